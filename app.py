@@ -1,14 +1,35 @@
 import os
 import io
+import sys
 import base64
+import hashlib
+import hmac
+import shutil
+import tempfile
 import time
 import uuid
 import csv
-from typing import Dict, Tuple
+import json
+import atexit
+import contextlib
+import cProfile
+import pstats
+import zipfile
+import tracemalloc
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
 import threading
 import queue
+import collections
+import copy
+import itertools
+import multiprocessing
+import multiprocessing.util
+import subprocess
+import signal
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, g, request, jsonify, render_template, send_from_directory, stream_with_context
 # 惰性导入YOLO，避免服务启动阶段因缺少依赖而失败
 try:
     from ultralytics import YOLO  # 如果存在则直接使用
@@ -16,16 +37,145 @@ except Exception:
     YOLO = None
 import numpy as np
 import cv2
+# 仅用于读取图像头部尺寸（Ultralytics 已依赖 Pillow）
+try:
+    from PIL import Image as PILImage
+except Exception:
+    PILImage = None
+
+import benchmark
+import detections
+import metrics
+import model_index
+import preprocess
+import result_store
+import tiling
+import union_area
 
 # Flask app
 app = Flask(__name__, template_folder=os.path.join(os.path.dirname(__file__), 'templates'))
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 单请求最大50MB
+# 队列微批调度：单批最多合并的任务数、凑批最长等待时间（毫秒）
+app.config['BATCH_MAX_SIZE'] = int(os.environ.get('BATCH_MAX_SIZE', 8))
+app.config['BATCH_MAX_WAIT_MS'] = float(os.environ.get('BATCH_MAX_WAIT_MS', 20))
+# 推理worker池：worker数量、模式（thread/process）、每个worker的torch线程数（0为按核数均分）、是否绑核
+app.config['WORKER_COUNT'] = int(os.environ.get('WORKER_COUNT', 1))
+app.config['WORKER_MODE'] = os.environ.get('WORKER_MODE', 'thread')
+app.config['TORCH_THREADS_PER_WORKER'] = int(os.environ.get('TORCH_THREADS_PER_WORKER', 0))
+app.config['WORKER_CPU_PINNING'] = os.environ.get('WORKER_CPU_PINNING', '0') == '1'
+# 预fork多进程服务（serve.py）：服务进程数；DEFER_BACKGROUND=1 时导入不启动worker池与调度线程，由 serve.py 在fork后逐进程启动
+app.config['SERVE_PROCESSES'] = max(1, int(os.environ.get('SERVE_PROCESSES', 1)))
+app.config['DEFER_BACKGROUND'] = os.environ.get('DEFER_BACKGROUND', '0') == '1'
+# 模型缓存：内存预算（MB，0为不限）、启动时预加载并预热的模型（逗号分隔）、预热推理尺寸
+app.config['MODEL_MEMORY_BUDGET_MB'] = float(os.environ.get('MODEL_MEMORY_BUDGET_MB', 2048))
+app.config['MODEL_PRELOAD'] = [k.strip() for k in os.environ.get('MODEL_PRELOAD', '').split(',') if k.strip()]
+app.config['MODEL_WARMUP_IMGSZ'] = int(os.environ.get('MODEL_WARMUP_IMGSZ', 640))
+# 模型索引：后台检查 runs/ 变化的间隔（秒）；是否用 watchdog 监听 runs/（需安装 watchdog）
+app.config['MODEL_INDEX_REFRESH_SECONDS'] = float(os.environ.get('MODEL_INDEX_REFRESH_SECONDS', 30))
+app.config['MODEL_INDEX_WATCH'] = os.environ.get('MODEL_INDEX_WATCH', '1') == '1'
+# 推理后端：torch（Ultralytics/PyTorch）或 onnx（导出ONNX后用onnxruntime推理）
+# MODEL_BACKENDS 为按模型指定的后端，例如 "yolo11n.pt=onnx,runs/rust_seg_v2/weights/best.pt=onnx"
+app.config['INFERENCE_BACKEND'] = os.environ.get('INFERENCE_BACKEND', 'torch')
+app.config['MODEL_BACKENDS'] = dict(
+    item.split('=', 1) for item in os.environ.get('MODEL_BACKENDS', '').split(',') if '=' in item
+)
+# 在线预处理（preprocess.py 的融合实现，输出与离线脚本逐像素一致）：可选配置 "名称=路径,..."（相对项目目录）、
+# 默认配置（空为不预处理）、按模型指定的配置，例如 "runs/rust_seg_v2/weights/best.pt=default"
+app.config['PREPROCESS_CONFIGS'] = dict(
+    item.split('=', 1) for item in os.environ.get('PREPROCESS_CONFIGS', 'default=preprocess_config.yaml').split(',')
+    if '=' in item
+)
+app.config['PREPROCESS_DEFAULT'] = os.environ.get('PREPROCESS_DEFAULT', '')
+app.config['MODEL_PREPROCESS'] = dict(
+    item.split('=', 1) for item in os.environ.get('MODEL_PREPROCESS', '').split(',') if '=' in item
+)
+# 检测结果缓存（按图像内容+权重+参数寻址）：是否启用、内存层与磁盘层容量（MB）
+app.config['RESULT_CACHE_ENABLED'] = os.environ.get('RESULT_CACHE_ENABLED', '1') == '1'
+app.config['RESULT_CACHE_MEMORY_MB'] = float(os.environ.get('RESULT_CACHE_MEMORY_MB', 256))
+app.config['RESULT_CACHE_DISK_MB'] = float(os.environ.get('RESULT_CACHE_DISK_MB', 2048))
+# 结果落盘（原图/标注图/CSV）：sync 同步写；async 后台写（默认）；fsync 后台写且每批落盘后 fsync
+# PERSIST_FLUSH_INTERVAL 为后台写入攒批的最长间隔（秒），PERSIST_QUEUE_SIZE 为待写队列上限（满时退化为同步写）
+app.config['PERSIST_MODE'] = os.environ.get('PERSIST_MODE', 'async')
+app.config['PERSIST_FLUSH_INTERVAL'] = float(os.environ.get('PERSIST_FLUSH_INTERVAL', 0.5))
+app.config['PERSIST_QUEUE_SIZE'] = int(os.environ.get('PERSIST_QUEUE_SIZE', 256))
+# 检测记录写入 SQLite（web_data/results.db）；RESULTS_CSV_MIRROR=1 时同时追加旧版 results.csv
+app.config['RESULTS_CSV_MIRROR'] = os.environ.get('RESULTS_CSV_MIRROR', '0') == '1'
+# 掩膜多边形面积统计的栅格化像素上限（外接矩形超过时缩小绘制，0为始终按原分辨率）
+app.config['AREA_RASTER_MAX_PIXELS'] = int(os.environ.get('AREA_RASTER_MAX_PIXELS', union_area.DEFAULT_MAX_PIXELS))
+# 响应中标注图的默认返回方式（请求可用 image_mode/image_format/image_quality/image_max_side 覆盖）
+# inline 内嵌base64；url 返回 /outputs/... 地址；none 只返回指标
+app.config['RESPONSE_IMAGE_MODE'] = os.environ.get('RESPONSE_IMAGE_MODE', 'inline')
+app.config['RESPONSE_IMAGE_FORMAT'] = os.environ.get('RESPONSE_IMAGE_FORMAT', 'png')
+app.config['RESPONSE_IMAGE_QUALITY'] = int(os.environ.get('RESPONSE_IMAGE_QUALITY', 85))
+app.config['RESPONSE_IMAGE_MAX_SIDE'] = int(os.environ.get('RESPONSE_IMAGE_MAX_SIDE', 0))
+# /render 落盘缓存的缩放尺寸（最长边，逗号分隔）；其余 max_side 或非默认 quality 的变体只渲染返回、不落盘
+app.config['RENDER_CACHE_SIDES'] = tuple(
+    int(v) for v in os.environ.get('RENDER_CACHE_SIDES', '320,640,1280').split(',') if v.strip().isdigit()
+)
+# /outputs 静态文件的浏览器缓存时长（秒）；文件名含随机id，内容不会变化
+app.config['OUTPUT_CACHE_MAX_AGE'] = int(os.environ.get('OUTPUT_CACHE_MAX_AGE', 7 * 24 * 3600))
+# 结构化检测结果中多边形的简化容差（像素）
+app.config['DETECTION_POLY_EPSILON'] = float(os.environ.get('DETECTION_POLY_EPSILON', detections.DEFAULT_POLY_EPSILON))
+# 上传文件分块写盘的块大小（字节）；DECODE_REDUCED=1 时，远大于 imgsz 的 JPEG 按 1/2、1/4、1/8 缩小解码
+# TRACE_MEMORY=1 时用 tracemalloc 统计每批推理的 Python/numpy 内存峰值并写入结果（有额外开销）
+app.config['UPLOAD_CHUNK_SIZE'] = int(os.environ.get('UPLOAD_CHUNK_SIZE', 1024 * 1024))
+app.config['DECODE_REDUCED'] = os.environ.get('DECODE_REDUCED', '1') == '1'
+app.config['TRACE_MEMORY'] = os.environ.get('TRACE_MEMORY', '0') == '1'
+# /detect/batch：单请求最大体积（MB）、最多图片数、zip 解压后总大小上限（MB）
+app.config['BATCH_MAX_CONTENT_MB'] = float(os.environ.get('BATCH_MAX_CONTENT_MB', 2048))
+app.config['BATCH_MAX_FILES'] = int(os.environ.get('BATCH_MAX_FILES', 1000))
+app.config['BATCH_MAX_UNZIPPED_MB'] = float(os.environ.get('BATCH_MAX_UNZIPPED_MB', 4096))
+# 视频/帧序列巡检：默认抽帧间隔、近重复帧差阈值（缩略灰度图平均绝对差，0为不跳过）、
+# 连续复用上一帧结果的最大次数、同时处理的视频数
+app.config['VIDEO_FRAME_STRIDE'] = int(os.environ.get('VIDEO_FRAME_STRIDE', 5))
+app.config['VIDEO_DIFF_THRESHOLD'] = float(os.environ.get('VIDEO_DIFF_THRESHOLD', 2.0))
+app.config['VIDEO_MAX_REUSE'] = int(os.environ.get('VIDEO_MAX_REUSE', 30))
+app.config['VIDEO_MAX_CONCURRENT'] = int(os.environ.get('VIDEO_MAX_CONCURRENT', 1))
+# 视频任务准入：排队+运行中的视频任务总数上限、单个用户上限（0为不限）；超出时返回 429
+app.config['VIDEO_MAX_PENDING'] = int(os.environ.get('VIDEO_MAX_PENDING', 4))
+app.config['VIDEO_MAX_PER_USER'] = int(os.environ.get('VIDEO_MAX_PER_USER', 1))
+# 任务状态存储：已结束任务的保留时长（小时）、内存上限（MB）、结果超过该大小（KB）时只保存在磁盘
+app.config['JOB_TTL_HOURS'] = float(os.environ.get('JOB_TTL_HOURS', 24))
+app.config['JOB_STORE_MEMORY_MB'] = float(os.environ.get('JOB_STORE_MEMORY_MB', 64))
+app.config['JOB_SPILL_KB'] = float(os.environ.get('JOB_SPILL_KB', 64))
+# 单请求剖析（/detect?profile=1 或 profile=cprofile）：是否允许、访问口令（请求头 X-Profile-Token，
+# 为空则不校验）、cProfile 摘要行数、保留的 cProfile 文件数
+app.config['PROFILE_ENABLED'] = os.environ.get('PROFILE_ENABLED', '0') == '1'
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN', '')
+app.config['PROFILE_TOP'] = int(os.environ.get('PROFILE_TOP', 30))
+app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 50))
+# Prometheus 指标：是否开放 /metrics 及记录请求耗时
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+# 推理队列准入：总容量、单个用户最多排队任务数（0为不限）；队列满时返回 429
+app.config['QUEUE_MAX_SIZE'] = int(os.environ.get('QUEUE_MAX_SIZE', 100))
+app.config['QUEUE_MAX_PER_USER'] = int(os.environ.get('QUEUE_MAX_PER_USER', 50))
+# 同步 /detect 等待结果的最长秒数（0为不限）；超时返回 504，任务仍会完成并写入结果缓存
+app.config['DETECT_TIMEOUT'] = float(os.environ.get('DETECT_TIMEOUT', 120))
+# 任务进度推送（SSE）：单个连接最多订阅的任务数、连接最长保持秒数（到期后浏览器自动重连）、
+# 心跳间隔秒数、排队位置的刷新间隔秒数
+app.config['JOB_EVENTS_MAX_IDS'] = int(os.environ.get('JOB_EVENTS_MAX_IDS', 1000))
+app.config['JOB_EVENTS_TIMEOUT'] = float(os.environ.get('JOB_EVENTS_TIMEOUT', 600))
+app.config['JOB_EVENTS_HEARTBEAT'] = float(os.environ.get('JOB_EVENTS_HEARTBEAT', 15))
+app.config['JOB_EVENTS_POSITION_INTERVAL'] = float(os.environ.get('JOB_EVENTS_POSITION_INTERVAL', 2))
+# 切片推理（高分辨率图像）：默认切片边长（0为关闭，请求可用 tile_size/tile_overlap 覆盖）、重叠比例、
+# 每次 predict 的切片数、跨切片合并阈值（交集占较小框的比例）
+app.config['TILE_SIZE'] = int(os.environ.get('TILE_SIZE', 0))
+app.config['TILE_OVERLAP'] = float(os.environ.get('TILE_OVERLAP', 0.2))
+app.config['TILE_BATCH_SIZE'] = int(os.environ.get('TILE_BATCH_SIZE', 8))
+app.config['TILE_MATCH_THRESHOLD'] = float(os.environ.get('TILE_MATCH_THRESHOLD', 0.6))
 
-# Model cache to avoid reloading every request
-_loaded_models: Dict[str, object] = {}
+# Model cache to avoid reloading every request（按最近使用排序，超出内存预算时淘汰最久未用）
+_loaded_models: "collections.OrderedDict[str, object]" = collections.OrderedDict()
+_model_info: Dict[str, Dict] = {}
+_loaded_models_lock = threading.Lock()
+_model_load_locks: Dict[str, threading.Lock] = {}
+_model_setup_lock = threading.Lock()
+_weights_hashes: Dict[str, Tuple[float, int, str]] = {}
+_onnx_exports: Dict[Tuple[str, str, int], Tuple[str, str]] = {}
+_thread_state = threading.local()
+# 等待任务完成通知的队列（/detect/batch 流式返回用），job_id -> queue.Queue
 _jobs_lock = threading.Lock()
-_jobs: Dict[str, Dict] = {}
-_job_queue: "queue.Queue" = queue.Queue(maxsize=100)
+_job_listeners: Dict[str, "queue.Queue"] = {}
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_FILES = {
@@ -33,20 +183,9 @@ MODEL_FILES = {
     'yolo11n.pt': os.path.join(BASE_DIR, 'yolo11n.pt'),
 }
 
-# 发现runs目录中的自定义训练权重（best.pt）
-def discover_models() -> Dict[str, str]:
-    discovered: Dict[str, str] = {}
-    runs_dir = os.path.join(BASE_DIR, 'runs')
-    if os.path.isdir(runs_dir):
-        for root, dirs, files in os.walk(runs_dir):
-            # 仅关注weights目录中的best.pt
-            if os.path.basename(root) == 'weights' and 'best.pt' in files:
-                rel = os.path.relpath(os.path.join(root, 'best.pt'), BASE_DIR)
-                key = rel.replace('\\', '/')  # 统一为/分隔，便于前端使用
-                discovered[key] = os.path.join(BASE_DIR, rel)
-    return discovered
-# 初始化时合并发现的模型
-MODEL_FILES.update(discover_models())
+# weights目录中可直接选用的权重：训练得到的best.pt，以及 train.py --quantize_int8 发布的INT8模型
+DISCOVERABLE_WEIGHTS = ('best.pt', 'best_int8.onnx')
+
 
 # Web data directories for saving uploads and outputs
 WEB_DATA_DIR = os.path.join(BASE_DIR, 'web_data')
@@ -54,27 +193,81 @@ UPLOAD_DIR = os.path.join(WEB_DATA_DIR, 'uploads')
 OUTPUT_DIR = os.path.join(WEB_DATA_DIR, 'outputs')
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+CACHE_DIR = os.path.join(WEB_DATA_DIR, 'cache')
+DETECTIONS_DIR = os.path.join(WEB_DATA_DIR, 'detections')
+VIDEOS_DIR = os.path.join(WEB_DATA_DIR, 'videos')
+JOBS_DIR = os.path.join(WEB_DATA_DIR, 'jobs')
+PROFILES_DIR = os.path.join(WEB_DATA_DIR, 'profiles')
+RESULTS_DB_PATH = os.path.join(WEB_DATA_DIR, 'results.db')
+
+# 模型索引：增量发现runs目录中的自定义训练权重（best.pt / best_int8.onnx），并缓存每个权重文件的元数据
+_model_index = model_index.ModelIndex(
+    BASE_DIR,
+    os.path.join(WEB_DATA_DIR, 'model_index.json'),
+    MODEL_FILES,
+    DISCOVERABLE_WEIGHTS,
+    refresh_seconds=app.config['MODEL_INDEX_REFRESH_SECONDS'],
+    on_error=lambda path, e: app.logger.warning('模型索引读取失败 %s: %s', path, e),
+)
+# 启动时同步扫描一次（只发现权重，不起线程）；元数据在首次刷新时由后台线程读取
+_model_index.refresh(metadata=False)
+
+
+def discover_models() -> Dict[str, str]:
+    """Known weights (key -> path) from the model index; starts a background refresh when one is due."""
+    _model_index.maybe_refresh()
+    return _model_index.paths()
+
+
+# 初始化时合并发现的模型
+MODEL_FILES.update(_model_index.paths())
+# /models 的响应条目，随索引版本重建
+_models_response: Dict = {'version': None, 'items': []}
+# 模型元数据中返回给前端的字段
+MODEL_META_FIELDS = ('task', 'names', 'nc', 'imgsz', 'sha256', 'size', 'trained_at', 'error')
+
+
+def _model_display_name(key: str) -> str:
+    display = key
+    if key.endswith('best.pt'):
+        display = f"{key} (最佳权重)"
+    elif key.endswith('best_int8.onnx'):
+        display = f"{key} (INT8量化)"
+    elif key.endswith('yolo11s.pt'):
+        display = 'yolo11s.pt (基础模型)'
+    elif key.endswith('yolo11n.pt'):
+        display = 'yolo11n.pt (基础模型)'
+    return display
+
 
 # 提供模型列表给前端动态加载
 @app.route('/models', methods=['GET'])
 def list_models():
-    # 每次请求时也尝试刷新一次，防止运行期间新增权重
-    MODEL_FILES.update(discover_models())
-    items = []
-    for key, path in MODEL_FILES.items():
-        display = key
-        if key.endswith('best.pt'):
-            display = f"{key} (最佳权重)"
-        elif key.endswith('yolo11s.pt'):
-            display = 'yolo11s.pt (基础模型)'
-        elif key.endswith('yolo11n.pt'):
-            display = 'yolo11n.pt (基础模型)'
-        items.append({'key': key, 'path': path, 'name': display})
-    return jsonify({'success': True, 'models': items})
-
-
-def _get_model(model_key: str):
-    """Get or load a YOLO model by key or path (lazy import)."""
+    """Models with their indexed metadata (task det/seg, class names, imgsz, weights hash, size).
+
+    Answers from the in-memory model index; a changed runs/ tree is picked up by a
+    background refresh, or synchronously with ?refresh=1.
+    """
+    global _models_response
+    if request.args.get('refresh') == '1':
+        _model_index.refresh()
+    else:
+        _model_index.maybe_refresh()
+    cached = _models_response
+    if cached['version'] != _model_index.version:
+        MODEL_FILES.update(_model_index.paths())
+        items = []
+        for entry in _model_index.entries():
+            item = {'key': entry['key'], 'path': entry['path'], 'name': _model_display_name(entry['key'])}
+            item.update({field: entry.get(field) for field in MODEL_META_FIELDS})
+            item['modified'] = entry.get('mtime')
+            items.append(item)
+        cached = _models_response = {'version': _model_index.version, 'items': items}
+    return jsonify({'success': True, 'models': cached['items']})
+
+
+def _resolve_model_path(model_key: str) -> str:
+    """Map a model key or path to an existing weights file."""
     # 如果传入的是存在的路径（相对或绝对），直接使用
     candidate_path = model_key
     if not os.path.isabs(candidate_path):
@@ -86,46 +279,414 @@ def _get_model(model_key: str):
 
     if model_path is None or not os.path.exists(model_path):
         raise FileNotFoundError(f"模型文件不存在: {model_key}")
+    return model_path
+
+
+def _estimate_model_bytes(model, model_path: str) -> int:
+    """Approximate resident size of a loaded model (parameters + buffers)."""
+    net = getattr(model, 'model', None)
+    try:
+        total = sum(t.numel() * t.element_size() for t in itertools.chain(net.parameters(), net.buffers()))
+        if total:
+            return int(total)
+    except Exception:
+        pass
+    return os.path.getsize(model_path)
+
+
+def _evict_models(keep: str) -> None:
+    """Drop least recently used models until the registry fits the memory budget."""
+    budget = app.config['MODEL_MEMORY_BUDGET_MB'] * 1024 * 1024
+    if budget <= 0:
+        return
+    with _loaded_models_lock:
+        used = sum(info['bytes'] for info in _model_info.values())
+        for path in list(_loaded_models.keys()):
+            if used <= budget:
+                break
+            if path == keep:
+                continue
+            _loaded_models.pop(path, None)
+            used -= _model_info.pop(path, {}).get('bytes', 0)
+
+
+INFERENCE_BACKENDS = ('torch', 'onnx')
 
+
+def _resolve_backend(model_key: str, requested: Optional[str] = None) -> str:
+    """Pick the backend for a request: explicit request > per-model config > server default."""
+    if model_key.endswith('.onnx'):
+        # 已是ONNX模型（如INT8量化发布的best_int8.onnx），只能由onnxruntime执行
+        return 'onnx'
+    backend = (requested or app.config['MODEL_BACKENDS'].get(model_key) or app.config['INFERENCE_BACKEND']).lower()
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"不支持的推理后端: {backend}（可选: {', '.join(INFERENCE_BACKENDS)}）")
+    return backend
+
+
+def _yolo_cls():
     # 惰性导入YOLO
     if YOLO is None:
         from ultralytics import YOLO as _YOLO
-        model_cls = _YOLO
+        return _YOLO
+    return YOLO
+
+
+def _weights_hash(model_path: str) -> str:
+    """SHA-256 of a weights file, cached until its mtime or size changes."""
+    st = os.stat(model_path)
+    cached = _weights_hashes.get(model_path)
+    if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+        return cached[2]
+    h = hashlib.sha256()
+    with open(model_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _weights_hashes[model_path] = (st.st_mtime, st.st_size, digest)
+    return digest
+
+
+def _ensure_onnx_export(model_path: str, imgsz: int) -> Tuple[str, str]:
+    """Export weights to ONNX once and cache the file next to them.
+
+    The cached file is named <stem>.<weights hash>.<imgsz>.<task>.onnx, so a
+    retrained best.pt or a different imgsz gets its own export. Returns the
+    ONNX path and the Ultralytics task (detect/segment/...).
+    """
+    digest = _weights_hash(model_path)[:16]
+    cache_key = (model_path, digest, imgsz)
+    cached = _onnx_exports.get(cache_key)
+    if cached and os.path.exists(cached[0]):
+        return cached
+
+    weights_dir = os.path.dirname(model_path)
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    prefix = f'{stem}.{digest}.{imgsz}.'
+    with _loaded_models_lock:
+        export_lock = _model_load_locks.setdefault(f'onnx-export:{model_path}', threading.Lock())
+    with export_lock:
+        for name in os.listdir(weights_dir):
+            if name.startswith(prefix) and name.endswith('.onnx'):
+                found = (os.path.join(weights_dir, name), name[len(prefix):-len('.onnx')])
+                _onnx_exports[cache_key] = found
+                return found
+        try:
+            import onnxruntime  # noqa: F401
+        except Exception:
+            raise RuntimeError('ONNX 后端需要安装 onnx 与 onnxruntime: pip install onnx onnxruntime')
+        # 在临时目录中导出，避免多个进程同时写同名的 <stem>.onnx
+        with tempfile.TemporaryDirectory(dir=weights_dir) as tmp:
+            tmp_weights = os.path.join(tmp, os.path.basename(model_path))
+            shutil.copy2(model_path, tmp_weights)
+            exporter = _yolo_cls()(tmp_weights)
+            exported = exporter.export(format='onnx', imgsz=imgsz, dynamic=True, verbose=False)
+            task = exporter.task
+            target = os.path.join(weights_dir, f'{prefix}{task}.onnx')
+            os.replace(exported, target)
+    _onnx_exports[cache_key] = (target, task)
+    return target, task
+
+
+def _onnx_task(onnx_path: str) -> Optional[str]:
+    """Ultralytics task stored in an exported ONNX file's metadata."""
+    try:
+        import onnxruntime
+        session = onnxruntime.InferenceSession(onnx_path, providers=['CPUExecutionProvider'])
+        return session.get_modelmeta().custom_metadata_map.get('task')
+    except Exception:
+        return None
+
+
+def _get_model(model_key: str, backend: str = 'torch', imgsz: int = 640):
+    """Get or load a YOLO model by key or path (lazy import).
+
+    Each weights file is loaded exactly once per process, even when several
+    request/worker threads ask for it at the same time. With the onnx backend
+    the cached ONNX export for `imgsz` is loaded instead of the .pt file.
+    """
+    model_path = _resolve_model_path(model_key)
+    task = None
+    if backend == 'onnx' and not model_path.endswith('.onnx'):
+        model_path, task = _ensure_onnx_export(model_path, imgsz)
+    with _loaded_models_lock:
+        model = _loaded_models.get(model_path)
+        if model is not None:
+            _loaded_models.move_to_end(model_path)
+            _model_info[model_path]['last_used'] = time.time()
+            return model
+        load_lock = _model_load_locks.setdefault(model_path, threading.Lock())
+
+    with load_lock:
+        model = _loaded_models.get(model_path)
+        if model is None:
+            t0 = time.perf_counter()
+            if model_path.endswith('.onnx') and task is None:
+                # 读取任务类型要建一次推理会话，只在真正加载时做
+                task = _onnx_task(model_path)
+            model = _yolo_cls()(model_path, task=task) if task else _yolo_cls()(model_path)
+            load_seconds = time.perf_counter() - t0
+            with _loaded_models_lock:
+                _loaded_models[model_path] = model
+                _model_info[model_path] = {
+                    'key': model_key,
+                    'backend': backend,
+                    'bytes': _estimate_model_bytes(model, model_path),
+                    'load_seconds': load_seconds,
+                    'loaded_at': time.time(),
+                    'last_used': time.time(),
+                }
+            _evict_models(keep=model_path)
+    return model
+
+
+def _get_thread_model(model_key: str, backend: str = 'torch', imgsz: int = 640) -> Dict:
+    """Per-thread view of a shared model.
+
+    Ultralytics keeps predictor state on the model object, so concurrent
+    predict() calls on one instance are unsafe. Each worker thread gets a
+    shallow copy with its own predictor that shares the loaded weights.
+    """
+    model = _get_model(model_key, backend, imgsz)
+    views = getattr(_thread_state, 'model_views', None)
+    if views is None:
+        views = _thread_state.model_views = {}
+    # 丢弃已被淘汰模型的视图，使其权重可以被回收
+    with _loaded_models_lock:
+        live = {id(m) for m in _loaded_models.values()}
+    for stale in [k for k in views if k not in live and k != id(model)]:
+        del views[stale]
+    entry = views.get(id(model))
+    if entry is None or entry['base'] is not model:
+        view = copy.copy(model)
+        view.predictor = None
+        entry = views[id(model)] = {'base': model, 'model': view, 'warm': False}
+    return entry
+
+
+# 标注图可选编码格式：扩展名与MIME类型
+IMAGE_FORMATS = {
+    'png': ('.png', 'image/png'),
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+}
+IMAGE_MODES = ('inline', 'url', 'none')
+
+
+def _encode_image(img_bgr: np.ndarray, fmt: str = 'png', quality: int = 85) -> bytes:
+    """Encode BGR image to PNG/JPEG/WebP bytes (quality applies to JPEG/WebP)."""
+    ext = IMAGE_FORMATS[fmt][0]
+    if fmt == 'jpeg':
+        flags = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    elif fmt == 'webp':
+        flags = [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
     else:
-        model_cls = YOLO
+        flags = []
+    success, buffer = cv2.imencode(ext, img_bgr, flags)
+    if not success:
+        raise RuntimeError(f'图像编码为{fmt.upper()}失败')
+    return buffer.tobytes()
+
 
-    if model_path not in _loaded_models:
-        _loaded_models[model_path] = model_cls(model_path)
-    return _loaded_models[model_path]
+def _encode_png(img_bgr: np.ndarray) -> bytes:
+    """Encode BGR image to PNG bytes."""
+    return _encode_image(img_bgr, 'png')
+
+
+def _fit_max_side(img_bgr: np.ndarray, max_side: int) -> np.ndarray:
+    """Downscale so the longer side is at most max_side (0 keeps the original size)."""
+    h, w = img_bgr.shape[:2]
+    if max_side <= 0 or max(h, w) <= max_side:
+        return img_bgr
+    scale = max_side / float(max(h, w))
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    return cv2.resize(img_bgr, size, interpolation=cv2.INTER_AREA)
 
 
 def _encode_image_to_base64(img_bgr: np.ndarray) -> str:
     """Encode BGR image to PNG base64 string."""
-    success, buffer = cv2.imencode('.png', img_bgr)
-    if not success:
-        raise RuntimeError('图像编码为PNG失败')
-    return base64.b64encode(buffer.tobytes()).decode('utf-8')
+    return base64.b64encode(_encode_png(img_bgr)).decode('utf-8')
+
+
+RESULTS_CSV_HEADER = result_store.COLUMNS
+
+
+class _PersistWriter:
+    """Write-behind persistence for uploads, annotated images and detection records.
+
+    Requests enqueue ('bytes', path, data), ('image', path, (img, fmt, quality)),
+    ('db', path, row) or ('csv', path, row) items and return immediately; a
+    background thread drains the bounded queue in batches (encoding 'image'
+    items there), inserting all pending records in one transaction. When the
+    queue is full the item is written synchronously so nothing is dropped.
+    """
+
+    MAX_BATCH = 512
+
+    def __init__(self, maxsize: int):
+        self._queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._csv_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db_conns: Dict[str, object] = {}
+        # 已入队但尚未落盘的文件路径 -> 待写次数
+        self._pending_paths: Dict[str, int] = {}
+        self._pending_lock = threading.Lock()
+        self.stats = {'written': 0, 'failed': 0, 'sync_fallbacks': 0}
+
+    def _ensure_started(self) -> None:
+        # 惰性启动：worker子进程在第一次写入时启动自己的写线程
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='persist-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, kind: str, path: str, payload) -> None:
+        item = (kind, path, payload)
+        if kind in ('bytes', 'image'):
+            with self._pending_lock:
+                self._pending_paths[path] = self._pending_paths.get(path, 0) + 1
+        if app.config['PERSIST_MODE'] == 'sync':
+            self._write_batch([item])
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.stats['sync_fallbacks'] += 1
+            self._write_batch([item])
+
+    def pending(self) -> int:
+        return self._queue.qsize()
 
-# 新增：计算检测框并集覆盖的面积比例，避免重叠重复累计
+    def wait_for(self, path: str, timeout: float) -> bool:
+        """Wait until a submitted file is on disk; also covers files written by worker processes."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._pending_lock:
+                pending = path in self._pending_paths
+            if not pending and os.path.exists(path):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.02)
+
+    def _done_path(self, path: str) -> None:
+        with self._pending_lock:
+            left = self._pending_paths.get(path, 0) - 1
+            if left > 0:
+                self._pending_paths[path] = left
+            else:
+                self._pending_paths.pop(path, None)
+
+    def flush(self) -> None:
+        """Block until everything queued so far is on disk."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + app.config['PERSIST_FLUSH_INTERVAL']
+            while len(batch) < self.MAX_BATCH:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception:
+                # 写线程不能退出，否则之后的结果都不会落盘
+                app.logger.exception('后台写盘批次失败（%d 项）', len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch: List[Tuple[str, str, object]]) -> None:
+        do_fsync = app.config['PERSIST_MODE'] == 'fsync'
+        csv_rows: Dict[str, List] = collections.defaultdict(list)
+        db_rows: Dict[str, List] = collections.defaultdict(list)
+        file_seconds: Dict[str, float] = collections.defaultdict(float)
+        for kind, path, payload in batch:
+            if kind == 'csv':
+                csv_rows[path].append(payload)
+                continue
+            if kind == 'db':
+                db_rows[path].append(payload)
+                continue
+            t0 = time.perf_counter()
+            try:
+                if kind == 'image':
+                    img_bgr, fmt, quality = payload
+                    payload = _encode_image(img_bgr, fmt, quality)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # 先写临时文件再改名，/outputs 不会读到写了一半的图
+                tmp = f'{path}.tmp'
+                with open(tmp, 'wb') as f_out:
+                    f_out.write(payload)
+                    if do_fsync:
+                        f_out.flush()
+                        os.fsync(f_out.fileno())
+                os.replace(tmp, path)
+                self.stats['written'] += 1
+            except Exception as e:
+                # 编码失败（cv2.error）、负载格式错误等都只影响这一项
+                self.stats['failed'] += 1
+                app.logger.warning('结果文件写入失败 %s: %s', path, e)
+            finally:
+                self._done_path(path)
+                file_seconds[kind] += time.perf_counter() - t0
+        for kind, seconds in file_seconds.items():
+            _persist_seconds.observe(seconds, kind=kind)
+        for csv_path, rows in csv_rows.items():
+            t0 = time.perf_counter()
+            try:
+                with self._csv_lock:
+                    write_header = not os.path.exists(csv_path)
+                    with open(csv_path, 'a', newline='', encoding='utf-8') as csvfile:
+                        writer = csv.writer(csvfile)
+                        if write_header:
+                            writer.writerow(RESULTS_CSV_HEADER)
+                        writer.writerows(rows)
+                        if do_fsync:
+                            csvfile.flush()
+                            os.fsync(csvfile.fileno())
+                self.stats['written'] += len(rows)
+            except Exception as e:
+                self.stats['failed'] += len(rows)
+                app.logger.warning('CSV写入失败 %s: %s', csv_path, e)
+            _persist_seconds.observe(time.perf_counter() - t0, kind='csv')
+        for db_path, rows in db_rows.items():
+            t0 = time.perf_counter()
+            try:
+                # 写线程与同步回退可能并发，单连接写入需串行
+                with self._db_lock:
+                    conn = self._db_conns.get(db_path)
+                    if conn is None:
+                        conn = self._db_conns[db_path] = result_store.connect(db_path, durable=do_fsync)
+                    result_store.insert_rows(conn, rows)
+                self.stats['written'] += len(rows)
+            except Exception as e:
+                self.stats['failed'] += len(rows)
+                app.logger.warning('检测记录写入失败 %s: %s', db_path, e)
+            _persist_seconds.observe(time.perf_counter() - t0, kind='db')
+
+
+_persist = _PersistWriter(app.config['PERSIST_QUEUE_SIZE'])
+atexit.register(_persist.flush)
+
+# 新增：计算检测框并集覆盖的面积比例，避免重叠重复累计（坐标压缩，不分配整幅掩膜）
 def _compute_union_area_ratio(xyxy: np.ndarray, img_shape: Tuple[int, int]) -> float:
-    h, w = img_shape
     if xyxy is None or xyxy.size == 0:
         return 0.0
-    mask = np.zeros((h, w), dtype=np.uint8)
-    for x1, y1, x2, y2 in xyxy:
-        x1i = max(0, min(int(np.floor(x1)), w - 1))
-        y1i = max(0, min(int(np.floor(y1)), h - 1))
-        x2i = max(0, min(int(np.ceil(x2)), w))
-        y2i = max(0, min(int(np.ceil(y2)), h))
-        if x2i <= x1i or y2i <= y1i:
-            continue
-        mask[y1i:y2i, x1i:x2i] = 255
-    covered = int((mask > 0).sum())
-    return min(1.0, float(covered) / float(max(1, w * h)))
+    return union_area.box_union_area_ratio(xyxy, img_shape)
 
 # 新增：计算分割掩膜的并集覆盖面积比例（仅在结果包含 masks 时使用）
 def _compute_union_mask_area_ratio(result, img_shape: Tuple[int, int]) -> float:
-    h, w = img_shape
     masks_obj = getattr(result, 'masks', None)
     if masks_obj is None:
         return 0.0
@@ -133,43 +694,19 @@ def _compute_union_mask_area_ratio(result, img_shape: Tuple[int, int]) -> float:
     # 优先使用多边形坐标（通常已缩放到原图尺寸），更精确
     xy_list = getattr(masks_obj, 'xy', None)
     if xy_list:
-        mask_union = np.zeros((h, w), dtype=np.uint8)
         try:
-            for pts in xy_list:
-                if pts is None or len(pts) == 0:
-                    continue
-                # pts 形状 (N, 2)，单位像素坐标
-                poly = np.array(pts, dtype=np.int32)
-                # 边界裁剪
-                poly[:, 0] = np.clip(poly[:, 0], 0, w - 1)
-                poly[:, 1] = np.clip(poly[:, 1], 0, h - 1)
-                cv2.fillPoly(mask_union, [poly], 255)
+            return union_area.polygon_union_area_ratio(xy_list, img_shape, app.config['AREA_RASTER_MAX_PIXELS'])
         except Exception:
             # 回退到栅格掩膜
-            xy_list = None
-
-        if xy_list:
-            covered = int((mask_union > 0).sum())
-            return min(1.0, float(covered) / float(max(1, w * h)))
+            pass
 
-    # 回退：使用栅格掩膜数据并缩放到原图尺寸
+    # 回退：在掩膜原生分辨率上求并集，再解析地换算到原图尺寸
     data = getattr(masks_obj, 'data', None)
     if data is None:
         return 0.0
     try:
         masks_np = data.detach().cpu().numpy() if hasattr(data, 'detach') else np.array(data)
-        if masks_np.ndim != 3 or masks_np.shape[0] == 0:
-            return 0.0
-        # 阈值化（有的版本为概率掩膜）
-        union_small = (masks_np > 0.5).any(axis=0).astype(np.uint8)  # (mh, mw)
-        mh, mw = union_small.shape[:2]
-        if mh != h or mw != w:
-            # 缩放到原图尺寸
-            union = cv2.resize(union_small, (w, h), interpolation=cv2.INTER_NEAREST)
-        else:
-            union = union_small
-        covered = int((union > 0).sum())
-        return min(1.0, float(covered) / float(max(1, w * h)))
+        return union_area.mask_union_area_ratio(masks_np, img_shape)
     except Exception:
         return 0.0
     
@@ -202,94 +739,242 @@ def _compute_stats(result, img_shape: Tuple[int, int]) -> Dict:
     }
 
 
-def _process_image_bytes(file_bytes: bytes, filename: str, model_key: str, conf: float, iou: float, imgsz: int, max_det: int):
-    # 解码
-    safe_name = os.path.basename(filename or '未命名图像')
+def _decode_image(file_bytes: bytes) -> np.ndarray:
+    """Decode uploaded bytes into a BGR image."""
     nparr = np.frombuffer(file_bytes, np.uint8)
     img_bgr = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
     if img_bgr is None:
         raise RuntimeError('图像解码失败，文件格式可能不支持')
-    h, w = img_bgr.shape[:2]
+    return img_bgr
+
+
+_REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def _jpeg_size(path: str) -> Optional[Tuple[int, int]]:
+    """(h, w) from the JPEG header without decoding pixels; None for other formats."""
+    if PILImage is None:
+        return None
+    try:
+        with PILImage.open(path) as im:
+            return (im.height, im.width) if im.format == 'JPEG' else None
+    except Exception:
+        return None
+
+
+def _decode_file(path: str, imgsz: int = 0) -> Tuple[np.ndarray, Tuple[int, int], int]:
+    """Decode an image file into BGR; returns (image, original (h, w), reduction factor).
+
+    When imgsz > 0 and the file is a JPEG whose longer side is still >= imgsz at 1/2, 1/4
+    or 1/8 scale, libjpeg decodes directly at that scale: the model letterboxes to imgsz
+    anyway, so full resolution would only cost memory.
+    """
+    size = _jpeg_size(path) if imgsz > 0 and app.config['DECODE_REDUCED'] else None
+    factor, flag = 1, cv2.IMREAD_COLOR
+    if size is not None:
+        for f, f_flag in _REDUCED_DECODE_FLAGS:
+            if max(size) // f >= imgsz:
+                factor, flag = f, f_flag
+                break
+    # np.fromfile + imdecode：兼容 Windows 下的中文路径
+    img_bgr = cv2.imdecode(np.fromfile(path, dtype=np.uint8), flag)
+    if img_bgr is None:
+        raise RuntimeError('图像解码失败，文件格式可能不支持')
+    if factor == 1:
+        return img_bgr, img_bgr.shape[:2], 1
+    h, w = size
+    # EXIF 方向会在解码时旋转图像，头部尺寸是旋转前的
+    if (img_bgr.shape[0] > img_bgr.shape[1]) != (h > w):
+        h, w = w, h
+    return img_bgr, (h, w), factor
+
+
+def _save_upload(stream, filename: str) -> Dict:
+    """Stream an upload (any object with read(n)) to web_data/uploads in chunks while hashing it.
+
+    Jobs carry the returned path and digest instead of the file bytes.
+    """
+    safe_name = os.path.basename(filename or '未命名图像')
+    detection_id = f"{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}"
+    path = os.path.join(UPLOAD_DIR, f'{detection_id}_{safe_name}')
+    digest = hashlib.sha256()
+    size = 0
+    chunk_size = app.config['UPLOAD_CHUNK_SIZE']
+    tmp = f'{path}.part'
+    with open(tmp, 'wb') as f_out:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            f_out.write(chunk)
+            size += len(chunk)
+        if app.config['PERSIST_MODE'] == 'fsync':
+            f_out.flush()
+            os.fsync(f_out.fileno())
+    os.replace(tmp, path)
+    return {'detection_id': detection_id, 'file_path': path, 'file_sha256': digest.hexdigest(), 'file_size': size}
+
+
+def _discard_upload(job: Dict) -> None:
+    """Remove an upload that produced no detection record (cache hit or failure)."""
+    try:
+        os.remove(job['file_path'])
+    except (KeyError, OSError):
+        pass
 
-    # 模型
-    model = _get_model(model_key)
 
-    # 预测（Ultralytics使用RGB）
-    img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
-    results = model.predict(source=img_rgb, conf=conf, iou=iou, imgsz=imgsz, max_det=max_det, verbose=False)
-    if not results:
+def _predict_batch(model_key: str, imgs_bgr: List[np.ndarray], conf: float, iou: float, imgsz: int, max_det: int,
+                   backend: str = 'torch') -> List:
+    """Run one batched predict call; returns one Ultralytics result per input image."""
+    entry = _get_thread_model(model_key, backend, imgsz)
+    model = entry['model']
+    # 预测：Ultralytics 对 numpy 输入按 BGR 处理（与 cv2 一致），直接传入，不再复制转换
+    source = imgs_bgr[0] if len(imgs_bgr) == 1 else imgs_bgr
+    if entry['warm']:
+        results = model.predict(source=source, conf=conf, iou=iou, imgsz=imgsz, max_det=max_det, verbose=False)
+    else:
+        # 首次推理会就地融合Conv+BN，多个线程共享权重时需串行完成
+        with _model_setup_lock:
+            results = model.predict(source=source, conf=conf, iou=iou, imgsz=imgsz, max_det=max_det, verbose=False)
+        entry['warm'] = True
+    if not results or len(results) != len(imgs_bgr):
         raise RuntimeError('模型未返回检测结果')
-    res = results[0]
-
-    # 可视化
-    annotated_rgb = res.plot()
-    annotated_bgr = cv2.cvtColor(annotated_rgb, cv2.COLOR_RGB2BGR)
-    img_base64 = _encode_image_to_base64(annotated_bgr)
-
-    # 指标
-    stats = _compute_stats(res, (h, w))
-
-    # 保存到磁盘
-    ts = time.strftime('%Y%m%d-%H%M%S')
-    uid = uuid.uuid4().hex[:8]
-    name_no_ext, ext = os.path.splitext(safe_name)
-    saved_original = os.path.join(UPLOAD_DIR, f'{ts}_{uid}_{safe_name}')
-    with open(saved_original, 'wb') as f_out:
-        f_out.write(file_bytes)
-
-    def _model_dir_name(model_key: str) -> str:
-        key_norm = model_key.replace('\\', '/').strip()
-        rel = key_norm
+    return list(results)
+
+
+def _predict_tiled(model_key: str, img_bgr: np.ndarray, conf: float, iou: float, imgsz: int, max_det: int,
+                   backend: str, tile_size: int, tile_overlap: float) -> tiling.TiledResult:
+    """Slice a large image into overlapping tiles, predict them in batches and merge across tiles."""
+    h, w = img_bgr.shape[:2]
+    windows = tiling.tile_windows(h, w, tile_size, tile_overlap)
+    step = max(1, app.config['TILE_BATCH_SIZE'])
+    parts = []
+    for i in range(0, len(windows), step):
+        chunk = windows[i:i + step]
+        tiles = [np.ascontiguousarray(img_bgr[y1:y2, x1:x2]) for x1, y1, x2, y2 in chunk]
+        parts.extend(zip(chunk, _predict_batch(model_key, tiles, conf, iou, imgsz, max_det, backend)))
+    return tiling.merge(img_bgr, parts, iou, app.config['TILE_MATCH_THRESHOLD'], max_det)
+
+
+class _StageRecorder:
+    """Per-job stage timings; with trace_memory also Python/numpy memory per stage (tracemalloc)."""
+
+    def __init__(self, trace_memory: bool = False):
+        self.seconds: Dict[str, float] = {}
+        self.memory: Dict[str, Dict[str, float]] = {}
+        self.trace_memory = trace_memory and tracemalloc.is_tracing()
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            start_mem = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
         try:
-            if os.path.isabs(model_key):
-                rel = os.path.relpath(model_key, BASE_DIR).replace('\\', '/')
-        except Exception:
-            pass
-        parts = rel.split('/')
-        if 'runs' in parts and rel.endswith('best.pt'):
-            try:
-                idx = parts.index('runs')
-                run_name = parts[idx + 1] if idx + 1 < len(parts) else None
-                if run_name:
-                    return run_name
-            except ValueError:
-                pass
-        stem = os.path.splitext(os.path.basename(rel))[0]
-        safe = ''.join(ch if ch.isalnum() or ch in ('-', '_', '.') else '_' for ch in stem)
-        return safe or 'model_outputs'
+            yield
+        finally:
+            # 同名阶段多次进入时累加
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - t0
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                prev = self.memory.get(name, {'peak_mb': 0.0, 'retained_mb': 0.0})
+                self.memory[name] = {
+                    'peak_mb': round(max(prev['peak_mb'], (peak - start_mem) / (1024 * 1024)), 3),
+                    'retained_mb': round(prev['retained_mb'] + (current - start_mem) / (1024 * 1024), 3),
+                }
+
+    def copy_stage(self, other: '_StageRecorder', name: str) -> None:
+        """Take over a stage measured once for the whole batch (predict)."""
+        if name in other.seconds:
+            self.seconds[name] = other.seconds[name]
+        if name in other.memory:
+            self.memory[name] = other.memory[name]
+
+
+def _build_result(filename: str, img_shape: Tuple[int, int], res, params: Dict,
+                  orig_shape: Optional[Tuple[int, int]] = None, stages: Optional[_StageRecorder] = None) -> Dict:
+    """Compute metrics, store structured detections and persist a single prediction result.
+
+    img_shape is the decoded size the result refers to; orig_shape the original image size
+    when it was decoded at reduced scale. The upload is already on disk at params['file_path'].
+    Only image_mode=inline draws the annotated image here; url/none defer it to /render/<id>.
+    The postprocess, plot, encode and persist stages are measured into `stages` when given.
+    """
+    stages = stages or _StageRecorder()
+    safe_name = os.path.basename(filename or '未命名图像')
+    h, w = img_shape
+    orig_h, orig_w = orig_shape or img_shape
+    scale = (orig_w / float(w), orig_h / float(h))
+    model_key, conf, iou, imgsz, max_det = (
+        params['model'], params['conf'], params['iou'], params['imgsz'], params['max_det'])
+
+    image_mode = params.get('image_mode', 'inline')
+    image_format = params.get('image_format', 'png')
+    quality = params.get('image_quality', app.config['RESPONSE_IMAGE_QUALITY'])
+    max_side = params.get('image_max_side', 0)
+    ext, mime = IMAGE_FORMATS[image_format]
+
+    # 指标与结构化检测结果
+    with stages.stage('postprocess'):
+        stats = _compute_stats(res, (h, w))
+        det = detections.extract(res, (orig_h, orig_w), app.config['DETECTION_POLY_EPSILON'], scale)
+
+    # 原图已在上传时流式写盘；其余结果后台写入，响应不等待磁盘I/O
+    detection_id = params['detection_id']
+    ts = detection_id[:15]
+    name_no_ext = os.path.splitext(safe_name)[0]
+    saved_original = params['file_path']
 
     model_subdir = _model_dir_name(model_key)
-    per_model_output_dir = os.path.join(OUTPUT_DIR, model_subdir)
-    os.makedirs(per_model_output_dir, exist_ok=True)
-    saved_output = os.path.join(per_model_output_dir, f'{ts}_{uid}_{name_no_ext}_detected.png')
-    cv2.imwrite(saved_output, annotated_bgr)
+    output_name = f'{detection_id}_{name_no_ext}_detected{ext}'
+    saved_output = os.path.join(OUTPUT_DIR, model_subdir, output_name)
     rel_original = os.path.relpath(saved_original, BASE_DIR)
     rel_output = os.path.relpath(saved_output, BASE_DIR)
 
-    # 写CSV
-    csv_path = os.path.join(WEB_DATA_DIR, 'results.csv')
-    write_header = not os.path.exists(csv_path)
-    try:
-        with open(csv_path, 'a', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            if write_header:
-                writer.writerow([
-                    'timestamp', 'original_filename', 'saved_original_path', 'saved_output_path',
-                    'width', 'height', 'count', 'area_ratio', 'avg_conf',
-                    'model', 'conf', 'iou', 'imgsz', 'max_det'
-                ])
-            writer.writerow([
-                ts, safe_name, rel_original, rel_output,
-                w, h, stats['count'], stats['area_ratio'], stats['avg_conf'],
-                model_key, conf, iou, imgsz, max_det
-            ])
-    except Exception:
-        pass
+    inline_bytes = None
+    if image_mode == 'inline':
+        # 可视化（BGR 输入的 plot() 直接返回 BGR；缩小解码时标注图为解码分辨率）
+        with stages.stage('plot'):
+            annotated_bgr = res.plot()
+        with stages.stage('encode'):
+            preview_bgr = _fit_max_side(annotated_bgr, max_side)
+            inline_bytes = _encode_image(preview_bgr, image_format, quality)
+        if preview_bgr is annotated_bgr:
+            # 内嵌图即原尺寸图，复用同一次编码结果
+            _persist.submit('bytes', saved_output, inline_bytes)
+        else:
+            _persist.submit('image', saved_output, (annotated_bgr, image_format, quality))
+    # url/none 模式不绘制：原尺寸标注图在首次访问 /render/<id> 时生成到 saved_output
 
-    return {
+    # 只是入队（写盘在后台线程，见 corrosion_persist_write_seconds）；队列满时包含同步写盘
+    with stages.stage('persist'):
+        _persist.submit('bytes', _detection_path(detection_id), detections.dumps({
+            **det,
+            'id': detection_id,
+            'filename': safe_name,
+            'model': model_key,
+            'original_path': rel_original,
+            'output_path': rel_output,
+            'image_format': image_format,
+            'image_quality': quality,
+        }))
+
+        # 写检测记录
+        record = [
+            ts, safe_name, rel_original, rel_output,
+            orig_w, orig_h, stats['count'], stats['area_ratio'], stats['avg_conf'],
+            model_key, conf, iou, imgsz, max_det
+        ]
+        _persist.submit('db', RESULTS_DB_PATH, record)
+        if app.config['RESULTS_CSV_MIRROR']:
+            _persist.submit('csv', os.path.join(WEB_DATA_DIR, 'results.csv'), record)
+
+    result = {
         'success': True,
         'filename': filename,
-        'image_base64': img_base64,
+        'detection_id': detection_id,
+        'image_mode': image_mode,
         'metrics': {
             '检测数量': stats['count'],
             '面积比例': stats['area_ratio'],
@@ -301,147 +986,2415 @@ def _process_image_bytes(file_bytes: bytes, filename: str, model_key: str, conf:
             'iou': iou,
             'imgsz': imgsz,
             'max_det': max_det,
+            'backend': params.get('backend', 'torch'),
+            'tile_size': params.get('tile_size', 0),
+            'tile_overlap': params.get('tile_overlap', 0.0),
+            'preprocess': params.get('preprocess'),
         },
         'saved': {
             'original_path': rel_original,
             'output_path': rel_output,
         }
     }
+    if isinstance(res, tiling.TiledResult):
+        result['tiles'] = res.tiles
+    if image_mode == 'inline':
+        with stages.stage('encode'):
+            result['image_base64'] = base64.b64encode(inline_bytes).decode('utf-8')
+        result['image_mime'] = mime
+    elif image_mode == 'url':
+        result['image_url'] = f'/render/{detection_id}' + (f'?max_side={max_side}' if max_side > 0 else '')
+        result['image_mime'] = mime
+    if image_mode != 'none':
+        # 结构化结果，前端可直接据此绘制
+        result['detections'] = det
+    return result
 
 
-def _queue_worker():
-    while True:
-        job = _job_queue.get()
-        if job is None:
-            _job_queue.task_done()
-            break
-        job_id = job['job_id']
-        with _jobs_lock:
-            _jobs[job_id] = {'status': 'running'}
-        try:
-            result = _process_image_bytes(
-                job['file_bytes'], job['filename'],
-                job['model'], job['conf'], job['iou'], job['imgsz'], job['max_det']
-            )
-            with _jobs_lock:
-                _jobs[job_id] = {'status': 'done', 'result': result}
-        except Exception as e:
-            with _jobs_lock:
-                _jobs[job_id] = {'status': 'error', 'message': str(e)}
-        finally:
-            _job_queue.task_done()
+def _detection_path(detection_id: str) -> str:
+    # 按日期分目录，避免单目录文件过多
+    return os.path.join(DETECTIONS_DIR, detection_id[:8], f'{detection_id}.json')
 
 
-# 启动后台worker线程
-_worker_thread = threading.Thread(target=_queue_worker, daemon=True)
-_worker_thread.start()
+# 预处理配置名 -> (文件 mtime, 配置, 配置摘要)
+_preprocess_configs: Dict[str, Tuple[float, Dict, str]] = {}
+_preprocess_lock = threading.Lock()
 
 
-@app.route('/', methods=['GET'])
-def index():
-    return render_template('index.html')
+def _resolve_preprocess(model_key: str, requested: Optional[str] = None) -> Optional[str]:
+    """Pick the preprocess config name: explicit request > per-model config > server default; None for off."""
+    if requested is None:
+        requested = app.config['MODEL_PREPROCESS'].get(model_key, app.config['PREPROCESS_DEFAULT'])
+    name = requested.strip()
+    if name.lower() in ('', 'none'):
+        return None
+    if name not in app.config['PREPROCESS_CONFIGS']:
+        available = ', '.join(app.config['PREPROCESS_CONFIGS']) or '无'
+        raise ValueError(f"未知的预处理配置: {name}（可选: {available}，或 none）")
+    return name
 
 
-def _model_dir_name(model_key: str) -> str:
-    """Derive a folder name for outputs based on the selected model.
-    - If model is a runs/*/weights/best.pt path, use the run directory name.
-    - Else use the basename without extension.
+def _preprocess_config(name: str) -> Tuple[Dict, str]:
+    """Load a named preprocess config (merged with the script defaults), reloaded when the file changes.
+
+    Returns (config, digest of its content); the digest is part of the result cache key.
     """
-    key_norm = model_key.replace('\\', '/').strip()
-    # If absolute path, try to make it relative to BASE_DIR for parsing
-    rel = key_norm
+    path = app.config['PREPROCESS_CONFIGS'][name]
+    if not os.path.isabs(path):
+        path = os.path.join(BASE_DIR, path)
     try:
-        if os.path.isabs(model_key):
-            rel = os.path.relpath(model_key, BASE_DIR).replace('\\', '/')
-    except Exception:
-        pass
-    parts = rel.split('/')
-    if 'runs' in parts and rel.endswith('best.pt'):
-        # runs/<run_name>/weights/best.pt -> <run_name>
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        raise ValueError(f"预处理配置文件不存在: {app.config['PREPROCESS_CONFIGS'][name]}")
+    with _preprocess_lock:
+        cached = _preprocess_configs.get(name)
+        if cached is None or cached[0] != mtime:
+            cfg = preprocess.load_config(Path(path))
+            digest = hashlib.sha256(json.dumps(cfg, sort_keys=True).encode('utf-8')).hexdigest()
+            cached = _preprocess_configs[name] = (mtime, cfg, digest)
+    return cached[1], cached[2]
+
+
+def _parse_job_params(form) -> Dict:
+    """Read the detection parameters shared by /detect and /enqueue from form data."""
+    model_key = form.get('model', 'yolo11s.pt')
+    params = {
+        'model': model_key,
+        'conf': float(form.get('conf', 0.25)),
+        'iou': float(form.get('iou', 0.45)),
+        'imgsz': int(form.get('imgsz', 640)),
+        'max_det': int(form.get('max_det', 300)),
+        'backend': _resolve_backend(model_key, form.get('backend')),
+        'image_mode': form.get('image_mode', app.config['RESPONSE_IMAGE_MODE']).lower(),
+        'image_format': form.get('image_format', app.config['RESPONSE_IMAGE_FORMAT']).lower(),
+        'image_quality': int(form.get('image_quality', app.config['RESPONSE_IMAGE_QUALITY'])),
+        'image_max_side': int(form.get('image_max_side', app.config['RESPONSE_IMAGE_MAX_SIDE'])),
+        'tile_size': int(form.get('tile_size', app.config['TILE_SIZE'])),
+        'tile_overlap': float(form.get('tile_overlap', app.config['TILE_OVERLAP'])),
+        'preprocess': _resolve_preprocess(model_key, form.get('preprocess')),
+    }
+    # 配置内容变化时结果缓存随之失效
+    params['preprocess_digest'] = _preprocess_config(params['preprocess'])[1] if params['preprocess'] else None
+    if params['image_format'] == 'jpg':
+        params['image_format'] = 'jpeg'
+    if params['image_mode'] not in IMAGE_MODES:
+        raise ValueError(f"不支持的 image_mode: {params['image_mode']}（可选 {', '.join(IMAGE_MODES)}）")
+    if params['image_format'] not in IMAGE_FORMATS:
+        raise ValueError(f"不支持的 image_format: {params['image_format']}（可选 {', '.join(IMAGE_FORMATS)}）")
+    if not 1 <= params['image_quality'] <= 100:
+        raise ValueError('image_quality 取值范围为 1-100')
+    if params['tile_size'] < 0 or (0 < params['tile_size'] < 64):
+        raise ValueError('tile_size 须为 0（关闭）或不小于 64')
+    if not 0 <= params['tile_overlap'] < 0.9:
+        raise ValueError('tile_overlap 取值范围为 [0, 0.9)')
+    return params
+
+
+# 缓存格式版本：推理输入或结果结构变化时递增，使旧缓存失效
+RESULT_CACHE_VERSION = 3
+# 影响检测结果（含响应中标注图的形式）的参数，参与结果缓存键
+RESULT_CACHE_KEY_FIELDS = (
+    'model', 'backend', 'conf', 'iou', 'imgsz', 'max_det',
+    'image_mode', 'image_format', 'image_quality', 'image_max_side', 'tile_size', 'tile_overlap',
+    'preprocess', 'preprocess_digest',
+)
+
+
+def _result_cache_key(file_sha256: str, params: Dict) -> str:
+    """Content address of a detection: image bytes hash + weights hash + result-affecting params."""
+    weights = _weights_hash(_resolve_model_path(params['model']))
+    raw = json.dumps([
+        RESULT_CACHE_VERSION, file_sha256, weights,
+        [params.get(field) for field in RESULT_CACHE_KEY_FIELDS],
+    ])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class _ResultCache:
+    """Two-tier LRU cache of /detect results: in-memory dicts backed by JSON files on disk.
+
+    Both tiers are bounded in bytes; the disk tier survives restarts and
+    promotes hits back into memory. With shared=True (several forked serving
+    processes on one cache directory) a lookup missing from this process's disk
+    index still tries the file, and only the owner process (see take_ownership)
+    deletes files, enforcing the disk budget from periodic directory scans.
+    """
+
+    # 共享模式下属主进程扫描缓存目录、按预算淘汰的间隔（秒）
+    SWEEP_SECONDS = 30.0
+
+    def __init__(self, cache_dir: str, memory_bytes: int, disk_bytes: int, shared: bool = False):
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.shared = shared
+        # 非共享时本进程即属主
+        self._owner = not shared
+        self._sweeper: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._memory: "collections.OrderedDict[str, Tuple[Dict, int]]" = collections.OrderedDict()
+        self._memory_used = 0
+        self._disk: "collections.OrderedDict[str, int]" = collections.OrderedDict()
+        self._disk_used = 0
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        self._load_disk_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f'{key}.json')
+
+    def _scan_disk(self) -> List[Tuple[float, str, int]]:
+        """(mtime, key, size) of every cache file, oldest first."""
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for sub in os.scandir(self.cache_dir):
+                if not sub.is_dir():
+                    continue
+                for entry in os.scandir(sub.path):
+                    if entry.name.endswith('.json'):
+                        try:
+                            st = entry.stat()
+                        except OSError:
+                            # 扫描期间被其他进程淘汰
+                            continue
+                        entries.append((st.st_mtime, entry.name[:-len('.json')], st.st_size))
+        return sorted(entries)
+
+    def _load_disk_index(self) -> None:
+        for _, key, size in self._scan_disk():
+            self._disk[key] = size
+            self._disk_used += size
+
+    def _evict_disk(self) -> List[str]:
+        """Pop least recently used disk entries over budget (owner only); caller removes the files."""
+        evict = []
+        while self._owner and self._disk_used > self.disk_bytes and len(self._disk) > 1:
+            old_key, old_size = self._disk.popitem(last=False)
+            self._disk_used -= old_size
+            self.stats['evictions'] += 1
+            evict.append(old_key)
+        return evict
+
+    def _remove_files(self, keys: List[str]) -> None:
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def sweep(self) -> None:
+        """Rebuild the disk index from the directory (all processes' files) and enforce the budget."""
+        entries = self._scan_disk()
+        with self._lock:
+            self._disk = collections.OrderedDict((key, size) for _, key, size in entries)
+            self._disk_used = sum(size for _, _, size in entries)
+            evict = self._evict_disk()
+        self._remove_files(evict)
+
+    def take_ownership(self) -> None:
+        """Make this process the one that deletes cache files; in shared mode start the periodic sweep."""
+        self._owner = True
+        if not self.shared or (self._sweeper is not None and self._sweeper.is_alive()):
+            return
+
+        def _loop():
+            while True:
+                time.sleep(self.SWEEP_SECONDS)
+                try:
+                    self.sweep()
+                except Exception:
+                    app.logger.exception('结果缓存目录扫描失败')
+
+        self._sweeper = threading.Thread(target=_loop, name='cache-sweep', daemon=True)
+        self._sweeper.start()
+
+    def _remember(self, key: str, result: Dict, size: int) -> None:
+        if size > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old:
+            self._memory_used -= old[1]
+        self._memory[key] = (result, size)
+        self._memory_used += size
+        while self._memory_used > self.memory_bytes and self._memory:
+            _, (_, evicted) = self._memory.popitem(last=False)
+            self._memory_used -= evicted
+            self.stats['evictions'] += 1
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit is not None:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return hit[0]
+            # 共享模式下其他进程写入的条目不在本进程索引中，直接尝试读文件
+            on_disk = key in self._disk or self.shared
+        if on_disk:
+            try:
+                with open(self._path(key), 'r', encoding='utf-8') as f:
+                    raw = f.read()
+                result = json.loads(raw)
+                os.utime(self._path(key))
+            except (OSError, ValueError):
+                result = None
+            with self._lock:
+                if result is not None:
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    else:
+                        self._disk[key] = len(raw)
+                        self._disk_used += len(raw)
+                    self._remember(key, result, len(raw))
+                    self.stats['disk_hits'] += 1
+                    return result
+                self._disk_used -= self._disk.pop(key, 0)
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key: str, result: Dict) -> None:
+        raw = json.dumps(result, ensure_ascii=False)
+        size = len(raw)
+        with self._lock:
+            self._remember(key, result, size)
+            self.stats['stores'] += 1
+        if size > self.disk_bytes:
+            return
+        path = self._path(key)
         try:
-            idx = parts.index('runs')
-            run_name = parts[idx + 1] if idx + 1 < len(parts) else None
-            if run_name:
-                return run_name
-        except ValueError:
-            pass
-    # fallback to file stem
-    stem = os.path.splitext(os.path.basename(rel))[0]
-    # sanitize
-    safe = ''.join(ch if ch.isalnum() or ch in ('-', '_', '.') else '_' for ch in stem)
-    return safe or 'model_outputs'
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(raw)
+            os.replace(tmp, path)
+        except OSError:
+            return
+        with self._lock:
+            self._disk_used += size - self._disk.pop(key, 0)
+            self._disk[key] = size
+            evict = self._evict_disk()
+        self._remove_files(evict)
 
+    def snapshot(self) -> Dict:
+        with self._lock:
+            lookups = self.stats['memory_hits'] + self.stats['disk_hits'] + self.stats['misses']
+            hits = self.stats['memory_hits'] + self.stats['disk_hits']
+            return {
+                **self.stats,
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+                'memory_entries': len(self._memory),
+                'memory_mb': round(self._memory_used / (1024 * 1024), 2),
+                'disk_entries': len(self._disk),
+                'disk_mb': round(self._disk_used / (1024 * 1024), 2),
+            }
 
-@app.route('/detect', methods=['POST'])
-def detect():
-    try:
-        # Validate file
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'message': '未收到文件，请选择要检测的图像'}), 400
-        file = request.files['file']
-        filename = file.filename or '未命名图像'
-        file_bytes = file.read()
 
-        # Params
-        model_key = request.form.get('model', 'yolo11s.pt')
-        conf = float(request.form.get('conf', 0.25))
-        iou = float(request.form.get('iou', 0.45))
-        imgsz = int(request.form.get('imgsz', 640))
-        max_det = int(request.form.get('max_det', 300))
+_result_cache = _ResultCache(
+    CACHE_DIR,
+    int(app.config['RESULT_CACHE_MEMORY_MB'] * 1024 * 1024),
+    int(app.config['RESULT_CACHE_DISK_MB'] * 1024 * 1024),
+    shared=app.config['SERVE_PROCESSES'] > 1,
+)
 
-        result = _process_image_bytes(file_bytes, filename, model_key, conf, iou, imgsz, max_det)
-        return jsonify(result)
-    except FileNotFoundError as e:
-        return jsonify({'success': False, 'message': str(e)}), 400
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'检测失败: {str(e)}'}), 500
 
+def _cached_result(job: Dict) -> Optional[Dict]:
+    """Look up a finished result for this job; sets job['cache_key'] for the later store."""
+    if not app.config['RESULT_CACHE_ENABLED']:
+        return None
+    job['cache_key'] = _result_cache_key(job['file_sha256'], job)
+    cached = _result_cache.get(job['cache_key'])
+    if cached is None:
+        return None
+    return {**cached, 'filename': job['filename'], 'cached': True}
 
-@app.route('/enqueue', methods=['POST'])
-def enqueue():
-    try:
-        if 'file' not in request.files:
-            return jsonify({'success': False, 'message': '未收到文件，请选择要检测的图像'}), 400
-        file = request.files['file']
-        filename = file.filename or '未命名图像'
-        file_bytes = file.read()
 
-        model_key = request.form.get('model', 'yolo11s.pt')
-        conf = float(request.form.get('conf', 0.25))
-        iou = float(request.form.get('iou', 0.45))
-        imgsz = int(request.form.get('imgsz', 640))
-        max_det = int(request.form.get('max_det', 300))
+class _JobStore:
+    """Job status records with a TTL, a memory cap and disk spill.
 
-        job_id = uuid.uuid4().hex
-        with _jobs_lock:
-            _jobs[job_id] = {'status': 'queued'}
-        _job_queue.put({
-            'job_id': job_id,
-            'file_bytes': file_bytes,
-            'filename': filename,
-            'model': model_key,
-            'conf': conf,
-            'iou': iou,
-            'imgsz': imgsz,
-            'max_det': max_det,
-        })
-        return jsonify({'success': True, 'job_id': job_id})
-    except Exception as e:
-        return jsonify({'success': False, 'message': f'入队失败: {str(e)}'}), 500
+    queued/done/error states are also written to web_data/jobs/<id[:2]>/<id>.json, so
+    finished results survive restarts; results larger than spill_bytes are kept only on
+    disk and loaded when read. Jobs still queued by a previous process read back as
+    interrupted errors. With shared=True (several forked serving processes) running
+    states are written too and stamped with the owning pid, so any process can report
+    them and jobs of a dead process read back as interrupted. subscribe() returns a queue that receives (job_id, info) for
+    every later set() of the given jobs, which drives the /jobs/events stream.
+    """
 
+    FINISHED = ('done', 'error')
+    # 每隔多少秒清理一次过期任务
+    SWEEP_INTERVAL = 60.0
 
-@app.route('/jobs/<job_id>', methods=['GET'])
-def job_status(job_id: str):
-    with _jobs_lock:
-        info = _jobs.get(job_id)
-    if not info:
+    def __init__(self, jobs_dir: str, memory_bytes: int, ttl_seconds: float, spill_bytes: int,
+                 shared: bool = False):
+        self.jobs_dir = jobs_dir
+        self.shared = shared
+        self.memory_bytes = memory_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_bytes = spill_bytes
+        self.boot_id = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        # job_id -> (info 或 None（仅在磁盘）, 内存字节数, 更新时间)
+        self._memory: "collections.OrderedDict[str, Tuple[Optional[Dict], int, float]]" = collections.OrderedDict()
+        self._memory_used = 0
+        self._disk: "collections.OrderedDict[str, float]" = collections.OrderedDict()
+        self._next_sweep = 0.0
+        # job_id -> 订阅该任务状态变化的队列
+        self._subscribers: Dict[str, List["queue.Queue"]] = {}
+        self.stats = {'spilled': 0, 'disk_loads': 0, 'expired': 0, 'evicted': 0, 'interrupted': 0}
+        self._load_disk_index()
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, job_id[:2], f'{job_id}.json')
+
+    def _load_disk_index(self) -> None:
+        entries = []
+        if os.path.isdir(self.jobs_dir):
+            for sub in os.scandir(self.jobs_dir):
+                if not sub.is_dir():
+                    continue
+                for entry in os.scandir(sub.path):
+                    if entry.name.endswith('.json'):
+                        entries.append((entry.stat().st_mtime, entry.name[:-len('.json')]))
+        for mtime, job_id in sorted(entries):
+            self._disk[job_id] = mtime
+
+    def _write(self, job_id: str, info: Dict, raw: str) -> None:
+        path = self._path(job_id)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(raw)
+                if app.config['PERSIST_MODE'] == 'fsync':
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except OSError as e:
+            app.logger.warning('任务状态写入失败 %s: %s', path, e)
+            return
+        with self._lock:
+            self._disk.pop(job_id, None)
+            self._disk[job_id] = time.time()
+
+    def _read(self, job_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self.stats['disk_loads'] += 1
+        info = stored.get('info') or {}
+        if info.get('status') not in self.FINISHED and (
+                stored.get('boot_id') != self.boot_id or not self._owner_alive(stored.get('pid'))):
+            self.stats['interrupted'] += 1
+            return {'status': 'error', 'message': '服务已重启，任务未完成，请重新提交'}
+        return info
+
+    def _owner_alive(self, pid: Optional[int]) -> bool:
+        # 只在多进程服务（POSIX）下检查；同一 boot_id 下由已退出的服务进程留下的未完成任务视为中断
+        if not self.shared or not pid or pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass
+        return True
+
+    def set(self, job_id: str, info: Dict) -> None:
+        status = info.get('status')
+        raw = None
+        if status in self.FINISHED or status == 'queued' or self.shared:
+            raw = json.dumps({'boot_id': self.boot_id, 'pid': os.getpid(), 'info': info}, ensure_ascii=False)
+            self._write(job_id, info, raw)
+        size = len(raw) if raw is not None else 256
+        keep = info
+        if status in self.FINISHED and size > self.spill_bytes:
+            # 大结果只留在磁盘，读取时再加载
+            keep, size = None, 64
+            self.stats['spilled'] += 1
+        now = time.time()
+        with self._lock:
+            old = self._memory.pop(job_id, None)
+            if old:
+                self._memory_used -= old[1]
+            self._memory[job_id] = (keep, size, now)
+            self._memory_used += size
+            self._evict_memory()
+            subscribers = list(self._subscribers.get(job_id, ()))
+        for sub in subscribers:
+            sub.put((job_id, info))
+        self._maybe_sweep(now)
+
+    def subscribe(self, job_ids: Sequence[str], sub=None) -> "queue.Queue":
+        """Register sub (a new queue.Queue by default; anything with put()) for the jobs' updates."""
+        if sub is None:
+            sub = queue.Queue()
+        with self._lock:
+            for job_id in job_ids:
+                self._subscribers.setdefault(job_id, []).append(sub)
+        return sub
+
+    def unsubscribe(self, job_ids: Sequence[str], sub: "queue.Queue") -> None:
+        with self._lock:
+            for job_id in job_ids:
+                subs = self._subscribers.get(job_id)
+                if subs and sub in subs:
+                    subs.remove(sub)
+                    if not subs:
+                        del self._subscribers[job_id]
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            old = self._memory.pop(job_id, None)
+            if old:
+                self._memory_used -= old[1]
+            self._disk.pop(job_id, None)
+        try:
+            os.remove(self._path(job_id))
+        except OSError:
+            pass
+
+    def in_memory(self, job_id: str) -> bool:
+        """True when get() can answer without reading a file."""
+        with self._lock:
+            entry = self._memory.get(job_id)
+        return entry is not None and entry[0] is not None
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._memory.get(job_id)
+            on_disk = job_id in self._disk
+        if entry is not None and entry[0] is not None:
+            return entry[0]
+        if entry is None and not on_disk and not os.path.exists(self._path(job_id)):
+            return None
+        # 溢出到磁盘、被内存上限淘汰、上次运行留下或由其他进程写入的任务
+        return self._read(job_id)
+
+    def _evict_memory(self) -> None:
+        # 只淘汰已结束的任务（它们都在磁盘上）；排队/运行中的任务常驻内存
+        if self._memory_used <= self.memory_bytes:
+            return
+        for job_id in list(self._memory.keys()):
+            if self._memory_used <= self.memory_bytes:
+                break
+            info, size, _ = self._memory[job_id]
+            if info is None or info.get('status') in self.FINISHED:
+                del self._memory[job_id]
+                self._memory_used -= size
+                self.stats['evicted'] += 1
+
+    def _maybe_sweep(self, now: float) -> None:
+        if now < self._next_sweep or self.ttl_seconds <= 0:
+            return
+        self._next_sweep = now + self.SWEEP_INTERVAL
+        cutoff = now - self.ttl_seconds
+        expired = []
+        with self._lock:
+            for job_id in list(self._memory.keys()):
+                info, size, updated = self._memory[job_id]
+                if updated >= cutoff:
+                    break
+                if info is None or info.get('status') in self.FINISHED:
+                    del self._memory[job_id]
+                    self._memory_used -= size
+            while self._disk:
+                job_id, mtime = next(iter(self._disk.items()))
+                if mtime >= cutoff:
+                    break
+                self._disk.popitem(last=False)
+                if job_id not in self._memory:
+                    expired.append(job_id)
+        for job_id in expired:
+            try:
+                os.remove(self._path(job_id))
+            except OSError:
+                pass
+        self.stats['expired'] += len(expired)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            by_status: Dict[str, int] = collections.Counter(
+                (info.get('status') if info is not None else 'done_on_disk') for info, _, _ in self._memory.values()
+            )
+            return {
+                **self.stats,
+                'live_jobs': sum(by_status.get(s, 0) for s in ('queued', 'running')),
+                'memory_entries': len(self._memory),
+                'memory_by_status': dict(by_status),
+                'memory_mb': round(self._memory_used / (1024 * 1024), 3),
+                'disk_entries': len(self._disk),
+                'subscribed_jobs': len(self._subscribers),
+                'ttl_hours': round(self.ttl_seconds / 3600.0, 2),
+            }
+
+
+_job_store = _JobStore(
+    JOBS_DIR,
+    int(app.config['JOB_STORE_MEMORY_MB'] * 1024 * 1024),
+    app.config['JOB_TTL_HOURS'] * 3600.0,
+    int(app.config['JOB_SPILL_KB'] * 1024),
+    shared=app.config['SERVE_PROCESSES'] > 1,
+)
+
+
+def _batch_key(job: Dict) -> Tuple:
+    """Jobs sharing this key can be served by one predict call."""
+    return (job['model'], job['backend'], job['imgsz'], job['conf'], job['iou'], job['max_det'],
+            job.get('tile_size', 0), job.get('tile_overlap', 0.0),
+            # 剖析请求不与其他任务合批，计时与内存只属于这一张图
+            job['job_id'] if job.get('profile') else None)
+
+
+# 调度优先级：交互式 /detect 最先，其次 /enqueue，批量最后
+# （视频任务不进此队列：由 _video_admission 限流，帧推理直接提交到 worker 池）
+PRIORITIES = {'interactive': 0, 'normal': 1, 'bulk': 2}
+
+
+class _BatchScheduler:
+    """Job queue that hands out groups of compatible jobs for batched inference.
+
+    Jobs are kept per priority level and, within a level, per user; users are
+    served round-robin so one user's bulk upload cannot starve the others.
+    put() keeps queue.Queue semantics (blocking when full, raising queue.Full on
+    timeout or when block=False); a queue is full when it holds maxsize jobs or
+    the job's user already has per_user jobs waiting. get_batch() takes the next
+    job by priority and user turn, then keeps collecting jobs with the same
+    _batch_key (again round-robin over users) until max_size is reached or
+    max_wait expires.
+    """
+
+    def __init__(self, maxsize: int = 0, per_user: int = 0):
+        self.maxsize = maxsize
+        self.per_user = per_user
+        self._levels: List["collections.OrderedDict[str, Deque[Dict]]"] = [
+            collections.OrderedDict() for _ in PRIORITIES
+        ]
+        self._count = 0
+        self._user_counts: Dict[str, int] = collections.Counter()
+        self._cond = threading.Condition()
+        self._closed = False
+        # 每次入队/出队加一，用于判断排队位置是否需要重新计算
+        self.version = 0
+
+    def qsize(self) -> int:
+        with self._cond:
+            return self._count
+
+    def user_qsize(self, user: str) -> int:
+        with self._cond:
+            return self._user_counts.get(user, 0)
+
+    def full_reason(self, user: str) -> Optional[str]:
+        """'queue' or 'user' when a job from this user would not be admitted now."""
+        # Condition 默认使用可重入锁，put() 持锁时也可调用
+        with self._cond:
+            if self.maxsize > 0 and self._count >= self.maxsize:
+                return 'queue'
+            if self.per_user > 0 and self._user_counts.get(user, 0) >= self.per_user:
+                return 'user'
+            return None
+
+    def put(self, job: Dict, block: bool = True, timeout: Optional[float] = None) -> None:
+        user = job.get('user', '')
+        with self._cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self.full_reason(user):
+                if not block:
+                    raise queue.Full
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise queue.Full
+                self._cond.wait(remaining)
+            level = self._levels[job.get('priority', PRIORITIES['normal'])]
+            job.setdefault('enqueued_at', time.monotonic())
+            level.setdefault(user, collections.deque()).append(job)
+            self._count += 1
+            self._user_counts[user] += 1
+            self.version += 1
+            self._cond.notify_all()
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _taken(self, level, user: str, job: Dict) -> Dict:
+        if not level[user]:
+            del level[user]
+        else:
+            # 轮到下一个用户
+            level.move_to_end(user)
+        self._count -= 1
+        self.version += 1
+        self._user_counts[user] -= 1
+        if not self._user_counts[user]:
+            del self._user_counts[user]
+        return job
+
+    def _pop_next(self) -> Dict:
+        for level in self._levels:
+            if level:
+                user, jobs = next(iter(level.items()))
+                return self._taken(level, user, jobs.popleft())
+        raise IndexError('empty scheduler')
+
+    def _take_matching(self, key: Tuple, batch: List[Dict], max_size: int) -> None:
+        for level in self._levels:
+            progress = True
+            # 每轮每个用户最多取一个兼容任务
+            while progress and len(batch) < max_size:
+                progress = False
+                for user in list(level.keys()):
+                    if len(batch) >= max_size:
+                        return
+                    jobs = level[user]
+                    for i, job in enumerate(jobs):
+                        if _batch_key(job) == key:
+                            del jobs[i]
+                            batch.append(self._taken(level, user, job))
+                            progress = True
+                            break
+
+    def get_batch(self, max_size: int, max_wait: float) -> List[Dict]:
+        """Return up to max_size compatible jobs; an empty list means the scheduler is closed."""
+        max_size = max(1, max_size)
+        with self._cond:
+            while not self._count:
+                if self._closed:
+                    return []
+                self._cond.wait()
+            first = self._pop_next()
+            batch = [first]
+            key = _batch_key(first)
+            deadline = time.monotonic() + max(0.0, max_wait)
+            while len(batch) < max_size:
+                self._take_matching(key, batch, max_size)
+                remaining = deadline - time.monotonic()
+                if len(batch) >= max_size or remaining <= 0 or self._closed:
+                    break
+                self._cond.wait(remaining)
+            # 释放队列空位，唤醒阻塞中的put
+            self._cond.notify_all()
+            return batch
+
+    def positions(self, job_ids: Sequence[str]) -> Dict[str, int]:
+        """Number of jobs ahead of each given job that is still waiting.
+
+        Follows the priority levels and the user rotation of _pop_next; batching can pull
+        compatible jobs forward, so this is an estimate. Jobs not in the queue are omitted.
+        """
+        wanted = set(job_ids)
+        out: Dict[str, int] = {}
+        with self._cond:
+            ahead = 0
+            for level in self._levels:
+                lengths = [len(jobs) for jobs in level.values()]
+                for turn, jobs in enumerate(level.values()):
+                    for k, job in enumerate(jobs):
+                        if job['job_id'] not in wanted:
+                            continue
+                        # 第 k 轮轮到该任务；排在前面的用户本轮先取，后面的用户只算前 k 轮
+                        others = sum(min(n, k + 1 if i < turn else k) for i, n in enumerate(lengths) if i != turn)
+                        out[job['job_id']] = ahead + k + others
+                ahead += sum(lengths)
+        return out
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            return {
+                'queued': self._count,
+                'max_size': self.maxsize,
+                'max_per_user': self.per_user,
+                'by_priority': {name: sum(len(q) for q in self._levels[i].values()) for name, i in PRIORITIES.items()},
+                'users': len(self._user_counts),
+            }
+
+
+_job_queue = _BatchScheduler(maxsize=app.config['QUEUE_MAX_SIZE'], per_user=app.config['QUEUE_MAX_PER_USER'])
+# 最近完成任务的时间戳，用于估算吞吐量与 Retry-After
+_completions: Deque[float] = collections.deque(maxlen=256)
+
+
+# ---- Prometheus 指标（/metrics） ----
+_metrics = metrics.Registry()
+_stage_seconds = _metrics.histogram(
+    'corrosion_stage_seconds', 'Per-job time in each processing stage (decode, predict, postprocess, plot, encode, persist)',
+    ('stage', 'model', 'imgsz'))
+_queue_wait_seconds = _metrics.histogram(
+    'corrosion_queue_wait_seconds', 'Time a job waited in the scheduler before being batched', ('priority',))
+_job_seconds = _metrics.histogram(
+    'corrosion_job_seconds', 'Time from enqueue to stored result', ('model', 'imgsz', 'status'))
+_batch_size_hist = _metrics.histogram(
+    'corrosion_batch_size', 'Jobs per batched predict call', ('model', 'imgsz'), buckets=(1, 2, 4, 8, 16, 32, 64))
+_persist_seconds = _metrics.histogram(
+    'corrosion_persist_write_seconds', 'Background write time per batch of items of one kind', ('kind',))
+_http_seconds = _metrics.histogram(
+    'corrosion_http_request_seconds', 'Time to produce an HTTP response (streamed bodies excluded)',
+    ('route', 'method', 'status'))
+_jobs_total = _metrics.counter('corrosion_jobs_total', 'Finished inference jobs', ('status',))
+_metrics.callback(
+    'corrosion_queue_depth', 'Jobs waiting in the scheduler',
+    lambda: [({'priority': name}, n) for name, n in _job_queue.snapshot()['by_priority'].items()], ('priority',))
+_metrics.callback('corrosion_queue_users', 'Users with jobs waiting', lambda: _job_queue.snapshot()['users'])
+_metrics.callback('corrosion_persist_queue_depth', 'Items waiting for the background writer', lambda: _persist.pending())
+_metrics.callback(
+    'corrosion_persist_items_total', 'Background writer item counters', lambda: [
+        ({'event': k}, v) for k, v in _persist.stats.items()], ('event',), kind='counter')
+_metrics.callback(
+    'corrosion_result_cache_events_total', 'Result cache lookups and stores', lambda: [
+        ({'event': k}, _result_cache.stats[k]) for k in ('memory_hits', 'disk_hits', 'misses', 'stores', 'evictions')],
+    ('event',), kind='counter')
+_metrics.callback(
+    'corrosion_result_cache_bytes', 'Result cache occupancy', lambda: [
+        ({'tier': 'memory'}, _result_cache.snapshot()['memory_mb'] * 1024 * 1024),
+        ({'tier': 'disk'}, _result_cache.snapshot()['disk_mb'] * 1024 * 1024)], ('tier',))
+_metrics.callback(
+    'corrosion_job_store_events_total', 'Job store spill/load/expiry counters', lambda: [
+        ({'event': k}, v) for k, v in _job_store.stats.items()], ('event',), kind='counter')
+_metrics.callback('corrosion_live_jobs', 'Queued and running jobs', lambda: _job_store.snapshot()['live_jobs'])
+
+
+def _model_gauge(field: str, factor: float = 1.0):
+    def collect():
+        # 进程模式下模型在各worker进程中，取最近一次 /ready 或预热得到的快照
+        if app.config['WORKER_MODE'] == 'process':
+            workers = list(_ready_state['workers'].values())
+        else:
+            workers = [_registry_snapshot()]
+        return [({'model': m['key'], 'backend': m['backend'], 'pid': w['pid']}, m[field] * factor)
+                for w in workers for m in w['models']]
+    return collect
+
+
+_metrics.callback('corrosion_model_load_seconds', 'Time taken to load each resident model',
+                  _model_gauge('load_seconds'), ('model', 'backend', 'pid'))
+_metrics.callback('corrosion_model_memory_bytes', 'Estimated memory of each resident model',
+                  _model_gauge('memory_mb', 1024 * 1024), ('model', 'backend', 'pid'))
+
+
+def _observe_job(job: Dict, info: Dict, timings: Optional[Dict[str, float]], now: float) -> None:
+    labels = {'model': job['model'], 'imgsz': job['imgsz']}
+    _jobs_total.inc(status=info['status'])
+    if 'enqueued_at' in job:
+        _job_seconds.observe(now - job['enqueued_at'], status=info['status'], **labels)
+    for stage, seconds in (timings or {}).items():
+        _stage_seconds.observe(seconds, stage=stage, **labels)
+
+
+def _throughput() -> Optional[float]:
+    """Jobs per second completed over the last five minutes, None while unknown."""
+    now = time.monotonic()
+    recent = [t for t in list(_completions) if now - t <= 300]
+    if len(recent) < 2:
+        return None
+    return (len(recent) - 1) / max(recent[-1] - recent[0], 1e-3)
+
+
+def _retry_after(excess: int, users: int = 1) -> int:
+    """Seconds until `excess` queued jobs should have drained at the recent completion rate."""
+    rate = _throughput()
+    if rate is None:
+        return 5
+    # 按用户轮转调度时，单个用户只能分到 1/users 的吞吐
+    return int(min(300, max(1, np.ceil(excess * max(1, users) / rate))))
+
+
+def _queue_eta(position: int) -> Optional[float]:
+    """Estimated seconds until a job with `position` jobs ahead of it has finished."""
+    rate = _throughput()
+    if rate is None:
+        return None
+    return round((position + 1) / rate, 1)
+
+
+def _queue_full_body(user: str) -> Tuple[Dict, int]:
+    """429 body and Retry-After seconds for a job that was not admitted."""
+    reason = _job_queue.full_reason(user) or 'queue'
+    if reason == 'user':
+        excess = _job_queue.user_qsize(user) - _job_queue.per_user + 1
+        message = f'您已有 {_job_queue.user_qsize(user)} 个任务在排队，请稍后再提交'
+        retry = _retry_after(excess, _job_queue.snapshot()['users'])
+    else:
+        excess = _job_queue.qsize() - _job_queue.maxsize + 1
+        message = '检测队列已满，请稍后重试'
+        retry = _retry_after(excess)
+    return {'success': False, 'message': message, 'retry_after': retry}, retry
+
+
+def _queue_full_response(user: str):
+    body, retry = _queue_full_body(user)
+    resp = jsonify(body)
+    resp.headers['Retry-After'] = str(retry)
+    return resp, 429
+
+
+def _user_from(headers, remote_addr: Optional[str]) -> str:
+    """User identity for fair scheduling: X-User-Id from the Nuxt proxy, else the bearer token, else the client IP."""
+    user = headers.get('X-User-Id', '').strip()
+    if user:
+        return f'user:{user}'
+    auth = headers.get('Authorization', '')
+    if auth.lower().startswith('bearer ') and auth[7:].strip():
+        return 'token:' + hashlib.sha256(auth[7:].strip().encode('utf-8')).hexdigest()[:16]
+    return f'ip:{remote_addr}'
+
+
+def _request_user() -> str:
+    return _user_from(request.headers, request.remote_addr)
+
+
+# tracemalloc 是进程级的：同一时刻只允许一个批次开启/关闭它并重置峰值，其余批次不记录内存
+_memory_trace_lock = threading.Lock()
+_MEMORY_SCOPE_NOTE = 'tracemalloc 为进程级统计，包含同时运行的其他线程的分配'
+_MEMORY_BUSY_NOTE = '另一批次正在测量内存，本次未记录'
+
+
+def _execute_job_batch(batch: List[Dict]) -> List[Tuple[str, Dict]]:
+    """Decode, predict in one call and finalize every job of a compatible batch.
+
+    Returns (job_id, job_info) pairs instead of touching _jobs, so the same
+    function can run in a worker thread or in a worker process.
+    """
+    outcomes: List[Tuple[str, Dict]] = []
+    trace = app.config['TRACE_MEMORY']
+    profile_mode = next((job['profile'] for job in batch if job.get('profile')), None)
+    # 剖析请求单独成批（见 _batch_key），临时开启 tracemalloc 记录各阶段内存
+    measuring = (trace or bool(profile_mode)) and _memory_trace_lock.acquire(blocking=False)
+    started_tracing = False
+    peak_mb = None
+    if measuring:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            # TRACE_MEMORY=1 时保持开启，只关闭为剖析临时开启的
+            started_tracing = not trace
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    profiler = cProfile.Profile() if profile_mode == 'cprofile' else None
+    try:
+        if profiler is not None:
+            profiler.enable()
+        try:
+            _run_job_batch(batch, outcomes, measuring and bool(profile_mode))
+        finally:
+            if profiler is not None:
+                profiler.disable()
+    finally:
+        if measuring:
+            peak_mb = round((tracemalloc.get_traced_memory()[1] - base) / (1024 * 1024), 2)
+            if started_tracing:
+                tracemalloc.stop()
+            _memory_trace_lock.release()
+        for job in batch:
+            if not any(job_id == job['job_id'] and info['status'] == 'done' for job_id, info in outcomes):
+                _discard_upload(job)
+    if profiler is not None:
+        for _, info in outcomes:
+            if 'profile' in info:
+                info['profile']['cprofile'] = _dump_profile(profiler, info['result']['detection_id'])
+    if trace:
+        # 批内峰值（线程模式下并发批次会相互叠加，只作量级参考）
+        memory = {'peak_mb': peak_mb, 'note': _MEMORY_SCOPE_NOTE if measuring else _MEMORY_BUSY_NOTE}
+        for _, info in outcomes:
+            if info['status'] == 'done':
+                info['result']['memory'] = memory
+    return outcomes
+
+
+def _dump_profile(profiler: cProfile.Profile, detection_id: str) -> Dict:
+    """Save a cProfile dump under web_data/profiles and summarize its top functions."""
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    name = f'{detection_id}.prof'
+    profiler.dump_stats(os.path.join(PROFILES_DIR, name))
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(app.config['PROFILE_TOP'])
+    # 只保留最近的若干份
+    dumps = sorted((e for e in os.scandir(PROFILES_DIR) if e.name.endswith('.prof')), key=lambda e: e.stat().st_mtime)
+    for entry in dumps[:-max(1, app.config['PROFILE_KEEP'])]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+    return {'url': f'/profiles/{name}', 'path': os.path.relpath(os.path.join(PROFILES_DIR, name), BASE_DIR),
+            'top': out.getvalue().splitlines()}
+
+
+def _run_job_batch(batch: List[Dict], outcomes: List[Tuple[str, Dict]], trace_memory: bool = False) -> None:
+    """Fill outcomes for one batch; finished jobs carry per-stage seconds under 'timings'.
+
+    Jobs with a 'profile' flag also get a 'profile' entry: stage timings, per-stage
+    memory (when trace_memory, i.e. this batch holds the tracemalloc lock) and
+    Ultralytics' own preprocess/inference/postprocess split.
+    """
+    decoded = []
+    trace = trace_memory and tracemalloc.is_tracing()
+    stages = {job['job_id']: _StageRecorder(trace) for job in batch}
+    # 预处理后送入模型的图像；标注仍画在用户上传的原图上
+    originals: Dict[str, np.ndarray] = {}
+    preprocess_ms: Dict[str, Dict[str, float]] = {}
+    for job in batch:
+        try:
+            # 切片推理与预处理需要原分辨率（预处理与离线脚本一致地作用于整幅原图）；否则按 imgsz 缩小解码
+            imgsz = 0 if job.get('tile_size', 0) > 0 or job.get('preprocess') else job['imgsz']
+            with stages[job['job_id']].stage('decode'):
+                item = (job, *_decode_file(job['file_path'], imgsz))
+            if job.get('preprocess'):
+                cfg = _preprocess_config(job['preprocess'])[0]
+                timings: Dict[str, float] = {}
+                with stages[job['job_id']].stage('preprocess'):
+                    processed, _ = preprocess.preprocess_image_fast(item[1], cfg, timings)
+                originals[job['job_id']] = item[1]
+                preprocess_ms[job['job_id']] = timings
+                item = (job, processed, *item[2:])
+            decoded.append(item)
+        except Exception as e:
+            outcomes.append((job['job_id'], {'status': 'error', 'message': str(e)}))
+    if not decoded:
+        return
+
+    first = decoded[0][0]
+    batch_stages = _StageRecorder(trace)
+    try:
+        with batch_stages.stage('predict'):
+            if first.get('tile_size', 0) > 0:
+                # 切片推理：每张图的切片各自成批，合并后得到整图结果
+                results = [
+                    _predict_tiled(first['model'], img, first['conf'], first['iou'], first['imgsz'],
+                                   first['max_det'], first['backend'], first['tile_size'], first['tile_overlap'])
+                    for _, img, _, _ in decoded
+                ]
+            else:
+                results = _predict_batch(
+                    first['model'], [img for _, img, _, _ in decoded],
+                    first['conf'], first['iou'], first['imgsz'], first['max_det'], first['backend']
+                )
+    except FileNotFoundError as e:
+        outcomes.extend((job['job_id'], {'status': 'error', 'message': str(e), 'not_found': True})
+                        for job, _, _, _ in decoded)
+        return
+    except Exception as e:
+        outcomes.extend((job['job_id'], {'status': 'error', 'message': str(e)}) for job, _, _, _ in decoded)
+        return
+
+    for (job, img_bgr, orig_shape, factor), res in zip(decoded, results):
+        job_stages = stages[job['job_id']]
+        # 批内每个任务都要等整批 predict 完成，按整批耗时计入
+        job_stages.copy_stage(batch_stages, 'predict')
+        if job['job_id'] in originals:
+            res.orig_img = originals[job['job_id']]
+        try:
+            result = _build_result(job['filename'], img_bgr.shape[:2], res, job, orig_shape, job_stages)
+            result['batch_size'] = len(decoded)
+            result['decode'] = {'reduction': factor, 'decoded_size': [img_bgr.shape[1], img_bgr.shape[0]]}
+            if job['job_id'] in preprocess_ms:
+                result['preprocess'] = {'config': job['preprocess'], 'stages_ms': preprocess_ms[job['job_id']]}
+            info = {'status': 'done', 'result': result, 'timings': job_stages.seconds}
+            if job.get('profile'):
+                info['profile'] = {
+                    'stages_ms': {k: round(v * 1000.0, 3) for k, v in job_stages.seconds.items()},
+                    'memory_mb': job_stages.memory if trace else None,
+                    'memory_note': _MEMORY_SCOPE_NOTE if trace else _MEMORY_BUSY_NOTE,
+                    # Ultralytics 自带的单张图耗时拆分（切片推理时没有）
+                    'ultralytics_ms': getattr(res, 'speed', None),
+                    'batch_size': len(decoded),
+                }
+            outcomes.append((job['job_id'], info))
+        except Exception as e:
+            outcomes.append((job['job_id'], {'status': 'error', 'message': str(e)}))
+
+
+def _worker_cpu_set(index: int, threads: int) -> Optional[set]:
+    """CPUs reserved for worker `index` when pinning is enabled."""
+    if not app.config['WORKER_CPU_PINNING'] or not hasattr(os, 'sched_getaffinity'):
+        return None
+    cpus = sorted(os.sched_getaffinity(0))
+    start = (index * threads) % len(cpus)
+    return set(cpus[start:start + threads]) or None
+
+
+def _torch_threads_per_worker() -> int:
+    configured = app.config['TORCH_THREADS_PER_WORKER']
+    if configured > 0:
+        return configured
+    # 多进程服务时各服务进程的worker共同均分核数
+    workers = max(1, app.config['WORKER_COUNT']) * app.config['SERVE_PROCESSES']
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def _init_worker(index: int, threads: int) -> None:
+    """Limit torch intra-op threads and optionally pin the calling worker to its cores."""
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except Exception:
+        pass
+    cpus = _worker_cpu_set(index, threads)
+    if cpus:
+        try:
+            # pid 0 作用于当前线程/进程
+            os.sched_setaffinity(0, cpus)
+        except OSError:
+            pass
+
+
+_worker_index = itertools.count()
+
+
+def _init_worker_thread(threads: int) -> None:
+    _init_worker(next(_worker_index), threads)
+
+
+def _exit_worker_process(signum, frame) -> None:
+    raise SystemExit(0)
+
+
+def _init_worker_process(index_queue, threads: int) -> None:
+    # 推理子进程有自己的写盘队列；子进程经 multiprocessing 收尾退出，用 Finalize 在退出前刷完，
+    # SIGTERM 也转成 SystemExit 走同一条收尾路径
+    multiprocessing.util.Finalize(None, _persist.flush, exitpriority=10)
+    signal.signal(signal.SIGTERM, _exit_worker_process)
+    _init_worker(index_queue.get(), threads)
+
+
+def _create_executor():
+    count = max(1, app.config['WORKER_COUNT'])
+    threads = _torch_threads_per_worker()
+    if app.config['WORKER_MODE'] == 'process':
+        ctx = multiprocessing.get_context('spawn')
+        index_queue = ctx.Queue()
+        for i in range(count):
+            index_queue.put(i)
+        return ProcessPoolExecutor(max_workers=count, mp_context=ctx,
+                                   initializer=_init_worker_process, initargs=(index_queue, threads))
+    return ThreadPoolExecutor(max_workers=count, thread_name_prefix='infer',
+                              initializer=_init_worker_thread, initargs=(threads,))
+
+
+def _store_outcomes(batch: List[Dict], outcomes: List[Tuple[str, Dict]]) -> None:
+    jobs = {job['job_id']: job for job in batch}
+    cache_keys = {job['job_id']: job.get('cache_key') for job in batch}
+    ephemeral = {job['job_id'] for job in batch if job.get('ephemeral')}
+    with _jobs_lock:
+        listeners = {job_id: _job_listeners.pop(job_id, None) for job_id, _ in outcomes}
+    now = time.monotonic()
+    for job_id, info in outcomes:
+        _completions.append(now)
+        _observe_job(jobs[job_id], info, info.pop('timings', None), now)
+        profile = info.pop('profile', None)
+        notify = dict(info)
+        if profile is not None:
+            # 剖析结果只返回给发起请求的线程，不进入缓存与任务存储
+            job = jobs[job_id]
+            profile['queue_wait_ms'] = round((job['dispatched_at'] - job['enqueued_at']) * 1000.0, 3)
+            profile['worker_ms'] = round((now - job['dispatched_at']) * 1000.0, 3)
+            notify['result'] = {**info['result'], 'profile': profile}
+        info.pop('not_found', None)
+        # /detect 的任务由请求线程直接取结果，不写入任务存储
+        if job_id not in ephemeral:
+            _job_store.set(job_id, info)
+        if info['status'] == 'done' and cache_keys.get(job_id):
+            _result_cache.put(cache_keys[job_id], info['result'])
+        if listeners[job_id] is not None:
+            listeners[job_id].put((job_id, notify))
+
+
+def _on_batch_done(batch: List[Dict], future: Future) -> None:
+    _worker_slots.release()
+    try:
+        outcomes = future.result()
+    except Exception as e:
+        outcomes = [(job['job_id'], {'status': 'error', 'message': str(e)}) for job in batch]
+    _store_outcomes(batch, outcomes)
+
+
+def _queue_worker():
+    """Dispatcher: forms batches only when a pool worker is free, so batches grow under load."""
+    while True:
+        _worker_slots.acquire()
+        batch = _job_queue.get_batch(
+            app.config['BATCH_MAX_SIZE'], app.config['BATCH_MAX_WAIT_MS'] / 1000.0
+        )
+        if not batch:
+            _worker_slots.release()
+            break
+        now = time.monotonic()
+        _batch_size_hist.observe(len(batch), model=batch[0]['model'], imgsz=batch[0]['imgsz'])
+        priority_names = {v: k for k, v in PRIORITIES.items()}
+        for job in batch:
+            job['dispatched_at'] = now
+            _queue_wait_seconds.observe(now - job['enqueued_at'],
+                                        priority=priority_names[job.get('priority', PRIORITIES['normal'])])
+            if not job.get('ephemeral'):
+                _job_store.set(job['job_id'], {'status': 'running'})
+        future = _executor.submit(_execute_job_batch, batch)
+        future.add_done_callback(lambda f, b=batch: _on_batch_done(b, f))
+
+
+def _submit_inference(job: Dict, listener) -> None:
+    """Schedule a job at interactive priority; listener.put((job_id, info)) is called when it finishes.
+
+    Raises queue.Full when the job is not admitted.
+    """
+    job.update(priority=PRIORITIES['interactive'], ephemeral=True)
+    with _jobs_lock:
+        _job_listeners[job['job_id']] = listener
+    try:
+        _job_queue.put(job, block=False)
+    except queue.Full:
+        with _jobs_lock:
+            _job_listeners.pop(job['job_id'], None)
+        raise
+
+
+def _drop_listener(job_id: str) -> None:
+    """Stop waiting for a job (timeout or disconnect); the job itself still runs."""
+    with _jobs_lock:
+        _job_listeners.pop(job_id, None)
+
+
+def _detect_timeout_message() -> str:
+    return f"检测超时（{app.config['DETECT_TIMEOUT']:g} 秒），服务繁忙或推理进程异常，请稍后重试"
+
+
+def _run_inference(job: Dict) -> Dict:
+    """Schedule a job at interactive priority and wait for its result (used by /detect).
+
+    Raises queue.Full when the job is not admitted and TimeoutError after DETECT_TIMEOUT seconds.
+    """
+    done: "queue.Queue" = queue.Queue()
+    _submit_inference(job, done)
+    # 缓存写入由 _store_outcomes 完成
+    try:
+        _, info = done.get(timeout=app.config['DETECT_TIMEOUT'] or None)
+    except queue.Empty:
+        _drop_listener(job['job_id'])
+        raise TimeoutError(_detect_timeout_message())
+    return _inference_result(info)
+
+
+def _inference_result(info: Dict) -> Dict:
+    """The result of a finished interactive job, or the matching exception."""
+    if info['status'] == 'done':
+        return info['result']
+    if info.get('not_found'):
+        raise FileNotFoundError(info['message'])
+    raise RuntimeError(info['message'])
+
+
+_executor = None
+_worker_slots = threading.Semaphore(max(1, app.config['WORKER_COUNT']))
+_worker_thread = None
+
+
+# ---- 视频 / 帧序列巡检 ----
+
+# 近重复帧判定用的缩略图尺寸
+_VIDEO_THUMB_SIZE = (64, 36)
+
+
+def _video_infer_batch(model_key: str, backend: str, conf: float, iou: float, imgsz: int, max_det: int,
+                       frames: List[np.ndarray]) -> List[Dict]:
+    """Predict a batch of frames on a pool worker and return only their stats."""
+    results = _predict_batch(model_key, frames, conf, iou, imgsz, max_det, backend)
+    return [_compute_stats(res, frame.shape[:2]) for frame, res in zip(frames, results)]
+
+
+def _iter_video_frames(path: str, stride: int):
+    """Yield (frame_index, seconds or None, BGR frame) for every stride-th frame of a video or zip of frames."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            members = sorted(
+                (m for m in archive.infolist() if not m.is_dir() and m.filename.lower().endswith(BATCH_IMAGE_EXTENSIONS)),
+                key=lambda m: m.filename,
+            )
+            for index, member in enumerate(members):
+                if index % stride == 0:
+                    yield index, None, _decode_image(archive.read(member))
+        return
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError('视频解码失败，文件格式可能不支持')
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    index = 0
+    try:
+        while True:
+            if index % stride == 0:
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                yield index, (index / fps if fps > 0 else None), frame
+            elif not cap.grab():
+                # 非抽样帧只 grab 不 retrieve，省去颜色转换与拷贝
+                break
+            index += 1
+    finally:
+        cap.release()
+
+
+def _video_source_info(path: str) -> Dict:
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            total = sum(1 for m in archive.infolist()
+                        if not m.is_dir() and m.filename.lower().endswith(BATCH_IMAGE_EXTENSIONS))
+        return {'kind': 'frames', 'total_frames': total, 'fps': None}
+    cap = cv2.VideoCapture(path)
+    try:
+        return {'kind': 'video', 'total_frames': int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0),
+                'fps': cap.get(cv2.CAP_PROP_FPS) or None}
+    finally:
+        cap.release()
+
+
+def _video_decode_loop(job: Dict, out: "queue.Queue", stop: threading.Event) -> None:
+    """Decode thread: sample frames, drop near-duplicates, shrink to imgsz and feed the inference loop."""
+    imgsz = job['imgsz']
+    threshold = job['diff_threshold']
+    last_thumb = None
+    reused = 0
+
+    def put(item) -> None:
+        # 推理侧出错退出时不再阻塞在满队列上
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    try:
+        for index, seconds, frame in _iter_video_frames(job['file_path'], job['frame_stride']):
+            if stop.is_set():
+                break
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            thumb = cv2.resize(gray, _VIDEO_THUMB_SIZE, interpolation=cv2.INTER_AREA)
+            if (last_thumb is not None and threshold > 0 and reused < app.config['VIDEO_MAX_REUSE']
+                    and float(cv2.absdiff(thumb, last_thumb).mean()) < threshold):
+                reused += 1
+                put(('reuse', index, seconds, None))
+                continue
+            last_thumb, reused = thumb, 0
+            h, w = frame.shape[:2]
+            if max(h, w) > imgsz:
+                # 模型本就会缩放到 imgsz，提前缩小可减少跨进程传输与letterbox开销
+                s = imgsz / float(max(h, w))
+                frame = cv2.resize(frame, (max(1, round(w * s)), max(1, round(h * s))), interpolation=cv2.INTER_AREA)
+            put(('infer', index, seconds, frame))
+    except Exception as e:
+        put(('error', None, None, str(e)))
+    finally:
+        put(None)
+
+
+def _video_run_batch(job: Dict, items: List[Tuple], frames_out: List[Dict], last: List[Optional[Dict]]) -> None:
+    frames = [frame for kind, _, _, frame in items if kind == 'infer']
+    stats: List[Dict] = []
+    if frames:
+        # 与 /enqueue 的批次一样占用一个worker空位，避免长视频挤占交互请求
+        _worker_slots.acquire()
+        try:
+            stats = _executor.submit(
+                _video_infer_batch, job['model'], job['backend'], job['conf'], job['iou'],
+                job['imgsz'], job['max_det'], frames,
+            ).result()
+        finally:
+            _worker_slots.release()
+    it = iter(stats)
+    for kind, index, seconds, _ in items:
+        if kind == 'infer':
+            last[0] = next(it)
+            reused = False
+        else:
+            reused = True
+        entry = {'frame': index, 'time': round(seconds, 3) if seconds is not None else None,
+                 **last[0], 'reused': reused}
+        frames_out.append(entry)
+
+
+def _video_aggregate(frames: List[Dict], info: Dict, seconds: float) -> Dict:
+    counts = np.array([f['count'] for f in frames], dtype=np.float64)
+    ratios = np.array([f['area_ratio'] for f in frames], dtype=np.float64)
+    duration = (info['total_frames'] / info['fps']) if info.get('fps') else None
+    peak = int(ratios.argmax()) if len(ratios) else None
+    return {
+        'total_frames': info['total_frames'],
+        'frames_sampled': len(frames),
+        'frames_inferred': sum(1 for f in frames if not f['reused']),
+        'frames_reused': sum(1 for f in frames if f['reused']),
+        'frames_with_detections': int((counts > 0).sum()),
+        'count_max': int(counts.max()) if len(counts) else 0,
+        'count_mean': float(counts.mean()) if len(counts) else 0.0,
+        'area_ratio_max': float(ratios.max()) if len(ratios) else 0.0,
+        'area_ratio_mean': float(ratios.mean()) if len(ratios) else 0.0,
+        'area_ratio_max_frame': frames[peak]['frame'] if peak is not None else None,
+        'video_seconds': round(duration, 3) if duration else None,
+        'processing_seconds': round(seconds, 3),
+        # >1 表示快于实时
+        'realtime_factor': round(duration / seconds, 2) if duration and seconds > 0 else None,
+    }
+
+
+def _run_video_job(job: Dict) -> None:
+    """Video job: decode thread + batched inference on the worker pool; records progress in the job store."""
+    job_id = job['job_id']
+    started = time.monotonic()
+    stop = threading.Event()
+    items: "queue.Queue" = queue.Queue(maxsize=max(4, 2 * app.config['BATCH_MAX_SIZE']))
+    try:
+        info = _video_source_info(job['file_path'])
+        decoder = threading.Thread(target=_video_decode_loop, args=(job, items, stop), name='video-decode', daemon=True)
+        decoder.start()
+        frames_out: List[Dict] = []
+        last: List[Optional[Dict]] = [None]
+        pending: List[Tuple] = []
+        error = None
+        batch_size = max(1, app.config['BATCH_MAX_SIZE'])
+        while True:
+            item = items.get()
+            if item is not None and item[0] == 'error':
+                error = item[3]
+                continue
+            if item is not None:
+                pending.append(item)
+            inferred = sum(1 for p in pending if p[0] == 'infer')
+            # 凑满一批、或解码暂时跟不上时就推理已有的帧
+            if pending and (item is None or inferred >= batch_size or (inferred and items.empty())):
+                _video_run_batch(job, pending, frames_out, last)
+                pending = []
+                _job_store.set(job_id, {'status': 'running', 'progress': {
+                    'frames_processed': frames_out[-1]['frame'] + 1,
+                    'total_frames': info['total_frames'],
+                    'frames_inferred': sum(1 for f in frames_out if not f['reused']),
+                }})
+            if item is None:
+                break
+        decoder.join()
+        if error and not frames_out:
+            raise RuntimeError(error)
+        result = {
+            'success': True,
+            'filename': job['filename'],
+            'detection_id': job['detection_id'],
+            'source': info['kind'],
+            'params': {k: job[k] for k in ('model', 'conf', 'iou', 'imgsz', 'max_det', 'backend',
+                                           'frame_stride', 'diff_threshold')},
+            'aggregate': _video_aggregate(frames_out, info, time.monotonic() - started),
+            'frames': frames_out,
+            'saved': {'original_path': os.path.relpath(job['file_path'], BASE_DIR)},
+        }
+        if error:
+            result['warning'] = f'解码中途出错，已返回此前的结果: {error}'
+        summary_path = os.path.join(VIDEOS_DIR, f"{job['detection_id']}.json")
+        _persist.submit('bytes', summary_path, json.dumps(result, ensure_ascii=False).encode('utf-8'))
+        result['saved']['result_path'] = os.path.relpath(summary_path, BASE_DIR)
+        _job_store.set(job_id, {'status': 'done', 'result': result})
+    except Exception as e:
+        stop.set()
+        _discard_upload(job)
+        _job_store.set(job_id, {'status': 'error', 'message': str(e)})
+
+
+class _VideoAdmission:
+    """Bounds queued + running video jobs, overall and per user.
+
+    Video jobs bypass _BatchScheduler, so this is their admission control; it
+    also tracks how long recent video jobs took to suggest a Retry-After.
+    """
+
+    def __init__(self, max_jobs: int = 0, per_user: int = 0):
+        self.max_jobs = max_jobs
+        self.per_user = per_user
+        self._count = 0
+        self._user_counts: Dict[str, int] = collections.Counter()
+        self._lock = threading.Lock()
+        self._avg_seconds: Optional[float] = None
+
+    def acquire(self, user: str) -> Optional[str]:
+        """Take a slot; returns None when admitted, else 'queue' or 'user'."""
+        with self._lock:
+            if self.max_jobs > 0 and self._count >= self.max_jobs:
+                return 'queue'
+            if self.per_user > 0 and self._user_counts.get(user, 0) >= self.per_user:
+                return 'user'
+            self._count += 1
+            self._user_counts[user] += 1
+            return None
+
+    def release(self, user: str, seconds: Optional[float] = None) -> None:
+        with self._lock:
+            self._count -= 1
+            self._user_counts[user] -= 1
+            if not self._user_counts[user]:
+                del self._user_counts[user]
+            if seconds is not None:
+                # 指数滑动平均
+                self._avg_seconds = seconds if self._avg_seconds is None else 0.7 * self._avg_seconds + 0.3 * seconds
+
+    def retry_after(self) -> int:
+        with self._lock:
+            avg = self._avg_seconds
+        return 60 if avg is None else int(min(600, max(5, np.ceil(avg))))
+
+
+_video_executor = ThreadPoolExecutor(max_workers=max(1, app.config['VIDEO_MAX_CONCURRENT']), thread_name_prefix='video')
+_video_admission = _VideoAdmission(app.config['VIDEO_MAX_PENDING'], app.config['VIDEO_MAX_PER_USER'])
+
+
+def _submit_video_job(job: Dict) -> None:
+    """Run a video job on the video pool; its admission slot is released when it ends."""
+    started = time.monotonic()
+
+    def _done(_future) -> None:
+        _video_admission.release(job['user'], time.monotonic() - started)
+
+    try:
+        future = _video_executor.submit(_run_video_job, job)
+    except Exception:
+        _video_admission.release(job['user'])
+        raise
+    future.add_done_callback(_done)
+
+
+def _video_full_response(reason: str):
+    retry = _video_admission.retry_after()
+    if reason == 'user':
+        message = '您已有视频任务在排队或处理中，请完成后再提交'
+    else:
+        message = '视频任务队列已满，请稍后重试'
+    resp = jsonify({'success': False, 'message': message, 'retry_after': retry})
+    resp.headers['Retry-After'] = str(retry)
+    return resp, 429
+
+def _registry_snapshot() -> Dict:
+    """Loaded models of the current process, most recently used last."""
+    with _loaded_models_lock:
+        models = [
+            {
+                'path': os.path.relpath(path, BASE_DIR).replace('\\', '/'),
+                'key': info['key'],
+                'backend': info['backend'],
+                'memory_mb': round(info['bytes'] / (1024 * 1024), 2),
+                'load_seconds': round(info['load_seconds'], 3),
+                'last_used': info['last_used'],
+            }
+            for path, info in ((p, _model_info[p]) for p in _loaded_models.keys())
+        ]
+    return {'pid': os.getpid(), 'models': models}
+
+
+def _warmup_model(model_key: str, imgsz: int) -> Dict:
+    """Load a model and run one dummy inference so the first real request is not cold."""
+    dummy = np.zeros((imgsz, imgsz, 3), dtype=np.uint8)
+    _predict_batch(model_key, [dummy], 0.25, 0.45, imgsz, 1, _resolve_backend(model_key))
+    return _registry_snapshot()
+
+
+_ready_state: Dict = {'ready': False, 'errors': {}, 'workers': {}}
+
+
+def _preload_models() -> None:
+    keys = app.config['MODEL_PRELOAD']
+    imgsz = app.config['MODEL_WARMUP_IMGSZ']
+    for key in keys:
+        # 每个worker各预热一次（线程模式下各线程有独立predictor，进程模式下各进程独立加载）
+        futures = [_executor.submit(_warmup_model, key, imgsz) for _ in range(max(1, app.config['WORKER_COUNT']))]
+        for future in futures:
+            try:
+                snapshot = future.result()
+                _ready_state['workers'][snapshot['pid']] = snapshot
+            except Exception as e:
+                _ready_state['errors'][key] = str(e)
+    _ready_state['ready'] = True
+
+
+def preload_weights() -> None:
+    """Load MODEL_PRELOAD weights in this process without starting any thread.
+
+    serve.py calls this before forking so the serving processes share the weights
+    copy-on-write. Conv+BN are fused here, because the fusion done by the first
+    predict() rewrites the weights and would give every process its own copy.
+    """
+    imgsz = app.config['MODEL_WARMUP_IMGSZ']
+    for key in app.config['MODEL_PRELOAD']:
+        try:
+            model = _get_model(key, _resolve_backend(key), imgsz)
+            inner = getattr(model, 'model', None)
+            if hasattr(inner, 'fuse') and hasattr(inner, 'is_fused') and not inner.is_fused():
+                inner.fuse(verbose=False)
+        except Exception as e:
+            _ready_state['errors'][key] = str(e)
+
+
+def start_background(process_index: int = 0) -> None:
+    """Start the worker pool, the dispatcher thread and model warm-up of this process.
+
+    Threads do not survive fork(), so serve.py calls this in every forked serving
+    process; process_index offsets the CPU pinning slots of its workers. Process 0
+    also owns the shared housekeeping: result cache eviction and the runs/ watcher
+    (the other processes pick up model changes by polling).
+    """
+    global _executor, _worker_thread, _worker_index
+    _worker_index = itertools.count(process_index * max(1, app.config['WORKER_COUNT']))
+    if process_index == 0:
+        _result_cache.take_ownership()
+        if app.config['MODEL_INDEX_WATCH']:
+            _model_index.start_watcher()
+    _executor = _create_executor()
+    _worker_thread = threading.Thread(target=_queue_worker, daemon=True)
+    _worker_thread.start()
+    threading.Thread(target=_preload_models, daemon=True).start()
+
+
+def stop_background() -> None:
+    """Shut the worker pool down and flush this process's write-behind queue.
+
+    Waiting for the pool lets process workers run their own exit flush before
+    the caller leaves with os._exit (serve.py), which would skip atexit.
+    """
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+    _persist.flush()
+
+
+# 启动worker池与调度线程（spawn出的子进程只执行推理，不再启动调度；serve.py 在fork后自行启动）
+if multiprocessing.current_process().name == 'MainProcess' and not app.config['DEFER_BACKGROUND']:
+    start_background()
+
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None and app.config['METRICS_ENABLED']:
+        # 用路由模板而非实际路径作标签，避免 job_id 等造成标签爆炸
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        _http_seconds.observe(time.perf_counter() - started, route=route, method=request.method,
+                              status=response.status_code)
+    return response
+
+
+@app.route('/', methods=['GET'])
+def index():
+    return render_template('index.html')
+
+
+def _model_dir_name(model_key: str) -> str:
+    """Derive a folder name for outputs based on the selected model.
+    - If model is a runs/*/weights/best.pt path, use the run directory name.
+    - Else use the basename without extension.
+    """
+    key_norm = model_key.replace('\\', '/').strip()
+    # If absolute path, try to make it relative to BASE_DIR for parsing
+    rel = key_norm
+    try:
+        if os.path.isabs(model_key):
+            rel = os.path.relpath(model_key, BASE_DIR).replace('\\', '/')
+    except Exception:
+        pass
+    parts = rel.split('/')
+    if 'runs' in parts and parts[-1] in DISCOVERABLE_WEIGHTS:
+        # runs/<run_name>/weights/best.pt -> <run_name>；best_int8.onnx -> <run_name>_int8
+        try:
+            idx = parts.index('runs')
+            run_name = parts[idx + 1] if idx + 1 < len(parts) else None
+            if run_name:
+                return run_name + ('_int8' if parts[-1] == 'best_int8.onnx' else '')
+        except ValueError:
+            pass
+    # fallback to file stem
+    stem = os.path.splitext(os.path.basename(rel))[0]
+    # sanitize
+    safe = ''.join(ch if ch.isalnum() or ch in ('-', '_', '.') else '_' for ch in stem)
+    return safe or 'model_outputs'
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness probe: preload status plus loaded models and their memory usage."""
+    if app.config['WORKER_MODE'] == 'process':
+        # 进程模式下模型驻留在各worker进程中，尽力刷新一次快照（忙时沿用上次结果）
+        futures = [_executor.submit(_registry_snapshot) for _ in range(max(1, app.config['WORKER_COUNT']))]
+        for future in futures:
+            try:
+                snapshot = future.result(timeout=2)
+                _ready_state['workers'][snapshot['pid']] = snapshot
+            except Exception:
+                pass
+        workers = list(_ready_state['workers'].values())
+    else:
+        workers = [_registry_snapshot()]
+    used_mb = sum(m['memory_mb'] for w in workers for m in w['models'])
+    body = {
+        'success': True,
+        'ready': _ready_state['ready'],
+        'preload': app.config['MODEL_PRELOAD'],
+        'errors': _ready_state['errors'],
+        'memory_budget_mb': app.config['MODEL_MEMORY_BUDGET_MB'],
+        'memory_used_mb': round(used_mb, 2),
+        'workers': workers,
+    }
+    return jsonify(body), (200 if _ready_state['ready'] else 503)
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition of stage latencies, queue, cache and model metrics."""
+    if not app.config['METRICS_ENABLED']:
+        return jsonify({'success': False, 'message': '指标导出未开启（METRICS_ENABLED=0）'}), 404
+    body = _metrics.render(on_error=lambda name, e: app.logger.warning('指标 %s 导出失败: %s', name, e))
+    return Response(body, content_type=metrics.CONTENT_TYPE)
+
+
+_benchmark_lock = threading.Lock()
+_benchmark_proc: Optional[subprocess.Popen] = None
+
+
+def _benchmark_running() -> bool:
+    return _benchmark_proc is not None and _benchmark_proc.poll() is None
+
+
+@app.route('/benchmarks', methods=['GET'])
+def list_benchmarks():
+    """Cached benchmark results (benchmark.py) for the current weights of every known model.
+
+    Items follow the frontend BenchmarkItem shape; models whose weights have no cached
+    result yet (never measured, or retrained since) are listed under 'missing'.
+    """
+    MODEL_FILES.update(discover_models())
+    items, missing = [], []
+    for key, path in MODEL_FILES.items():
+        if not os.path.exists(path):
+            continue
+        cached = benchmark.load_cached(_weights_hash(path))
+        if cached is None:
+            missing.append(key)
+            continue
+        # 同一份权重可能以不同的键出现，以当前键为准
+        items.append({**cached, 'model': key, 'name': benchmark.display_name(key)})
+    return jsonify({'success': True, 'data': items, 'missing': missing, 'running': _benchmark_running()})
+
+
+@app.route('/benchmarks', methods=['POST'])
+def run_benchmarks():
+    """Start benchmark.py in a background process for the given (default: missing) models.
+
+    Form/JSON fields: models (keys, comma separated or a list), force=1 to re-measure.
+    The benchmark shares CPU/GPU with inference, so run it off-peak.
+    """
+    global _benchmark_proc
+    payload = request.get_json(silent=True) or request.form
+    requested = payload.get('models') or []
+    if isinstance(requested, str):
+        requested = [k.strip() for k in requested.split(',') if k.strip()]
+    force = str(payload.get('force', '0')) in ('1', 'true')
+    MODEL_FILES.update(discover_models())
+    unknown = [k for k in requested if k not in MODEL_FILES]
+    if unknown:
+        return jsonify({'success': False, 'message': f'未知模型: {", ".join(unknown)}'}), 400
+    if not requested:
+        requested = [k for k, p in MODEL_FILES.items()
+                     if os.path.exists(p) and (force or benchmark.load_cached(_weights_hash(p)) is None)]
+    if not requested:
+        return jsonify({'success': True, 'started': False, 'message': '所有模型均已有基准结果'})
+    with _benchmark_lock:
+        if _benchmark_running():
+            return jsonify({'success': False, 'message': '基准测试正在运行，请稍后再试'}), 409
+        os.makedirs(benchmark.BENCH_DIR, exist_ok=True)
+        cmd = [sys.executable, os.path.join(BASE_DIR, 'benchmark.py'), '--models', *requested]
+        if force:
+            cmd.append('--force')
+        log = open(os.path.join(benchmark.BENCH_DIR, 'run.log'), 'ab')
+        try:
+            _benchmark_proc = subprocess.Popen(cmd, cwd=BASE_DIR, stdout=log, stderr=subprocess.STDOUT)
+        finally:
+            log.close()
+    return jsonify({'success': True, 'started': True, 'models': requested}), 202
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters and occupancy of the detection result cache."""
+    return jsonify({'success': True, 'enabled': app.config['RESULT_CACHE_ENABLED'], **_result_cache.snapshot()})
+
+
+def _results_db():
+    """Per-thread read connection to the detection record store."""
+    conn = getattr(_thread_state, 'results_db', None)
+    if conn is None:
+        conn = _thread_state.results_db = result_store.connect(RESULTS_DB_PATH)
+    return conn
+
+
+def _results_filters(args) -> Dict:
+    return {
+        'model': args.get('model'),
+        'filename': args.get('filename'),
+        'since': args.get('since'),
+        'until': args.get('until'),
+        'min_area_ratio': args.get('min_area_ratio', type=float),
+    }
+
+
+@app.route('/results', methods=['GET'])
+def list_results():
+    """Paginated detection records, newest first.
+
+    Query: model, filename, since/until (YYYYMMDD or YYYYMMDD-HHMMSS),
+    min_area_ratio, page, page_size (<= 500).
+    """
+    try:
+        page = result_store.query_results(
+            _results_db(), _results_filters(request.args),
+            page=request.args.get('page', 1, type=int),
+            page_size=request.args.get('page_size', 50, type=int),
+        )
+        return jsonify({'success': True, **page})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'查询失败: {str(e)}'}), 500
+
+
+@app.route('/results/aggregate', methods=['GET'])
+def aggregate_results():
+    """Record count and mean area ratio per model per day (same filters as /results)."""
+    try:
+        rows = result_store.aggregate_results(_results_db(), _results_filters(request.args))
+        return jsonify({'success': True, 'items': rows})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'查询失败: {str(e)}'}), 500
+
+
+@app.route('/outputs/<path:filename>', methods=['GET'])
+def serve_output(filename: str):
+    """Annotated images referenced by image_url; long-lived cache headers since names are unique."""
+    path = os.path.abspath(os.path.join(OUTPUT_DIR, filename))
+    if not path.startswith(os.path.abspath(OUTPUT_DIR) + os.sep):
+        return jsonify({'success': False, 'message': '非法路径'}), 404
+    # url 模式下响应可能先于后台写入返回，短暂等待落盘
+    if not _persist.wait_for(path, timeout=5.0):
+        return jsonify({'success': False, 'message': '文件不存在'}), 404
+    resp = send_from_directory(OUTPUT_DIR, filename, max_age=app.config['OUTPUT_CACHE_MAX_AGE'], conditional=True)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
+
+
+_DETECTION_ID_CHARS = set('0123456789abcdef-_')
+
+
+@app.route('/detections/<detection_id>', methods=['GET'])
+def get_detection(detection_id: str):
+    """Structured detections (boxes, conf, cls, simplified polygons) of one stored result."""
+    path = _detection_path(detection_id)
+    if len(detection_id) != 24 or not set(detection_id) <= _DETECTION_ID_CHARS or not _persist.wait_for(path, 5.0):
+        return jsonify({'success': False, 'message': '检测结果不存在'}), 404
+    with open(path, 'rb') as f:
+        det = detections.loads(f.read())
+    return jsonify({'success': True, 'detection': det})
+
+
+@app.route('/render/<detection_id>', methods=['GET'])
+def render_detection(detection_id: str):
+    """Annotated image of a stored result, drawn from the original + detections on first request.
+
+    Query: format (png/jpeg/webp, default the format requested at detection time),
+    quality (1-100), max_side (>= 0). Variants at the stored quality with max_side 0 or
+    one of RENDER_CACHE_SIDES are rendered once and then served from web_data/outputs;
+    any other variant is rendered per request and not persisted, so query strings
+    cannot grow the output directory without bound.
+    """
+    det_path = _detection_path(detection_id)
+    if len(detection_id) != 24 or not set(detection_id) <= _DETECTION_ID_CHARS or not _persist.wait_for(det_path, 5.0):
+        return jsonify({'success': False, 'message': '检测结果不存在'}), 404
+    try:
+        with open(det_path, 'rb') as f:
+            det = detections.loads(f.read())
+    except (OSError, ValueError):
+        return jsonify({'success': False, 'message': '检测结果不存在或已损坏'}), 404
+
+    fmt = request.args.get('format', det.get('image_format', 'png')).lower()
+    fmt = 'jpeg' if fmt == 'jpg' else fmt
+    if fmt not in IMAGE_FORMATS:
+        return jsonify({'success': False, 'message': f'不支持的 format: {fmt}'}), 400
+    stored_quality = det.get('image_quality', app.config['RESPONSE_IMAGE_QUALITY'])
+    try:
+        quality = int(request.args.get('quality', stored_quality))
+        max_side = int(request.args.get('max_side', 0))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'quality 与 max_side 须为整数'}), 400
+    if not 1 <= quality <= 100:
+        return jsonify({'success': False, 'message': 'quality 取值范围为 1-100'}), 400
+    if max_side < 0:
+        return jsonify({'success': False, 'message': 'max_side 不能为负数'}), 400
+    ext, mime = IMAGE_FORMATS[fmt]
+
+    # 默认变体即检测记录中的 saved_output_path；其余可缓存变体加后缀
+    cacheable = quality == stored_quality and (max_side == 0 or max_side in app.config['RENDER_CACHE_SIDES'])
+    out_path = os.path.join(BASE_DIR, os.path.splitext(det['output_path'])[0])
+    if fmt != det.get('image_format') or quality != det.get('image_quality') or max_side > 0:
+        out_path += f'_{fmt}{quality}_{max_side}'
+    out_path += ext
+    rel = os.path.relpath(out_path, OUTPUT_DIR).replace('\\', '/')
+    if cacheable and _persist.wait_for(out_path, 0):
+        return serve_output(rel)
+
+    original = os.path.join(BASE_DIR, det['original_path'])
+    if not _persist.wait_for(original, 5.0):
+        return jsonify({'success': False, 'message': '原图不存在，无法渲染'}), 404
+    try:
+        img_bgr = _decode_file(original)[0]
+        annotated = _fit_max_side(detections.render(img_bgr, det), max_side)
+        data = _encode_image(annotated, fmt, quality)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'渲染失败: {str(e)}'}), 400
+    if not cacheable:
+        resp = Response(data, mimetype=mime)
+        resp.cache_control.public = True
+        resp.cache_control.max_age = app.config['OUTPUT_CACHE_MAX_AGE']
+        return resp
+    try:
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tmp = f'{out_path}.{uuid.uuid4().hex[:8]}.tmp'
+        with open(tmp, 'wb') as f_out:
+            f_out.write(data)
+        os.replace(tmp, out_path)
+    except OSError as e:
+        return jsonify({'success': False, 'message': f'保存标注图失败: {str(e)}'}), 500
+    return serve_output(rel)
+
+
+def _profile_mode() -> Optional[str]:
+    """'timings' or 'cprofile' when this request asks for (and may use) profiling, else None."""
+    value = request.args.get('profile') or request.form.get('profile') or ''
+    return _check_profile_mode(value, request.headers.get('X-Profile-Token', ''))
+
+
+def _check_profile_mode(value: str, token_header: str) -> Optional[str]:
+    """Validate a requested profile mode.
+
+    Raises PermissionError when profiling is requested but disabled or the token is wrong.
+    """
+    value = value.strip().lower()
+    if value in ('', '0', 'false'):
+        return None
+    if not app.config['PROFILE_ENABLED']:
+        raise PermissionError('单请求剖析未开启（PROFILE_ENABLED=0）')
+    token = app.config['PROFILE_TOKEN']
+    if token and not hmac.compare_digest(token_header, token):
+        raise PermissionError('剖析口令错误')
+    if value == 'cprofile':
+        return 'cprofile'
+    if value in ('1', 'true', 'timings'):
+        return 'timings'
+    raise ValueError('profile 可选 1 或 cprofile')
+
+
+@app.route('/detect', methods=['POST'])
+def detect():
+    try:
+        # Validate file
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'message': '未收到文件，请选择要检测的图像'}), 400
+        file = request.files['file']
+        filename = file.filename or '未命名图像'
+
+        # Params
+        params = _parse_job_params(request.form)
+        profile = _profile_mode()
+
+        # 上传流式写盘，任务只携带路径与摘要
+        t0 = time.perf_counter()
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'filename': filename,
+            'user': _request_user(),
+            **params,
+            **_save_upload(file.stream, filename),
+        }
+        upload_ms = round((time.perf_counter() - t0) * 1000.0, 3)
+        if profile:
+            # 剖析请求跳过结果缓存，完整走一遍解码与推理
+            job['profile'] = profile
+        else:
+            try:
+                cached = _cached_result(job)
+            except Exception:
+                _discard_upload(job)
+                raise
+            if cached is not None:
+                _discard_upload(job)
+                return jsonify(cached)
+        try:
+            result = _run_inference(job)
+        except queue.Full:
+            _discard_upload(job)
+            return _queue_full_response(job['user'])
+        if profile:
+            result['profile']['upload_ms'] = upload_ms
+            result['profile']['request_ms'] = round((time.perf_counter() - g.request_started) * 1000.0, 3)
+        return jsonify(result)
+    except PermissionError as e:
+        return jsonify({'success': False, 'message': str(e)}), 403
+    except (FileNotFoundError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except TimeoutError as e:
+        return jsonify({'success': False, 'message': str(e)}), 504
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'检测失败: {str(e)}'}), 500
+
+
+@app.route('/profiles/<name>', methods=['GET'])
+def download_profile(name: str):
+    """Download a cProfile dump written by /detect?profile=cprofile (open with snakeviz or pstats)."""
+    if not app.config['PROFILE_ENABLED']:
+        return jsonify({'success': False, 'message': '单请求剖析未开启（PROFILE_ENABLED=0）'}), 404
+    token = app.config['PROFILE_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('X-Profile-Token', ''), token):
+        return jsonify({'success': False, 'message': '剖析口令错误'}), 403
+    if not name.endswith('.prof') or os.path.basename(name) != name:
+        return jsonify({'success': False, 'message': '未找到剖析文件'}), 404
+    return send_from_directory(PROFILES_DIR, name, as_attachment=True, mimetype='application/octet-stream')
+
+
+# /detect/batch 从 zip 中读取的图片类型
+BATCH_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tif', '.tiff')
+
+
+def _iter_batch_uploads(files):
+    """Yield (filename, stream) for every uploaded image, expanding zip archives."""
+    count = 0
+    unzipped_limit = app.config['BATCH_MAX_UNZIPPED_MB'] * 1024 * 1024
+    for file in files:
+        name = file.filename or '未命名图像'
+        if name.lower().endswith('.zip') or file.mimetype in ('application/zip', 'application/x-zip-compressed'):
+            with zipfile.ZipFile(file.stream) as archive:
+                members = [m for m in archive.infolist()
+                           if not m.is_dir() and not m.filename.startswith('__MACOSX/')
+                           and m.filename.lower().endswith(BATCH_IMAGE_EXTENSIONS)]
+                if sum(m.file_size for m in members) > unzipped_limit:
+                    raise ValueError(f'{name} 解压后超过 {app.config["BATCH_MAX_UNZIPPED_MB"]:.0f}MB')
+                for member in members:
+                    count += 1
+                    if count > app.config['BATCH_MAX_FILES']:
+                        raise ValueError(f'单次最多 {app.config["BATCH_MAX_FILES"]} 张图片')
+                    with archive.open(member) as stream:
+                        yield member.filename, stream
+        else:
+            count += 1
+            if count > app.config['BATCH_MAX_FILES']:
+                raise ValueError(f'单次最多 {app.config["BATCH_MAX_FILES"]} 张图片')
+            yield name, file.stream
+
+
+def _ndjson(obj: Dict) -> str:
+    return json.dumps(obj, ensure_ascii=False) + '\n'
+
+
+@app.route('/detect/batch', methods=['POST'])
+def detect_batch():
+    """Detect many images (multiple files and/or zip archives) in one request.
+
+    Form fields are the same as /detect; files go in 'files' (or 'file'). The response is
+    NDJSON: one line per image in completion order with the /detect result plus index,
+    job_id and status, then a final summary line.
+    """
+    try:
+        # 批量接口允许更大的请求体（Flask >= 3.1 支持按请求设置）
+        request.max_content_length = int(app.config['BATCH_MAX_CONTENT_MB'] * 1024 * 1024)
+    except AttributeError:
+        pass
+    try:
+        files = request.files.getlist('files') + request.files.getlist('file')
+        if not files:
+            return jsonify({'success': False, 'message': '未收到文件，请选择要检测的图像或zip压缩包'}), 400
+        params = _parse_job_params(request.form)
+    except (FileNotFoundError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    user = _request_user()
+
+    def generate():
+        started = time.monotonic()
+        done_queue: "queue.Queue" = queue.Queue()
+        pending: Dict[str, Dict] = {}
+        summary = {'total': 0, 'done': 0, 'failed': 0}
+
+        def line(index: int, filename: str, job_id: Optional[str], info: Dict) -> str:
+            summary['done' if info['status'] == 'done' else 'failed'] += 1
+            if info['status'] == 'done':
+                body = {**info['result']}
+            else:
+                body = {'success': False, 'message': info.get('message', '未知错误')}
+            return _ndjson({'index': index, 'filename': filename, 'job_id': job_id, 'status': info['status'], **body})
+
+        def drain(block: bool):
+            while pending:
+                try:
+                    job_id, info = done_queue.get(timeout=1.0) if block else done_queue.get_nowait()
+                except queue.Empty:
+                    if block:
+                        continue
+                    return
+                job = pending.pop(job_id)
+                yield line(job['index'], job['filename'], job_id, info)
+                block = False
+
+        try:
+            for index, (filename, stream) in enumerate(_iter_batch_uploads(files)):
+                summary['total'] += 1
+                job_id = uuid.uuid4().hex
+                try:
+                    job = {'job_id': job_id, 'filename': filename, 'user': user, 'priority': PRIORITIES['bulk'],
+                           **params, **_save_upload(stream, filename)}
+                    cached = _cached_result(job)
+                except Exception as e:
+                    yield line(index, filename, None, {'status': 'error', 'message': str(e)})
+                    continue
+                if cached is not None:
+                    _discard_upload(job)
+                    yield line(index, filename, job_id, {'status': 'done', 'result': cached})
+                    continue
+                pending[job_id] = {'index': index, 'filename': filename}
+                _job_store.set(job_id, {'status': 'queued'})
+                with _jobs_lock:
+                    _job_listeners[job_id] = done_queue
+                # 队列满时先输出已完成的结果，避免阻塞在入队上
+                while True:
+                    try:
+                        _job_queue.put(job, timeout=0.05)
+                        break
+                    except queue.Full:
+                        yield from drain(block=False)
+                yield from drain(block=False)
+        except (ValueError, zipfile.BadZipFile) as e:
+            yield _ndjson({'status': 'error', 'success': False, 'message': f'读取上传文件失败: {str(e)}'})
+        try:
+            while pending:
+                yield from drain(block=True)
+        finally:
+            # 客户端中途断开：剩余任务照常完成并入库，只是不再通知
+            with _jobs_lock:
+                for job_id in pending:
+                    _job_listeners.pop(job_id, None)
+        yield _ndjson({'summary': {**summary, 'seconds': round(time.monotonic() - started, 3)}})
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def _enqueue_job(job: Dict) -> bool:
+    """Queue a saved upload as a background job; False (upload discarded) when not admitted."""
+    job_id = job['job_id']
+    try:
+        cached = _cached_result(job)
+    except Exception:
+        _discard_upload(job)
+        raise
+    if cached is not None:
+        # 命中缓存：任务直接完成，不进入推理队列
+        _discard_upload(job)
+        _job_store.set(job_id, {'status': 'done', 'result': cached})
+        return True
+    _job_store.set(job_id, {'status': 'queued'})
+    try:
+        _job_queue.put(job, block=False)
+    except queue.Full:
+        _discard_upload(job)
+        _job_store.delete(job_id)
+        return False
+    return True
+
+
+@app.route('/enqueue', methods=['POST'])
+def enqueue():
+    try:
+        if 'file' not in request.files:
+            return jsonify({'success': False, 'message': '未收到文件，请选择要检测的图像'}), 400
+        file = request.files['file']
+        filename = file.filename or '未命名图像'
+
+        params = _parse_job_params(request.form)
+
+        user = _request_user()
+        priority = request.form.get('priority', 'normal')
+        if priority not in ('normal', 'bulk'):
+            raise ValueError('priority 可选 normal 或 bulk')
+        # 准入检查放在接收文件之前，队列满时不落盘
+        if _job_queue.full_reason(user):
+            return _queue_full_response(user)
+
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'filename': filename,
+            'user': user,
+            'priority': PRIORITIES[priority],
+            **params,
+            **_save_upload(file.stream, filename),
+        }
+        if not _enqueue_job(job):
+            return _queue_full_response(user)
+        return jsonify({'success': True, 'job_id': job['job_id']})
+    except (FileNotFoundError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'入队失败: {str(e)}'}), 500
+
+
+@app.route('/detect/video', methods=['POST'])
+def detect_video():
+    """Queue a video (MP4 etc.) or a zip of ordered frames for sampled, batched inspection.
+
+    Form fields: those of /detect plus frame_stride and diff_threshold; returns a job_id
+    whose /jobs result holds per-frame and aggregate count/area_ratio.
+    """
+    try:
+        file = request.files.get('file') or request.files.get('video')
+        if file is None:
+            return jsonify({'success': False, 'message': '未收到视频文件'}), 400
+        filename = file.filename or '未命名视频'
+        params = _parse_job_params(request.form)
+        params['frame_stride'] = int(request.form.get('frame_stride', app.config['VIDEO_FRAME_STRIDE']))
+        params['diff_threshold'] = float(request.form.get('diff_threshold', app.config['VIDEO_DIFF_THRESHOLD']))
+        if params['frame_stride'] < 1:
+            raise ValueError('frame_stride 须为正整数')
+        _resolve_model_path(params['model'])
+
+        user = _request_user()
+        # 与 /enqueue 相同的准入检查：推理队列已满时视频帧也只会继续挤占 worker
+        if _job_queue.full_reason(user):
+            return _queue_full_response(user)
+        reason = _video_admission.acquire(user)
+        if reason:
+            return _video_full_response(reason)
+        try:
+            job_id = uuid.uuid4().hex
+            job = {'job_id': job_id, 'filename': filename, 'user': user, **params,
+                   **_save_upload(file.stream, filename)}
+            _job_store.set(job_id, {'status': 'queued'})
+        except Exception:
+            _video_admission.release(user)
+            raise
+        _submit_video_job(job)
+        return jsonify({'success': True, 'job_id': job_id})
+    except (FileNotFoundError, ValueError) as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'入队失败: {str(e)}'}), 500
+
+
+@app.route('/jobs/stats', methods=['GET'])
+def job_stats():
+    """Live job counts, job store memory and disk usage."""
+    return jsonify({'success': True, **_job_store.snapshot(), 'queue': _job_queue.snapshot()})
+
+
+def _valid_job_id(job_id: str) -> bool:
+    # job_id 用作文件名，只接受十六进制
+    return bool(job_id) and len(job_id) <= 64 and set(job_id) <= set('0123456789abcdef')
+
+
+def _job_event(job_id: str, info: Optional[Dict], position: Optional[int] = None) -> Dict:
+    """One job's state as pushed by /jobs/events (the /jobs/<id> body plus job_id)."""
+    if not info:
+        return {'job_id': job_id, 'status': 'not_found'}
+    status = info.get('status', 'queued')
+    event = {'job_id': job_id, 'status': status}
+    if status == 'done':
+        event['result'] = info.get('result')
+    elif status == 'error':
+        event['message'] = info.get('message', '未知错误')
+    else:
+        if 'progress' in info:
+            event['progress'] = info['progress']
+        if status == 'queued' and position is not None:
+            event['position'] = position
+            event['eta_seconds'] = _queue_eta(position)
+    return event
+
+
+def _sse(event: Dict, name: Optional[str] = None) -> str:
+    head = f'event: {name}\n' if name else ''
+    return f'{head}data: {json.dumps(event, ensure_ascii=False)}\n\n'
+
+
+def _parse_event_ids(raw: str) -> Tuple[List[str], Optional[str]]:
+    """Job ids of a /jobs/events?ids= query, or an error message."""
+    job_ids = list(dict.fromkeys(i.strip() for i in raw.split(',') if i.strip()))
+    if not job_ids or not all(_valid_job_id(i) for i in job_ids):
+        return job_ids, 'ids 须为逗号分隔的任务ID'
+    if len(job_ids) > app.config['JOB_EVENTS_MAX_IDS']:
+        return job_ids, f"单个连接最多订阅 {app.config['JOB_EVENTS_MAX_IDS']} 个任务"
+    return job_ids, None
+
+
+@app.route('/jobs/events', methods=['GET'])
+def job_events():
+    """Server-Sent Events stream of state changes for the jobs in ?ids=a,b,c.
+
+    Each message is the job's current state: status queued/running/done/error/not_found,
+    queue position and eta_seconds while queued, progress for videos, result or message
+    when finished. The current state of every job is sent first; an 'end' event follows
+    once all of them have finished. Streams are closed after JOB_EVENTS_TIMEOUT seconds,
+    and EventSource reconnects and receives the current states again.
+    """
+    job_ids, error = _parse_event_ids(request.args.get('ids', ''))
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+    return _job_events_response(job_ids)
+
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events_single(job_id: str):
+    if not _valid_job_id(job_id):
         return jsonify({'success': False, 'status': 'not_found'}), 404
+    return _job_events_response([job_id])
+
+
+class _JobEventStream:
+    """State of one /jobs/events stream: which jobs are still open, what was last sent, when to refresh.
+
+    The transport (a blocking generator here, an async one in asgi_app.py) subscribes to
+    the job store first, then calls start(), feeds every subscription item to update() and
+    calls tick() at least every wait_seconds(); each call returns the SSE chunks to send.
+    """
+
+    def __init__(self, job_ids: List[str]):
+        self.job_ids = job_ids
+        self.open_ids = set(job_ids)
+        self.interval = max(0.1, app.config['JOB_EVENTS_POSITION_INTERVAL'])
+        self.heartbeat = app.config['JOB_EVENTS_HEARTBEAT']
+        now = time.monotonic()
+        self.deadline = now + app.config['JOB_EVENTS_TIMEOUT']
+        self.next_positions = now + self.interval
+        self.next_heartbeat = now + self.heartbeat
+        self.current: Dict[str, Optional[Dict]] = {}
+        self.positions: Dict[str, int] = {}
+        self.version = 0
+        self._last: Dict[str, Dict] = {}
+
+    @property
+    def finished(self) -> bool:
+        return not self.open_ids or time.monotonic() >= self.deadline
+
+    def wait_seconds(self) -> float:
+        return max(0.0, min(self.next_positions, self.deadline) - time.monotonic())
+
+    def _emit(self, job_id: str) -> List[str]:
+        event = _job_event(job_id, self.current[job_id], self.positions.get(job_id))
+        # 排队位置不变时不因 ETA 的波动重复推送
+        key = {k: v for k, v in event.items() if k != 'eta_seconds'}
+        if key == self._last.get(job_id):
+            return []
+        self._last[job_id] = key
+        if event['status'] in _JobStore.FINISHED or event['status'] == 'not_found':
+            self.open_ids.discard(job_id)
+        return [_sse(event)]
+
+    def _waiting(self) -> List[str]:
+        return [i for i in self.open_ids
+                if self.current[i] and self.current[i].get('status', 'queued') == 'queued']
+
+    def start(self) -> List[str]:
+        # 调用前已订阅，读取当前状态与订阅之间的变化不会丢失（重复的由 _last 去重）
+        self.current = {job_id: _job_store.get(job_id) for job_id in self.job_ids}
+        self.version = _job_queue.version
+        self.positions = _job_queue.positions(self._waiting())
+        chunks = ['retry: 3000\n\n']
+        for job_id in self.job_ids:
+            chunks.extend(self._emit(job_id))
+        return chunks
+
+    def update(self, job_id: str, info: Dict) -> List[str]:
+        if job_id not in self.open_ids:
+            return []
+        self.current[job_id] = info
+        return self._emit(job_id)
+
+    def tick(self) -> List[str]:
+        chunks: List[str] = []
+        now = time.monotonic()
+        if now >= self.next_positions:
+            self.next_positions = now + self.interval
+            if _job_store.shared:
+                # 其他服务进程执行的任务不会推送到本进程的订阅队列，按间隔从磁盘重读（_emit 负责去重）
+                for job_id in list(self.open_ids):
+                    info = _job_store.get(job_id)
+                    if info is not None:
+                        self.current[job_id] = info
+                        chunks.extend(self._emit(job_id))
+            if _job_queue.version != self.version:
+                # 其他任务出队后刷新排队位置与预计完成时间
+                self.version = _job_queue.version
+                pending = self._waiting()
+                self.positions = _job_queue.positions(pending)
+                for job_id in pending:
+                    chunks.extend(self._emit(job_id))
+        if now >= self.next_heartbeat:
+            self.next_heartbeat = now + self.heartbeat
+            chunks.append(': keepalive\n\n')
+        return chunks
+
+    def end(self) -> List[str]:
+        # 超时关闭时不发 end，EventSource 会重连并重新收到当前状态
+        return [] if self.open_ids else [_sse({'job_ids': self.job_ids}, 'end')]
+
+
+# SSE 响应头：关闭反向代理（nginx）缓冲，事件即时送达
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def _job_events_response(job_ids: List[str]):
+    def generate():
+        stream = _JobEventStream(job_ids)
+        sub = _job_store.subscribe(job_ids)
+        try:
+            yield from stream.start()
+            while not stream.finished:
+                try:
+                    job_id, info = sub.get(timeout=stream.wait_seconds())
+                    yield from stream.update(job_id, info)
+                except queue.Empty:
+                    pass
+                yield from stream.tick()
+            yield from stream.end()
+        finally:
+            _job_store.unsubscribe(job_ids, sub)
+
+    resp = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    resp.headers.update(SSE_HEADERS)
+    return resp
+
+
+def _job_status_body(job_id: str) -> Tuple[Dict, int]:
+    """/jobs/<id> response body and HTTP status."""
+    if not _valid_job_id(job_id):
+        return {'success': False, 'status': 'not_found'}, 404
+    info = _job_store.get(job_id)
+    if not info:
+        return {'success': False, 'status': 'not_found'}, 404
     if info.get('status') == 'done':
-        return jsonify({'success': True, 'status': 'done', 'result': info.get('result')})
+        return {'success': True, 'status': 'done', 'result': info.get('result')}, 200
     elif info.get('status') == 'error':
-        return jsonify({'success': False, 'status': 'error', 'message': info.get('message', '未知错误')}), 500
-    else:
-        return jsonify({'success': True, 'status': info.get('status', 'queued')})
+        return {'success': False, 'status': 'error', 'message': info.get('message', '未知错误')}, 500
+    body = {'success': True, 'status': info.get('status', 'queued')}
+    if 'progress' in info:
+        body['progress'] = info['progress']
+    if body['status'] == 'queued':
+        position = _job_queue.positions([job_id]).get(job_id)
+        if position is not None:
+            body['position'] = position
+            body['eta_seconds'] = _queue_eta(position)
+    return body, 200
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id: str):
+    """Poll one job; /jobs/events pushes the same states without polling."""
+    body, status = _job_status_body(job_id)
+    return jsonify(body), status
 
 
 if __name__ == '__main__':
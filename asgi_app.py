@@ -0,0 +1,295 @@
+"""
+检测接口的 ASGI（asyncio）版本
+
+用法（终端）:
+  pip install starlette python-multipart uvicorn
+  uvicorn asgi_app:app --host 0.0.0.0 --port 8000
+
+/detect、/enqueue、/jobs/<id>、/jobs/events、/jobs/<id>/events 由协程直接处理，请求与响应格式与 app.py 完全一致：
+  - 上传由事件循环异步接收，慢速连接只占一个协程而不是一个线程；接收完成后落盘与哈希在线程池中执行；
+  - 推理仍走 app.py 的调度队列与 worker 池，协程只在事件循环上等待完成通知；
+  - 状态查询与 SSE 订阅不占线程，数千个长连接只是数千个协程。
+其余接口（/models、/results、/metrics 等）原样挂载 Flask 应用（WSGI 适配，在线程池中执行）。
+
+只能以单进程运行（不要用 uvicorn --workers）：调度队列与任务订阅都在进程内。
+"""
+import asyncio
+import contextlib
+import queue
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import app as core
+
+
+class _AsyncListener:
+    """Job listener/subscriber with the queue.Queue put() used by app.py, awaited on the event loop.
+
+    put() is called from worker and dispatcher threads.
+    """
+
+    def __init__(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue: "asyncio.Queue" = asyncio.Queue()
+
+    def put(self, item) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭（服务退出中），丢弃通知
+            pass
+
+    async def get(self, timeout: Optional[float] = None):
+        """Next item; raises asyncio.TimeoutError after timeout seconds."""
+        if timeout is None:
+            return await self._queue.get()
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+
+def _json(body: Dict, status: int = 200, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse(body, status_code=status, headers=headers)
+
+
+def _queue_full(user: str) -> JSONResponse:
+    body, retry = core._queue_full_body(user)
+    return _json(body, 429, {'Retry-After': str(retry)})
+
+
+def _timed(route: str, handler):
+    """Record the handler's response time under the Flask route template, like app.py's after_request."""
+    async def endpoint(request: Request):
+        started = time.perf_counter()
+        response = await handler(request)
+        if core.app.config['METRICS_ENABLED']:
+            core._http_seconds.observe(time.perf_counter() - started, route=route, method=request.method,
+                                       status=response.status_code)
+        return response
+    return endpoint
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+def _limited_request(request: Request, limit: int) -> Request:
+    """The same request whose body stream raises _BodyTooLarge once more than limit bytes arrive."""
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message['type'] == 'http.request':
+            received += len(message.get('body', b''))
+            if received > limit:
+                raise _BodyTooLarge
+        return message
+
+    return Request(request.scope, receive)
+
+
+async def _read_form(request: Request):
+    """Receive the multipart body on the event loop; returns (form, error response)."""
+    limit = core.app.config['MAX_CONTENT_LENGTH']
+    too_large = _json({'success': False, 'message': f'上传内容超过 {(limit or 0) // (1024 * 1024)}MB'}, 413)
+    length = request.headers.get('content-length')
+    if limit and length and length.isdigit() and int(length) > limit:
+        return None, too_large
+    try:
+        # 分块传输没有 Content-Length，接收时计数，超限即停止读取
+        return await (_limited_request(request, limit) if limit else request).form(), None
+    except _BodyTooLarge:
+        return None, too_large
+    except Exception as e:
+        return None, _json({'success': False, 'message': f'读取上传文件失败: {str(e)}'}, 400)
+
+
+def _user(request: Request) -> str:
+    return core._user_from(request.headers, request.client.host if request.client else None)
+
+
+async def detect(request: Request):
+    started = time.perf_counter()
+    form, error = await _read_form(request)
+    if error is not None:
+        return error
+    try:
+        file = form.get('file')
+        if file is None or isinstance(file, str):
+            return _json({'success': False, 'message': '未收到文件，请选择要检测的图像'}, 400)
+        filename = file.filename or '未命名图像'
+
+        params = core._parse_job_params(form)
+        profile = core._check_profile_mode(request.query_params.get('profile') or form.get('profile') or '',
+                                           request.headers.get('X-Profile-Token', ''))
+
+        # 上传已接收完毕（可能已溢写到临时文件），落盘与哈希放到线程池
+        t0 = time.perf_counter()
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'filename': filename,
+            'user': _user(request),
+            **params,
+            **(await run_in_threadpool(core._save_upload, file.file, filename)),
+        }
+        upload_ms = round((time.perf_counter() - t0) * 1000.0, 3)
+        if profile:
+            job['profile'] = profile
+        else:
+            try:
+                cached = await run_in_threadpool(core._cached_result, job)
+            except Exception:
+                core._discard_upload(job)
+                raise
+            if cached is not None:
+                core._discard_upload(job)
+                return _json(cached)
+        listener = _AsyncListener()
+        try:
+            core._submit_inference(job, listener)
+        except queue.Full:
+            core._discard_upload(job)
+            return _queue_full(job['user'])
+        # 客户端断开时协程被取消，任务照常完成，结果写入缓存
+        try:
+            _, info = await listener.get(timeout=core.app.config['DETECT_TIMEOUT'] or None)
+        except asyncio.TimeoutError:
+            core._drop_listener(job['job_id'])
+            return _json({'success': False, 'message': core._detect_timeout_message()}, 504)
+        result = core._inference_result(info)
+        if profile:
+            result['profile']['upload_ms'] = upload_ms
+            result['profile']['request_ms'] = round((time.perf_counter() - started) * 1000.0, 3)
+        return _json(result)
+    except PermissionError as e:
+        return _json({'success': False, 'message': str(e)}, 403)
+    except (FileNotFoundError, ValueError) as e:
+        return _json({'success': False, 'message': str(e)}, 400)
+    except Exception as e:
+        return _json({'success': False, 'message': f'检测失败: {str(e)}'}, 500)
+    finally:
+        await form.close()
+
+
+async def enqueue(request: Request):
+    user = _user(request)
+    # 准入检查放在接收文件之前，队列满时不读取请求体
+    if core._job_queue.full_reason(user):
+        return _queue_full(user)
+    form, error = await _read_form(request)
+    if error is not None:
+        return error
+    try:
+        file = form.get('file')
+        if file is None or isinstance(file, str):
+            return _json({'success': False, 'message': '未收到文件，请选择要检测的图像'}, 400)
+        filename = file.filename or '未命名图像'
+
+        params = core._parse_job_params(form)
+        priority = form.get('priority', 'normal')
+        if priority not in ('normal', 'bulk'):
+            raise ValueError('priority 可选 normal 或 bulk')
+        job = {
+            'job_id': uuid.uuid4().hex,
+            'filename': filename,
+            'user': user,
+            'priority': core.PRIORITIES[priority],
+            **params,
+            **(await run_in_threadpool(core._save_upload, file.file, filename)),
+        }
+        if not await run_in_threadpool(core._enqueue_job, job):
+            return _queue_full(user)
+        return _json({'success': True, 'job_id': job['job_id']})
+    except (FileNotFoundError, ValueError) as e:
+        return _json({'success': False, 'message': str(e)}, 400)
+    except Exception as e:
+        return _json({'success': False, 'message': f'入队失败: {str(e)}'}, 500)
+    finally:
+        await form.close()
+
+
+async def job_status(request: Request):
+    job_id = request.path_params['job_id']
+    # 内存中的任务直接在事件循环上读取；溢出到磁盘或由其他进程写入的任务要读文件，放到线程池
+    if core._valid_job_id(job_id) and core._job_store.in_memory(job_id):
+        body, status = core._job_status_body(job_id)
+    else:
+        body, status = await run_in_threadpool(core._job_status_body, job_id)
+    return _json(body, status)
+
+
+def _job_events_response(job_ids: List[str]) -> StreamingResponse:
+    async def generate():
+        stream = core._JobEventStream(job_ids)
+        sub = _AsyncListener()
+        core._job_store.subscribe(job_ids, sub)
+        try:
+            for chunk in await run_in_threadpool(stream.start):
+                yield chunk
+            while not stream.finished:
+                try:
+                    job_id, info = await sub.get(timeout=stream.wait_seconds())
+                    for chunk in stream.update(job_id, info):
+                        yield chunk
+                except asyncio.TimeoutError:
+                    pass
+                # 多进程服务下 tick() 会读磁盘
+                chunks = await run_in_threadpool(stream.tick) if core._job_store.shared else stream.tick()
+                for chunk in chunks:
+                    yield chunk
+            for chunk in stream.end():
+                yield chunk
+        finally:
+            core._job_store.unsubscribe(job_ids, sub)
+
+    return StreamingResponse(generate(), media_type='text/event-stream', headers=core.SSE_HEADERS)
+
+
+async def job_events(request: Request):
+    job_ids, error = core._parse_event_ids(request.query_params.get('ids', ''))
+    if error:
+        return _json({'success': False, 'message': error}, 400)
+    return _job_events_response(job_ids)
+
+
+async def job_events_single(request: Request):
+    job_id = request.path_params['job_id']
+    if not core._valid_job_id(job_id):
+        return _json({'success': False, 'status': 'not_found'}, 404)
+    return _job_events_response([job_id])
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app):
+    # 被 uvicorn 以非主进程方式导入时 app.py 不会自动启动 worker 池与调度线程
+    if core._executor is None:
+        core.start_background()
+    yield
+    await run_in_threadpool(core._persist.flush)
+
+
+# 其余接口交给 Flask 应用
+_flask = WSGIMiddleware(core.app)
+
+app = Starlette(
+    routes=[
+        Route('/detect', _timed('/detect', detect), methods=['POST']),
+        Route('/enqueue', _timed('/enqueue', enqueue), methods=['POST']),
+        Route('/jobs/events', _timed('/jobs/events', job_events), methods=['GET']),
+        Route('/jobs/{job_id}/events', _timed('/jobs/<job_id>/events', job_events_single), methods=['GET']),
+        Route('/jobs/stats', _flask),
+        Route('/jobs/{job_id}', _timed('/jobs/<job_id>', job_status), methods=['GET']),
+        Mount('/', app=_flask),
+    ],
+    lifespan=lifespan,
+)
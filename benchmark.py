@@ -0,0 +1,325 @@
+"""
+模型速度与精度基准（/benchmarks 接口的数据来源）
+
+用法（终端）:
+  python benchmark.py                                   # 评测内置模型与 runs/ 下发现的全部权重
+  python benchmark.py --models yolo11s.pt runs/rust_seg_v2/weights/best.pt
+可选参数:
+  --data          数据集配置，默认 datasets/data.yaml（速度测试取 test 划分的图片，精度走 train.py 的 test 集评估）
+  --imgsz         推理尺寸列表，默认 640（第一个尺寸用于延迟分位数与精度评估）
+  --batch_sizes   吞吐量测试的批大小列表，默认 1 4 8
+  --images        速度测试使用的图片数上限（预先解码到内存，不计读盘时间），默认 64
+  --warmup        每种配置计时前的预热次数，默认 5
+  --iterations    batch=1 延迟测试的计时次数，默认 50（更大批次按图片数折算）
+  --device        设备（不填则自动: CUDA 用 "0"，否则 "cpu"）
+  --skip_accuracy 不评估 mAP/precision/recall
+  --force         忽略缓存重新评测
+
+结果按“权重 SHA256 + 评测配置”缓存到 web_data/benchmarks/<sha256>.json，权重未变化时不重复评测；
+每个模型在独立的子进程中评测，峰值内存互不影响。Web 服务的 GET /benchmarks 读取这些缓存。
+"""
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import platform
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import cv2
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(BASE_DIR, 'web_data', 'benchmarks')
+BASE_MODELS = ('yolo11s.pt', 'yolo11n.pt')
+DISCOVERABLE_WEIGHTS = ('best.pt', 'best_int8.onnx')
+IMG_EXTS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+# 与 /detect 默认参数一致
+PREDICT_CONF = 0.25
+PREDICT_IOU = 0.45
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def discover_models() -> Dict[str, str]:
+    """Model key -> weights path, following the same rules as app.py's MODEL_FILES."""
+    models = {key: os.path.join(BASE_DIR, key) for key in BASE_MODELS if os.path.exists(os.path.join(BASE_DIR, key))}
+    for name in DISCOVERABLE_WEIGHTS:
+        for path in sorted(glob.glob(os.path.join(BASE_DIR, 'runs', '**', 'weights', name), recursive=True)):
+            models[os.path.relpath(path, BASE_DIR).replace('\\', '/')] = path
+    return models
+
+
+def display_name(model_key: str) -> str:
+    parts = model_key.replace('\\', '/').split('/')
+    if len(parts) >= 3 and parts[-2] == 'weights':
+        run = parts[-3]
+        return f'{run} (INT8)' if parts[-1].endswith('_int8.onnx') else run
+    stem = os.path.splitext(parts[-1])[0]
+    return f'{stem} (base)' if parts[-1] in BASE_MODELS else stem
+
+
+def config_key(cfg: Dict) -> str:
+    """Stable hash of everything that affects the numbers except the weights themselves."""
+    data = cfg.get('data')
+    data_hash = file_sha256(data) if data and os.path.exists(data) else None
+    keyed = {k: cfg[k] for k in ('imgsz', 'batch_sizes', 'images', 'warmup', 'iterations', 'device', 'skip_accuracy')}
+    raw = json.dumps({**keyed, 'data_sha256': data_hash}, sort_keys=True)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def _cache_path(weights_hash: str) -> str:
+    return os.path.join(BENCH_DIR, f'{weights_hash}.json')
+
+
+def load_cached(weights_hash: str, cfg_key: Optional[str] = None) -> Optional[Dict]:
+    """Cached result for these weights: for one config, or the most recent one when cfg_key is None."""
+    try:
+        with open(_cache_path(weights_hash), 'r', encoding='utf-8') as f:
+            entries = json.load(f).get('entries', {})
+    except (OSError, ValueError):
+        return None
+    if cfg_key is not None:
+        return entries.get(cfg_key)
+    if not entries:
+        return None
+    return max(entries.values(), key=lambda e: e.get('measured_at', 0))
+
+
+def store_cached(weights_hash: str, cfg_key: str, result: Dict) -> None:
+    path = _cache_path(weights_hash)
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = {'weights_sha256': weights_hash, 'entries': {}}
+    stored['entries'][cfg_key] = result
+    tmp = f'{path}.{uuid.uuid4().hex[:8]}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(stored, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def _load_images(data_yaml: str, limit: int) -> Tuple[List[np.ndarray], str]:
+    """Decoded test-split images in a fixed (sorted) order; seeded noise when no test images exist."""
+    paths = []
+    if data_yaml and os.path.exists(data_yaml):
+        import train
+        test_dir = train.resolve_split_images(data_yaml, 'test')
+        paths = sorted(p for p in glob.glob(os.path.join(test_dir, '**', '*'), recursive=True)
+                       if os.path.splitext(p)[1].lower() in IMG_EXTS)
+    images = []
+    for p in paths:
+        if len(images) >= limit:
+            break
+        img = cv2.imread(p)
+        if img is not None:
+            images.append(img)
+    if images:
+        return images, 'test'
+    print(f'[WARN] 未找到 test 图片（{data_yaml}），速度测试改用固定随机种子生成的 1280x960 图像')
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (960, 1280, 3), dtype=np.uint8) for _ in range(min(limit, 8))], 'synthetic'
+
+
+def _peak_memory_mb() -> Optional[float]:
+    """Peak resident memory of this process (MB)."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux 以 KB 计，macOS 以字节计
+        return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / (1024 * 1024), 1)
+    except Exception:
+        return None
+
+
+def _percentiles(samples_ms: List[float]) -> Dict[str, float]:
+    arr = np.asarray(samples_ms, dtype=np.float64)
+    return {
+        'mean': round(float(arr.mean()), 2),
+        'p50': round(float(np.percentile(arr, 50)), 2),
+        'p90': round(float(np.percentile(arr, 90)), 2),
+        'p95': round(float(np.percentile(arr, 95)), 2),
+        'p99': round(float(np.percentile(arr, 99)), 2),
+        'samples': len(arr),
+    }
+
+
+def bench_model(model_key: str, model_path: str, weights_hash: str, cfg: Dict) -> Dict:
+    """Measure one model (runs in its own process, so peak memory belongs to this model only)."""
+    import torch
+    from ultralytics import YOLO
+    import train
+
+    torch.manual_seed(0)
+    cuda = str(cfg['device']) != 'cpu' and torch.cuda.is_available()
+
+    def sync():
+        if cuda:
+            torch.cuda.synchronize()
+
+    images, image_source = _load_images(cfg['data'], cfg['images'])
+    model = YOLO(model_path)
+    throughput = []
+    latency = None
+    for imgsz in cfg['imgsz']:
+        for batch_size in cfg['batch_sizes']:
+            batches = [[images[(start + i) % len(images)] for i in range(batch_size)]
+                       for start in range(0, max(len(images), batch_size), batch_size)]
+
+            def predict(k: int):
+                src = batches[k % len(batches)]
+                return model.predict(source=src[0] if batch_size == 1 else src, imgsz=imgsz, conf=PREDICT_CONF,
+                                     iou=PREDICT_IOU, device=cfg['device'], verbose=False)
+
+            for k in range(cfg['warmup']):
+                predict(k)
+            sync()
+            calls = max(3, cfg['iterations'] // batch_size)
+            times_ms = []
+            for k in range(calls):
+                t0 = time.perf_counter()
+                predict(k)
+                sync()
+                times_ms.append((time.perf_counter() - t0) * 1000.0)
+            total_s = sum(times_ms) / 1000.0
+            throughput.append({
+                'imgsz': imgsz,
+                'batch': batch_size,
+                'images_per_sec': round(batch_size * calls / max(total_s, 1e-9), 2),
+                'call_ms_p50': round(float(np.median(times_ms)), 2),
+            })
+            if imgsz == cfg['imgsz'][0] and batch_size == 1:
+                latency = _percentiles(times_ms)
+            print(f'[Bench] {model_key} imgsz={imgsz} batch={batch_size}: '
+                  f'{throughput[-1]["images_per_sec"]} img/s, p50 {throughput[-1]["call_ms_p50"]} ms/call')
+    peak_mb = _peak_memory_mb()
+    gpu_peak_mb = round(torch.cuda.max_memory_allocated() / (1024 * 1024), 1) if cuda else None
+
+    accuracy = {'map50': None, 'map5095': None, 'precision': None, 'recall': None}
+    if not cfg['skip_accuracy'] and cfg['data'] and os.path.exists(cfg['data']):
+        eval_args = argparse.Namespace(data=cfg['data'], imgsz=cfg['imgsz'][0], batch=8, device=cfg['device'])
+        try:
+            eval_results, _ = train.evaluate_test_split(
+                model_path, eval_args, weights_hash[:12], project=os.path.join(BENCH_DIR, 'val'))
+            accuracy = train.eval_metrics(eval_results)
+        except Exception as e:
+            print(f'[WARN] {model_key} 精度评估失败: {e}')
+
+    p, r = accuracy['precision'], accuracy['recall']
+    primary = [t for t in throughput if t['imgsz'] == cfg['imgsz'][0]]
+    return {
+        'model': model_key,
+        'name': display_name(model_key),
+        **{k: (round(v, 4) if v is not None else None) for k, v in accuracy.items()},
+        'f1': round(2 * p * r / (p + r), 4) if p and r else None,
+        # fps 取主尺寸下各批大小中的最高吞吐；latency_ms 为 batch=1 的 p50
+        'fps': max(t['images_per_sec'] for t in primary) if primary else None,
+        'latency_ms': latency['p50'] if latency else None,
+        'latency': latency,
+        'throughput': throughput,
+        'peak_memory_mb': peak_mb,
+        'gpu_peak_memory_mb': gpu_peak_mb,
+        'weights_sha256': weights_hash,
+        'images': len(images),
+        'image_source': image_source,
+        'config': {k: cfg[k] for k in ('imgsz', 'batch_sizes', 'warmup', 'iterations', 'device')},
+        'env': {
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'ultralytics': getattr(sys.modules.get('ultralytics'), '__version__', None),
+            'device_name': torch.cuda.get_device_name(0) if cuda else platform.processor() or platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'torch_threads': torch.get_num_threads(),
+        },
+        'measured_at': time.time(),
+    }
+
+
+def run(models: Dict[str, str], cfg: Dict, force: bool = False) -> List[Dict]:
+    """Benchmark each model unless a cached result for the same weights and config exists."""
+    key = config_key(cfg)
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    for model_key, model_path in models.items():
+        if not os.path.exists(model_path):
+            print(f'[WARN] 权重不存在，跳过: {model_path}')
+            continue
+        weights_hash = file_sha256(model_path)
+        cached = None if force else load_cached(weights_hash, key)
+        if cached is not None:
+            print(f'[Bench] {model_key}: 使用缓存结果（权重 {weights_hash[:12]}）')
+            results.append({**cached, 'model': model_key, 'name': display_name(model_key)})
+            continue
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            result = pool.submit(bench_model, model_key, model_path, weights_hash, cfg).result()
+        store_cached(weights_hash, key, result)
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="模型速度与精度基准")
+    parser.add_argument("--models", nargs="*", default=None, help="模型键（相对项目根目录的权重路径），默认全部")
+    parser.add_argument("--data", type=str, default=os.path.join(BASE_DIR, "datasets", "data.yaml"))
+    parser.add_argument("--imgsz", type=int, nargs="+", default=[640])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--images", type=int, default=64)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--device", type=str, default=None)
+    parser.add_argument("--skip_accuracy", action="store_true")
+    parser.add_argument("--force", action="store_true")
+    args = parser.parse_args()
+
+    if args.device is None:
+        try:
+            import torch
+            args.device = "0" if torch.cuda.is_available() else "cpu"
+        except Exception:
+            args.device = "cpu"
+    if args.models:
+        models = {k: (k if os.path.isabs(k) else os.path.join(BASE_DIR, k)) for k in args.models}
+    else:
+        models = discover_models()
+    cfg = {
+        'data': args.data,
+        'imgsz': args.imgsz,
+        'batch_sizes': sorted(set(args.batch_sizes)),
+        'images': args.images,
+        'warmup': args.warmup,
+        'iterations': args.iterations,
+        'device': args.device,
+        'skip_accuracy': args.skip_accuracy,
+    }
+    results = run(models, cfg, force=args.force)
+    print(f"{'model':<48}{'mAP50':>8}{'mAP50-95':>10}{'P':>8}{'R':>8}{'fps':>9}{'p50 ms':>9}{'p99 ms':>9}{'peak MB':>9}")
+    for r in results:
+        def fmt(v, spec):
+            return format(v, spec) if v is not None else '-'
+        p99 = r['latency']['p99'] if r.get('latency') else None
+        print(f"{r['model']:<48}{fmt(r['map50'], '>8.4f')}{fmt(r['map5095'], '>10.4f')}{fmt(r['precision'], '>8.4f')}"
+              f"{fmt(r['recall'], '>8.4f')}{fmt(r['fps'], '>9.1f')}{fmt(r['latency_ms'], '>9.1f')}"
+              f"{fmt(p99, '>9.1f')}{fmt(r['peak_memory_mb'], '>9.0f')}")
+
+
+if __name__ == "__main__":
+    main()
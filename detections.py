@@ -0,0 +1,104 @@
+"""
+检测结果的结构化表示与按需渲染
+每次检测保存为紧凑 JSON（框、置信度、类别、简化后的多边形），标注图不再在请求内绘制，
+而是在首次访问 /render/<id> 时由原图 + 该 JSON 绘制并缓存；前端也可直接用这些数据自行绘制。
+
+JSON 字段:
+  width, height           原图尺寸
+  names                   本次出现的类别 id -> 名称
+  boxes                   [[x1, y1, x2, y2], ...]（原图像素，保留1位小数）
+  conf, cls               与 boxes 一一对应
+  polygons                分割模型的多边形 [[[x, y], ...], ...]，检测模型为 null
+"""
+import json
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import cv2
+
+
+# 多边形简化容差（像素，Douglas-Peucker）
+DEFAULT_POLY_EPSILON = 1.0
+# 与 Ultralytics 默认配色一致的调色板（RGB十六进制）
+_PALETTE_HEX = (
+    '042AFF', '0BDBEB', 'F3F3F3', '00DFB7', '111F68', 'FF6FDD', 'FF444F', 'CCED00', '00F344', 'BD00FF',
+    '00B4FF', 'DD00BA', '00FFFF', '26C000', '01FFB3', '7D24FF', '7B0068', 'FF1B6C', 'FC6D2F', 'A2FF0B',
+)
+_PALETTE_BGR = [(int(h[4:6], 16), int(h[2:4], 16), int(h[0:2], 16)) for h in _PALETTE_HEX]
+
+
+def _simplify_polygon(points: np.ndarray, epsilon: float) -> List[List[float]]:
+    pts = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+    if epsilon > 0 and len(pts) > 3:
+        approx = cv2.approxPolyDP(pts, epsilon, True)
+        if len(approx) >= 3:
+            pts = approx
+    return np.round(pts.reshape(-1, 2).astype(np.float64), 1).tolist()
+
+
+def extract(result, img_shape, poly_epsilon: float = DEFAULT_POLY_EPSILON,
+            scale: Tuple[float, float] = (1.0, 1.0)) -> Dict:
+    """Compact, JSON-serializable detections from one Ultralytics result.
+
+    img_shape is the original image size; scale = (sx, sy) maps result coordinates to it
+    when the image was decoded at reduced resolution.
+    """
+    h, w = img_shape
+    sx, sy = scale
+    det = {'width': int(w), 'height': int(h), 'names': {}, 'boxes': [], 'conf': [], 'cls': [], 'polygons': None}
+    boxes = result.boxes
+    if boxes is None or boxes.xyxy is None or len(boxes) == 0:
+        return det
+    xyxy = boxes.xyxy.cpu().numpy().astype(np.float64) * np.array([sx, sy, sx, sy])
+    det['boxes'] = np.round(xyxy, 1).tolist()
+    det['conf'] = np.round(boxes.conf.cpu().numpy().astype(np.float64), 4).tolist()
+    det['cls'] = [int(c) for c in boxes.cls.cpu().numpy()]
+    names = getattr(result, 'names', None) or {}
+    det['names'] = {str(c): str(names.get(c, c)) for c in sorted(set(det['cls']))}
+    masks_obj = getattr(result, 'masks', None)
+    if masks_obj is not None and getattr(masks_obj, 'xy', None) is not None:
+        det['polygons'] = [
+            _simplify_polygon(np.asarray(p, dtype=np.float64) * (sx, sy), poly_epsilon) if len(p) else []
+            for p in masks_obj.xy
+        ]
+    return det
+
+
+def dumps(det: Dict) -> bytes:
+    return json.dumps(det, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(raw: bytes) -> Dict:
+    return json.loads(raw.decode('utf-8') if isinstance(raw, bytes) else raw)
+
+
+def render(img_bgr: np.ndarray, det: Dict, mask_alpha: float = 0.5) -> np.ndarray:
+    """Draw masks, boxes and labels in the style of Ultralytics' Results.plot()."""
+    out = img_bgr.copy()
+    h, w = out.shape[:2]
+    lw = max(round((h + w) / 2 * 0.003), 2)
+    polygons: Optional[list] = det.get('polygons')
+    if polygons:
+        overlay = out.copy()
+        for poly, cls in zip(polygons, det['cls']):
+            if len(poly) >= 3:
+                pts = np.round(np.asarray(poly, dtype=np.float64)).astype(np.int32)
+                cv2.fillPoly(overlay, [pts], _PALETTE_BGR[cls % len(_PALETTE_BGR)])
+        cv2.addWeighted(overlay, mask_alpha, out, 1 - mask_alpha, 0, dst=out)
+
+    font_scale = lw / 3
+    font_thickness = max(lw - 1, 1)
+    for box, conf, cls in zip(det['boxes'], det['conf'], det['cls']):
+        color = _PALETTE_BGR[cls % len(_PALETTE_BGR)]
+        x1, y1, x2, y2 = (int(round(v)) for v in box)
+        cv2.rectangle(out, (x1, y1), (x2, y2), color, lw, lineType=cv2.LINE_AA)
+        label = f"{det['names'].get(str(cls), cls)} {conf:.2f}"
+        tw, th = cv2.getTextSize(label, 0, font_scale, font_thickness)[0]
+        outside = y1 - th - 3 >= 0
+        ty = y1 - th - 3 if outside else y1 + th + 3
+        cv2.rectangle(out, (x1, y1), (x1 + tw, ty), color, -1, cv2.LINE_AA)
+        # 浅色背景用深色文字
+        text_color = (0, 0, 0) if sum(color) > 550 else (255, 255, 255)
+        cv2.putText(out, label, (x1, y1 - 2 if outside else y1 + th + 2), 0, font_scale, text_color,
+                    font_thickness, lineType=cv2.LINE_AA)
+    return out
@@ -7,6 +7,14 @@ import { ref } from 'vue'
 interface ModelItem {
   key: string
   name: string
+  // 以下来自后端模型索引，读取权重元数据前为 null
+  task?: 'det' | 'seg' | string | null
+  names?: string[] | null
+  nc?: number | null
+  imgsz?: number | number[] | null
+  sha256?: string | null
+  size?: number | null
+  modified?: number | null
 }
 
 interface DetectionMetrics {
@@ -94,7 +102,7 @@ export function useCorrosion() {
 
   const handleResult = (data: any, inputUrl: string, filename: string, taskId?: string, batchId?: string) => {
     if (!data) return
-    const outputUrl = data.image_base64 ? `data:image/png;base64,${data.image_base64}` : ''
+    const outputUrl = data.image_base64 ? `data:${data.image_mime || 'image/png'};base64,${data.image_base64}` : ''
     previewSrc.value = outputUrl
     inputPreviewSrc.value = inputUrl
     const m = data.metrics || {}
@@ -203,6 +211,42 @@ export function useCorrosion() {
     }
   }
 
+  // 轮询任务状态（EventSource 不可用或推送中断时的回退方式）
+  const pollJob = async (jobId: string): Promise<any> => {
+    const jr = await $fetch<any>(`/api/corrosion/jobs/${jobId}`).catch((err: any) => err?.data || { status: 'error', message: '查询任务失败' })
+    if (jr?.status === 'done' || jr?.status === 'error' || jr?.status === 'not_found') return jr
+    await new Promise((r) => setTimeout(r, 800))
+    return pollJob(jobId)
+  }
+
+  // 通过 Server-Sent Events 等待任务结束，期间回调排队位置/运行状态；连接失败时回退为轮询
+  const waitForJob = (jobId: string, onState?: (state: any) => void): Promise<any> => {
+    if (typeof EventSource === 'undefined') return pollJob(jobId)
+    return new Promise((resolve) => {
+      const source = new EventSource(`/api/corrosion/jobs/events?ids=${jobId}`)
+      let settled = false
+      const finish = (value: Promise<any> | any) => {
+        if (settled) return
+        settled = true
+        source.close()
+        resolve(value)
+      }
+      source.onmessage = (e) => {
+        const state = JSON.parse(e.data)
+        if (state.status === 'done' || state.status === 'error' || state.status === 'not_found') {
+          finish(state)
+        } else {
+          onState?.(state)
+        }
+      }
+      // 后端在全部任务结束后发送 end；未收到最终状态时以轮询兜底
+      source.addEventListener('end', () => finish(pollJob(jobId)))
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) finish(pollJob(jobId))
+      }
+    })
+  }
+
   const startQueue = async () => {
     if (!files.value.length) return
     busy.value = true
@@ -250,25 +294,25 @@ export function useCorrosion() {
           continue
         }
 
-        const poll = async (): Promise<void> => {
-          const jr = await $fetch<any>(`/api/corrosion/jobs/${jobId}`)
-          if (jr?.status === 'done' && jr.result?.success) {
-            handleResult(jr.result, inputUrl, file.name, taskId, batchId)
-            pushLog(`队列完成: ${file.name}`)
-            return
-          }
-          if (jr?.status === 'error') {
-            console.error('队列任务错误', jr)
+        const jr = await waitForJob(jobId as string, (state) => {
+          if (state.status === 'queued' && state.position !== undefined) {
+            const eta = state.eta_seconds != null ? `，预计 ${Math.ceil(state.eta_seconds)} 秒` : ''
+            progressText.value = `${file.name} 排队中：前面 ${state.position} 个任务${eta}`
+          } else if (state.status === 'running') {
             const t = tasks.value.find((x: TaskItem) => x.id === taskId)
-            if (t) { t.status = 'error'; t.message = jr?.message || '队列任务错误' }
-            pushLog(`队列任务错误: ${file.name}`)
-            return
+            if (t) t.status = 'running'
           }
-          await new Promise((r) => setTimeout(r, 800))
-          return poll()
+        })
+        if (jr?.status === 'done' && jr.result?.success) {
+          handleResult(jr.result, inputUrl, file.name, taskId, batchId)
+          pushLog(`队列完成: ${file.name}`)
+        } else {
+          console.error('队列任务错误', jr)
+          const t = tasks.value.find((x: TaskItem) => x.id === taskId)
+          if (t) { t.status = 'error'; t.message = jr?.message || '队列任务错误' }
+          pushLog(`队列任务错误: ${file.name}`)
         }
 
-        await poll()
         done += 1
         progressText.value = `完成 ${done}/${files.value.length}`
       }
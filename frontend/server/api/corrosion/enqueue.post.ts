@@ -1,11 +1,11 @@
 /**
  * 接口名称: 锈蚀检测入队
  * 路径: POST /api/corrosion/enqueue -> POST {apiBase}/enqueue
- * 输入: FormData { file, model, conf, iou, imgsz, max_det }
+ * 输入: FormData { file, model, conf, iou, imgsz, max_det, image_mode?, image_format?, image_quality?, image_max_side?, preprocess? }
  * 输出: { success: boolean; job_id?: string }
  * 说明: 按用户鉴权，队列记录与账户关联；未配置 apiBase 时使用本地 mock 并立即完成。
  */
-import { defineEventHandler, readMultipartFormData, createError } from 'h3'
+import { defineEventHandler, readMultipartFormData, createError, setResponseHeader } from 'h3'
 import { readUserFromEvent, createMockJob } from './_store'
 
 const readToken = (event: any) => {
@@ -52,12 +52,24 @@ export default defineEventHandler(async (event) => {
     fd.append('iou', String(params.iou))
     fd.append('imgsz', String(params.imgsz))
     fd.append('max_det', String(params.max_det))
+    for (const key of ['image_mode', 'image_format', 'image_quality', 'image_max_side', 'preprocess']) {
+      if (params[key] !== undefined) fd.append(key, String(params[key]))
+    }
 
     const token = readToken(event)
     const headers: Record<string, string> = {}
     if (token) headers.Authorization = `Bearer ${token}`
+    // 后端按用户做公平调度与排队上限
+    headers['X-User-Id'] = String(user.id)
 
     const resp = await fetch(`${apiBase}/detect/enqueue`, { method: 'POST', body: fd, headers })
+    if (resp.status === 429) {
+      // 排队已满：透传 Retry-After，前端稍后重试
+      const retryAfter = resp.headers.get('retry-after') || ''
+      if (retryAfter) setResponseHeader(event, 'Retry-After', retryAfter)
+      const body: any = await resp.json().catch(() => ({}))
+      throw createError({ statusCode: 429, statusMessage: body.message || '检测队列繁忙，请稍后重试', data: body })
+    }
     if (!resp.ok) {
       throw createError({ statusCode: resp.status, statusMessage: '后端入队接口调用失败' })
     }
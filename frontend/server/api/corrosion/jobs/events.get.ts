@@ -0,0 +1,61 @@
+/**
+ * 接口名称: 订阅锈蚀检测队列任务进度（Server-Sent Events）
+ * 路径: GET /api/corrosion/jobs/events?ids=a,b -> GET {apiBase}/jobs/events?ids=a,b
+ * 输入: ids 逗号分隔的任务ID
+ * 输出: text/event-stream，每条消息 { job_id, status, position?, eta_seconds?, progress?, result?, message? }，
+ *       全部任务结束后发送 event: end
+ * 说明: 按用户鉴权；未配置 apiBase 时按本地 mock 任务的当前状态推送一次后结束。
+ */
+import { defineEventHandler, createError, getQuery, setResponseHeaders, sendStream } from 'h3'
+import { readUserFromEvent, getJobById } from '../_store'
+
+const readToken = (event: any) => {
+  const auth = event.req.headers['authorization'] || ''
+  if (typeof auth === 'string' && auth.toLowerCase().startsWith('bearer ')) return auth.slice(7)
+  const cookieToken = event.req.headers.cookie?.match(/auth_token=([^;]+)/)?.[1]
+  return cookieToken || ''
+}
+
+export default defineEventHandler(async (event) => {
+  const user = readUserFromEvent(event)
+  if (!user) {
+    throw createError({ statusCode: 401, statusMessage: '未登录，无法查询任务' })
+  }
+
+  const ids = String(getQuery(event).ids || '')
+  if (!ids) {
+    throw createError({ statusCode: 400, statusMessage: '缺少ids' })
+  }
+
+  setResponseHeaders(event, {
+    'Content-Type': 'text/event-stream',
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'
+  })
+
+  const config = useRuntimeConfig()
+  const apiBase = config.public.apiBase || ''
+  if (apiBase) {
+    const token = readToken(event)
+    const headers: Record<string, string> = { Accept: 'text/event-stream' }
+    if (token) headers.Authorization = `Bearer ${token}`
+    headers['X-User-Id'] = String(user.id)
+    // 浏览器断开时一并断开到后端的连接
+    const controller = new AbortController()
+    event.node.req.on('close', () => controller.abort())
+    const resp = await fetch(`${apiBase}/jobs/events?ids=${encodeURIComponent(ids)}`, { headers, signal: controller.signal })
+    if (!resp.ok || !resp.body) {
+      throw createError({ statusCode: resp.status, statusMessage: '订阅任务进度失败' })
+    }
+    return sendStream(event, resp.body)
+  }
+
+  const lines = ids.split(',').map((jobId) => {
+    const job = getJobById(jobId, user.id)
+    const data = job
+      ? { job_id: jobId, status: job.status, result: job.result, message: job.message }
+      : { job_id: jobId, status: 'not_found' }
+    return `data: ${JSON.stringify(data)}\n\n`
+  })
+  return lines.join('') + `event: end\ndata: ${JSON.stringify({ job_ids: ids.split(',') })}\n\n`
+})
@@ -2,7 +2,7 @@
  * 接口名称: 获取模型列表
  * 接口定义: GET /api/corrosion/models -> GET {apiBase}/models
  * 输入内容: 无
- * 输出内容: JSON { success: boolean; models?: Array<{ key: string; name: string }> }
+ * 输出内容: JSON { success: boolean; models?: Array<{ key: string; name: string; task?: string; names?: string[]; imgsz?: number; sha256?: string; size?: number; modified?: number }> }
  * 备注: 通过 Nuxt 服务器转发以避免跨域。
  */
 import { defineEventHandler, createError } from 'h3'
@@ -0,0 +1,356 @@
+"""
+模型索引：增量发现 runs/ 下的权重并缓存其元数据（/models 接口的数据来源）
+
+- 发现：记录 runs/ 下每个目录的 mtime。刷新时只 stat 已知目录，mtime 变化（有文件/子目录增删）的目录
+  才重新列出直接子项，新子目录递归扫描；不再每次 os.walk 整棵训练输出树。已知权重文件另外 stat，
+  原地覆盖（重新训练）时大小或 mtime 变化即重新读取。
+- 元数据：任务类型（det/seg/...）、类别名、训练 imgsz、SHA-256、文件大小，每个权重文件只读取一次
+  （.pt 经 Ultralytics 在 CPU 上加载 checkpoint，.onnx 读取导出时写入的 metadata）。
+- 持久化：web_data/model_index.json，重启后沿用目录 mtime 与元数据。
+- 触发：安装了 watchdog 时监听 runs/ 的变化；否则按间隔检查。刷新与元数据读取都在后台线程进行，
+  查询只读内存中的快照。
+
+用法（终端，手动重建索引并打印）:
+  python model_index.py
+"""
+import os
+import ast
+import json
+import time
+import uuid
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional, Sequence
+
+
+INDEX_VERSION = 1
+# Ultralytics 任务名 -> 接口中的简写
+TASK_NAMES = {'detect': 'det', 'segment': 'seg', 'classify': 'cls', 'pose': 'pose', 'obb': 'obb'}
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _normalize_names(names) -> Optional[List[str]]:
+    if isinstance(names, str):
+        names = ast.literal_eval(names)
+    if isinstance(names, dict):
+        return [str(names[k]) for k in sorted(names, key=int)]
+    if isinstance(names, (list, tuple)):
+        return [str(n) for n in names]
+    return None
+
+
+def _normalize_imgsz(imgsz):
+    if isinstance(imgsz, str):
+        imgsz = ast.literal_eval(imgsz)
+    if isinstance(imgsz, (list, tuple)):
+        imgsz = [int(v) for v in imgsz]
+        return imgsz[0] if len(set(imgsz)) == 1 else imgsz
+    return int(imgsz) if imgsz is not None else None
+
+
+def read_metadata(path: str) -> Dict:
+    """Task, class names and training imgsz stored in a weights file (lazy imports, CPU only)."""
+    if path.endswith('.onnx'):
+        import onnxruntime
+        session = onnxruntime.InferenceSession(path, providers=['CPUExecutionProvider'])
+        meta = session.get_modelmeta().custom_metadata_map
+        task, names, imgsz, date = meta.get('task'), meta.get('names'), meta.get('imgsz'), meta.get('date')
+    else:
+        from ultralytics.nn.tasks import guess_model_task, torch_safe_load
+        ckpt, _ = torch_safe_load(path)
+        model = ckpt.get('ema') or ckpt.get('model')
+        args = ckpt.get('train_args') or {}
+        task = args.get('task') or guess_model_task(model)
+        names, imgsz, date = getattr(model, 'names', None), args.get('imgsz'), ckpt.get('date')
+    names = _normalize_names(names)
+    return {
+        'task': TASK_NAMES.get(task, task),
+        'names': names,
+        'nc': len(names) if names is not None else None,
+        'imgsz': _normalize_imgsz(imgsz),
+        'trained_at': date,
+    }
+
+
+class ModelIndex:
+    """Persistent, incrementally refreshed index of the weights files offered by /models.
+
+    base_models are fixed key -> path entries (listed even while missing); weights named
+    in `discoverable` inside any runs/**/weights directory are discovered. entries() and
+    paths() only read the in-memory snapshot; `version` changes whenever it does.
+    """
+
+    def __init__(self, base_dir: str, index_path: str, base_models: Dict[str, str],
+                 discoverable: Sequence[str], refresh_seconds: float = 30.0,
+                 read_meta: Callable[[str], Dict] = read_metadata,
+                 on_error: Optional[Callable[[str, Exception], None]] = None):
+        self.base_dir = base_dir
+        self.runs_dir = os.path.join(base_dir, 'runs')
+        self.index_path = index_path
+        self.base_models = dict(base_models)
+        self.discoverable = tuple(discoverable)
+        self.refresh_seconds = refresh_seconds
+        self.read_meta = read_meta
+        self.on_error = on_error
+        self.version = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # 相对 base_dir 的目录 -> st_mtime_ns
+        self._dirs: Dict[str, int] = {}
+        # 模型键 -> {'size', 'mtime', 'sha256', 'task', 'names', 'nc', 'imgsz', ...}
+        self._models: Dict[str, Dict] = {}
+        self._snapshot: List[Dict] = []
+        self._paths: Dict[str, str] = {}
+        self._dirty = True
+        self._next_check = 0.0
+        self._worker: Optional[threading.Thread] = None
+        self._observer = None
+        self.stats = {'refreshes': 0, 'dirs_rescanned': 0, 'metadata_reads': 0, 'metadata_errors': 0}
+        self._load()
+
+    # ---- 持久化 ----
+
+    def _load(self) -> None:
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        if stored.get('version') != INDEX_VERSION:
+            return
+        self._dirs = {k: int(v) for k, v in (stored.get('dirs') or {}).items()}
+        self._models = stored.get('models') or {}
+        self._publish()
+
+    def _save(self) -> None:
+        with self._lock:
+            raw = json.dumps({'version': INDEX_VERSION, 'dirs': self._dirs, 'models': self._models},
+                             ensure_ascii=False)
+        tmp = f'{self.index_path}.{uuid.uuid4().hex[:8]}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(raw)
+            os.replace(tmp, self.index_path)
+        except OSError as e:
+            self._report(self.index_path, e)
+
+    def _report(self, path: str, e: Exception) -> None:
+        if self.on_error is not None:
+            self.on_error(path, e)
+
+    # ---- 查询（只读内存快照）----
+
+    def entries(self) -> List[Dict]:
+        return self._snapshot
+
+    def paths(self) -> Dict[str, str]:
+        return self._paths
+
+    def _publish(self) -> None:
+        with self._lock:
+            keys = list(self.base_models) + sorted(k for k in self._models if k not in self.base_models)
+            snapshot = []
+            for key in keys:
+                entry = self._models.get(key) or {}
+                snapshot.append({**entry, 'key': key, 'path': self._abs(key)})
+            self._snapshot = snapshot
+            self._paths = {item['key']: item['path'] for item in snapshot}
+            self.version += 1
+
+    def _abs(self, key: str) -> str:
+        return self.base_models.get(key) or os.path.join(self.base_dir, key)
+
+    def _rel(self, path: str) -> str:
+        # 统一为/分隔，便于前端使用
+        return os.path.relpath(path, self.base_dir).replace('\\', '/')
+
+    # ---- 刷新 ----
+
+    def invalidate(self) -> None:
+        """Force a rescan on the next maybe_refresh() (used by the file watcher)."""
+        self._dirty = True
+
+    def maybe_refresh(self) -> None:
+        """Start a background refresh when the interval has passed or a watcher fired; never blocks."""
+        now = time.monotonic()
+        if not self._dirty and now < self._next_check:
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._next_check = now + self.refresh_seconds
+            self._dirty = False
+            self._worker = threading.Thread(target=self.refresh, name='model-index', daemon=True)
+            self._worker.start()
+
+    def refresh(self, metadata: bool = True) -> None:
+        """Rescan changed directories, then read metadata of new or changed weights."""
+        with self._refresh_lock:
+            changed = self._scan()
+            self.stats['refreshes'] += 1
+            if changed:
+                self._publish()
+            if metadata:
+                changed = self._read_pending() or changed
+            if changed:
+                self._save()
+
+    def _scan(self) -> bool:
+        changed = False
+        stack: List[str] = []
+        # 已知目录只 stat；不存在的连同子目录与其中的权重一起移除
+        for rel, mtime in list(self._dirs.items()):
+            if rel not in self._dirs:
+                continue
+            try:
+                current = os.stat(os.path.join(self.base_dir, rel)).st_mtime_ns
+            except OSError:
+                self._drop_dir(rel)
+                changed = True
+                continue
+            if current != mtime:
+                stack.append(os.path.join(self.base_dir, rel))
+        if not self._dirs and os.path.isdir(self.runs_dir):
+            stack.append(self.runs_dir)
+
+        while stack:
+            path = stack.pop()
+            rel = self._rel(path)
+            try:
+                # 先取 mtime 再列目录：列目录期间的变化会让下次刷新再扫一遍
+                mtime = os.stat(path).st_mtime_ns
+                entries = list(os.scandir(path))
+            except OSError:
+                self._drop_dir(rel)
+                changed = True
+                continue
+            self.stats['dirs_rescanned'] += 1
+            self._dirs[rel] = mtime
+            changed = True
+            # 已删除的子目录在上面的 stat 中已移除，这里只需找出新增的
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False) and self._rel(entry.path) not in self._dirs:
+                    stack.append(entry.path)
+            if os.path.basename(path) == 'weights':
+                # 仅关注weights目录中的权重
+                present = {self._rel(os.path.join(path, e.name)) for e in entries
+                           if e.name in self.discoverable and e.is_file()}
+                for key in [k for k in self._models if os.path.dirname(k) == rel and k not in present]:
+                    del self._models[key]
+                for key in present:
+                    self._models.setdefault(key, {})
+
+        # 已知权重与基础模型只 stat 文件本身：原地覆盖不会改变目录 mtime
+        for key in list(self.base_models) + [k for k in self._models if k not in self.base_models]:
+            entry = self._models.get(key)
+            try:
+                st = os.stat(self._abs(key))
+            except OSError:
+                if key in self.base_models:
+                    if entry:
+                        self._models.pop(key, None)
+                        changed = True
+                    continue
+                self._models.pop(key, None)
+                changed = True
+                continue
+            if entry is None or entry.get('size') != st.st_size or entry.get('mtime') != st.st_mtime:
+                self._models[key] = {'size': st.st_size, 'mtime': st.st_mtime}
+                changed = True
+        return changed
+
+    def _drop_dir(self, rel: str) -> None:
+        prefix = rel + '/'
+        for d in [d for d in self._dirs if d == rel or d.startswith(prefix)]:
+            del self._dirs[d]
+        for key in [k for k in self._models if k.startswith(prefix)]:
+            del self._models[key]
+
+    def _read_pending(self) -> bool:
+        pending = [k for k, v in list(self._models.items()) if 'sha256' not in v]
+        for key in pending:
+            path = self._abs(key)
+            entry = dict(self._models.get(key) or {})
+            try:
+                entry['sha256'] = _sha256(path)
+            except OSError as e:
+                self._report(path, e)
+                continue
+            try:
+                entry.update(self.read_meta(path))
+                entry.pop('error', None)
+            except ImportError as e:
+                # 缺少 ultralytics/onnxruntime 是环境问题，不记入索引，下次刷新再读
+                self._report(path, e)
+                break
+            except Exception as e:
+                # 读取失败也记录下来，文件变化前不再重试
+                entry['error'] = str(e)
+                self.stats['metadata_errors'] += 1
+                self._report(path, e)
+            self.stats['metadata_reads'] += 1
+            with self._lock:
+                if key in self._models:
+                    self._models[key] = entry
+            self._publish()
+        return bool(pending)
+
+    # ---- 文件监听（可选依赖 watchdog）----
+
+    def start_watcher(self) -> bool:
+        """Watch runs/ with watchdog when it is installed; returns False otherwise."""
+        if self._observer is not None or not os.path.isdir(self.runs_dir):
+            return self._observer is not None
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            return False
+        index = self
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if getattr(event, 'is_directory', False) or os.path.basename(event.src_path) in index.discoverable:
+                    index.invalidate()
+
+        observer = Observer()
+        observer.schedule(_Handler(), self.runs_dir, recursive=True)
+        observer.daemon = True
+        observer.start()
+        self._observer = observer
+        return True
+
+    def snapshot(self) -> Dict:
+        return {
+            'models': len(self._snapshot),
+            'dirs': len(self._dirs),
+            'watching': self._observer is not None,
+            'refresh_seconds': self.refresh_seconds,
+            **self.stats,
+        }
+
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    base_models = {k: os.path.join(base_dir, k) for k in ('yolo11s.pt', 'yolo11n.pt')}
+    index = ModelIndex(base_dir, os.path.join(base_dir, 'web_data', 'model_index.json'), base_models,
+                       ('best.pt', 'best_int8.onnx'),
+                       on_error=lambda path, e: print(f"读取失败 {path}: {e}"))
+    t0 = time.perf_counter()
+    index.refresh()
+    print(f"索引刷新耗时 {time.perf_counter() - t0:.2f}s，目录 {index.snapshot()['dirs']} 个")
+    for item in index.entries():
+        names = ', '.join(item.get('names') or [])
+        print(f"{item['key']:<48}{str(item.get('task') or '-'):>6}{str(item.get('imgsz') or '-'):>8}  {names}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
+from __future__ import annotations
+
 import os
 import sys
+import math
+import time
 import argparse
 from pathlib import Path
 import shutil
@@ -163,6 +167,143 @@ def preprocess_image(img: np.ndarray, cfg: dict) -> tuple[np.ndarray, dict]:
     return out, info
 
 
+# ---- Fused fast path (online preprocessing in app.py) ----
+# Same output as preprocess_image, bit for bit: every per-pixel float32 expression of the
+# offline stages is evaluated once per possible uint8 value into a lookup table, and each
+# stage converts colour spaces once instead of splitting/merging and converting twice.
+
+
+def _value_lut(scale) -> np.ndarray:
+    # 与 `v = v.astype(np.float32); v *= scale; np.clip(v, 0, 255).astype(np.uint8)` 逐值相同
+    lut = np.arange(256, dtype=np.float32)
+    lut *= scale
+    return np.clip(lut, 0, 255).astype(np.uint8)
+
+
+def _white_balance_fast(img: np.ndarray) -> np.ndarray:
+    # 均值必须与 gray_world_white_balance 一样在 float32 副本上求（求和顺序决定末位舍入）
+    f = img.astype(np.float32)
+    avg_b, avg_g, avg_r = np.mean(f[:, :, 0]), np.mean(f[:, :, 1]), np.mean(f[:, :, 2])
+    del f
+    avg_gray = (avg_b + avg_g + avg_r) / 3.0
+    lut = np.empty((256, 3), dtype=np.float32)
+    lut[:] = np.arange(256, dtype=np.float32)[:, None]
+    lut[:, 0] *= (avg_gray / (avg_b + 1e-6))
+    lut[:, 1] *= (avg_gray / (avg_g + 1e-6))
+    lut[:, 2] *= (avg_gray / (avg_r + 1e-6))
+    lut = np.ascontiguousarray(np.clip(lut, 0, 255).astype(np.uint8).reshape(1, 256, 3))
+    return cv2.LUT(img, lut)
+
+
+def _clahe_fast(img: np.ndarray, clip_limit: float, tile_grid_size: int) -> np.ndarray:
+    lab = cv2.cvtColor(img, cv2.COLOR_BGR2Lab)
+    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(tile_grid_size, tile_grid_size))
+    lab = cv2.insertChannel(clahe.apply(cv2.extractChannel(lab, 0)), lab, 0)
+    return cv2.cvtColor(lab, cv2.COLOR_Lab2BGR)
+
+
+def _scale_v(hsv: np.ndarray, where: np.ndarray, scale) -> np.ndarray:
+    """HSV -> BGR with V multiplied by `scale` where `where` is non-zero."""
+    v = cv2.extractChannel(hsv, 2)
+    cv2.copyTo(cv2.LUT(v, _value_lut(scale)), where, v)
+    return cv2.cvtColor(cv2.insertChannel(v, hsv, 2), cv2.COLOR_HSV2BGR)
+
+
+def _de_reflection_fast(img: np.ndarray, dr_cfg: dict, info: dict) -> np.ndarray:
+    # highlight_mask_hsv 与 reduce_highlights 对同一张图各转一次 HSV，这里共用一次
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    v_lo = max(0, math.ceil(dr_cfg.get("v_thresh", 220)))
+    s_hi = min(255, math.floor(dr_cfg.get("s_thresh", 60)))
+    if v_lo > 255 or s_hi < 0:
+        mask = np.zeros(img.shape[:2], dtype=np.uint8)
+    else:
+        mask = cv2.inRange(hsv, (0, 0, v_lo), (255, s_hi, 255))
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+    mode = dr_cfg.get("mode", "dim")
+    if mode == "dim":
+        info["de_reflection"] = "dim"
+        return _scale_v(hsv, mask, float(dr_cfg.get("dim_ratio", 0.7)))
+    if mode == "inpaint":
+        info["de_reflection"] = "inpaint"
+        return inpaint_highlights(img, mask, radius=int(dr_cfg.get("inpaint_radius", 3)))
+    return img
+
+
+def _background_fast(img: np.ndarray, bg_cfg: dict) -> np.ndarray:
+    # simple_background_mask 与 apply_background_mask 共用一次 HSV 转换
+    method = bg_cfg.get("method", "none")
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+    s = cv2.extractChannel(hsv, 1)
+    if method == "sat_otsu":
+        _, m = cv2.threshold(s, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    else:
+        _, m = cv2.threshold(s, int(bg_cfg.get("sat_thresh", 50)), 255, cv2.THRESH_BINARY)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    m = cv2.morphologyEx(m, cv2.MORPH_OPEN, kernel, iterations=1)
+    m = cv2.morphologyEx(m, cv2.MORPH_CLOSE, kernel, iterations=1)
+    return _scale_v(hsv, cv2.bitwise_not(m), float(bg_cfg.get("strength", 0.6)))
+
+
+def preprocess_image_fast(img: np.ndarray, cfg: dict, timings: dict | None = None) -> tuple[np.ndarray, dict]:
+    """Latency-optimised preprocess_image with identical output and info.
+
+    When `timings` is given it receives the milliseconds spent in each enabled stage.
+    """
+    info = {}
+    out = img
+    clock = time.perf_counter()
+
+    def lap(stage: str) -> None:
+        nonlocal clock
+        now = time.perf_counter()
+        if timings is not None:
+            timings[stage] = round((now - clock) * 1000.0, 3)
+        clock = now
+
+    if cfg.get("white_balance", {}).get("enabled", True):
+        out = _white_balance_fast(out)
+        info["white_balance"] = True
+        lap("white_balance")
+
+    il_cfg = cfg.get("illumination", {})
+    if il_cfg.get("clahe", {}).get("enabled", True):
+        out = _clahe_fast(out, il_cfg.get("clahe", {}).get("clipLimit", 2.0), il_cfg.get("clahe", {}).get("tileGridSize", 8))
+        info["clahe"] = True
+        lap("clahe")
+    if il_cfg.get("retinex", {}).get("enabled", False):
+        out = msr_retinex(out, scales=il_cfg.get("retinex", {}).get("scales", [15, 80, 250]))
+        info["retinex"] = True
+        lap("retinex")
+
+    dr_cfg = cfg.get("de_reflection", {})
+    if dr_cfg.get("enabled", True):
+        out = _de_reflection_fast(out, dr_cfg, info)
+        lap("de_reflection")
+
+    bilateral_cfg = cfg.get("bilateral", {"enabled": True})
+    nlm_cfg = cfg.get("nlm", {"enabled": False})
+    if bilateral_cfg and bilateral_cfg.get("enabled", False):
+        out = cv2.bilateralFilter(out, int(bilateral_cfg.get("d", 9)), float(bilateral_cfg.get("sigmaColor", 75)),
+                                  float(bilateral_cfg.get("sigmaSpace", 75)))
+    if nlm_cfg and nlm_cfg.get("enabled", False):
+        out = cv2.fastNlMeansDenoisingColored(out, None, float(nlm_cfg.get("h", 7)), float(nlm_cfg.get("hColor", 7)),
+                                              int(nlm_cfg.get("templateWindowSize", 7)),
+                                              int(nlm_cfg.get("searchWindowSize", 21)))
+    info["denoise"] = True
+    lap("denoise")
+
+    bg_cfg = cfg.get("background", {"method": "none"})
+    if bg_cfg.get("method", "none") != "none":
+        out = _background_fast(out, bg_cfg)
+        info["background_mask"] = bg_cfg.get("method")
+        lap("background")
+
+    if out is img:
+        out = img.copy()
+    return out, info
+
+
 def load_config(cfg_path: Path | None) -> dict:
     default_cfg = {
         "white_balance": {"enabled": True},
@@ -239,12 +380,45 @@ def process_split(src_root: Path, dst_root: Path, split: str, cfg: dict, preview
     print(f"[Split {split}] processed images: {count}")
 
 
+def verify_fast(src_root: Path, cfg: dict, limit: int = 0) -> bool:
+    """Check preprocess_image_fast against preprocess_image on the dataset images and report speed."""
+    images = sorted(p for p in src_root.rglob("*") if p.is_file() and is_image_file(p))
+    if limit > 0:
+        images = images[:limit]
+    mismatched, slow_s, fast_s, checked = 0, 0.0, 0.0, 0
+    for img_p in images:
+        img = cv2.imread(str(img_p))
+        if img is None:
+            continue
+        t0 = time.perf_counter()
+        ref, ref_info = preprocess_image(img, cfg)
+        t1 = time.perf_counter()
+        out, info = preprocess_image_fast(img, cfg)
+        t2 = time.perf_counter()
+        slow_s += t1 - t0
+        fast_s += t2 - t1
+        checked += 1
+        if ref_info != info or ref.shape != out.shape or not np.array_equal(ref, out):
+            mismatched += 1
+            diff = int(np.abs(ref.astype(np.int16) - out.astype(np.int16)).max()) if ref.shape == out.shape else -1
+            print(f"[MISMATCH] {img_p} max abs diff {diff}")
+    if checked:
+        print(f"[VERIFY] {checked} images, mismatched {mismatched}; "
+              f"offline {slow_s / checked * 1000:.1f} ms/img, fast {fast_s / checked * 1000:.1f} ms/img")
+    else:
+        print(f"[VERIFY] no images under {src_root}")
+    return mismatched == 0
+
+
 def main():
     parser = argparse.ArgumentParser(description="Preprocess dataset images with configurable pipeline")
     parser.add_argument("--src", type=str, default="datasets", help="Source datasets directory")
     parser.add_argument("--dst", type=str, default="datasets_preprocessed", help="Destination datasets directory")
     parser.add_argument("--config", type=str, default="preprocess_config.yaml", help="YAML config path")
     parser.add_argument("--preview", action="store_true", help="Generate side-by-side preview")
+    parser.add_argument("--verify_fast", action="store_true",
+                        help="Compare the fused fast path with the offline pipeline on --src images, write nothing")
+    parser.add_argument("--limit", type=int, default=0, help="With --verify_fast: check at most this many images")
     args = parser.parse_args()
 
     src_root = Path(args.src).resolve()
@@ -255,8 +429,11 @@ def main():
         print(f"[ERROR] Source directory not found: {src_root}")
         sys.exit(1)
 
-    ensure_dir(dst_root)
     cfg = load_config(cfg_path)
+    if args.verify_fast:
+        sys.exit(0 if verify_fast(src_root, cfg, args.limit) else 1)
+
+    ensure_dir(dst_root)
 
     for split in ["train", "valid", "test"]:
         process_split(src_root, dst_root, split, cfg, preview=args.preview)
@@ -0,0 +1,184 @@
+"""
+检测记录存储（SQLite，WAL 模式）
+替代只追加的 web_data/results.csv：按时间、模型、文件名建立索引，支持分页查询与按模型/日期聚合。
+
+用法（终端，一次性导入历史 CSV）:
+  python result_store.py import web_data/results.csv
+可选参数:
+  --db  数据库路径，默认 web_data/results.db
+"""
+import os
+import csv
+import sqlite3
+import argparse
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+# 与 results.csv 表头保持一致的字段顺序
+COLUMNS = [
+    'timestamp', 'original_filename', 'saved_original_path', 'saved_output_path',
+    'width', 'height', 'count', 'area_ratio', 'avg_conf',
+    'model', 'conf', 'iou', 'imgsz', 'max_det'
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,            -- %Y%m%d-%H%M%S
+    day TEXT NOT NULL,                  -- %Y%m%d，按天聚合用
+    original_filename TEXT,
+    saved_original_path TEXT,
+    saved_output_path TEXT,
+    width INTEGER,
+    height INTEGER,
+    count INTEGER,
+    area_ratio REAL,
+    avg_conf REAL,
+    model TEXT,
+    conf REAL,
+    iou REAL,
+    imgsz INTEGER,
+    max_det INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_results_timestamp ON results(timestamp);
+CREATE INDEX IF NOT EXISTS idx_results_model_timestamp ON results(model, timestamp);
+CREATE INDEX IF NOT EXISTS idx_results_filename ON results(original_filename);
+-- 覆盖索引：按天/模型聚合时无需回表
+CREATE INDEX IF NOT EXISTS idx_results_day_model ON results(day, model, area_ratio);
+CREATE TABLE IF NOT EXISTS imported_files (
+    path TEXT PRIMARY KEY,
+    rows INTEGER NOT NULL,
+    imported_at TEXT NOT NULL DEFAULT (strftime('%Y%m%d-%H%M%S', 'now', 'localtime'))
+);
+"""
+
+_INSERT_SQL = (
+    f"INSERT INTO results (day, {', '.join(COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in range(len(COLUMNS) + 1))})"
+)
+
+MAX_PAGE_SIZE = 500
+
+
+def connect(db_path: str, durable: bool = False) -> sqlite3.Connection:
+    """Open the store in WAL mode; durable=True makes every commit fsync (synchronous=FULL)."""
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f"PRAGMA synchronous={'FULL' if durable else 'NORMAL'}")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def insert_rows(conn: sqlite3.Connection, rows: Iterable[Sequence]) -> int:
+    """Insert rows given in COLUMNS order in one transaction; returns the number inserted."""
+    values = [(str(row[0])[:8],) + tuple(row) for row in rows]
+    with conn:
+        conn.executemany(_INSERT_SQL, values)
+    return len(values)
+
+
+def _where(filters: Dict) -> Tuple[str, List]:
+    clauses, args = [], []
+    if filters.get('model'):
+        clauses.append('model = ?')
+        args.append(filters['model'])
+    if filters.get('filename'):
+        clauses.append('original_filename = ?')
+        args.append(filters['filename'])
+    if filters.get('since'):
+        clauses.append('timestamp >= ?')
+        args.append(filters['since'])
+    if filters.get('until'):
+        # until 为日期（YYYYMMDD）时包含当天全部记录
+        until = filters['until']
+        clauses.append('timestamp <= ?')
+        args.append(until + '-999999' if len(until) == 8 else until)
+    if filters.get('min_area_ratio') is not None:
+        clauses.append('area_ratio >= ?')
+        args.append(float(filters['min_area_ratio']))
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', args
+
+
+def query_results(conn: sqlite3.Connection, filters: Dict, page: int = 1, page_size: int = 50) -> Dict:
+    """Newest-first page of records matching the filters, plus the total match count."""
+    page = max(1, page)
+    page_size = max(1, min(MAX_PAGE_SIZE, page_size))
+    where, args = _where(filters)
+    total = conn.execute(f'SELECT COUNT(*) FROM results{where}', args).fetchone()[0]
+    rows = conn.execute(
+        f"SELECT id, {', '.join(COLUMNS)} FROM results{where} ORDER BY timestamp DESC, id DESC LIMIT ? OFFSET ?",
+        args + [page_size, (page - 1) * page_size],
+    ).fetchall()
+    return {'total': total, 'page': page, 'page_size': page_size, 'items': [dict(r) for r in rows]}
+
+
+def aggregate_results(conn: sqlite3.Connection, filters: Dict) -> List[Dict]:
+    """Record count and mean area_ratio per model per day."""
+    where, args = _where(filters)
+    rows = conn.execute(
+        f'SELECT day, model, COUNT(*) AS count, AVG(area_ratio) AS mean_area_ratio '
+        f'FROM results{where} GROUP BY day, model ORDER BY day DESC, model',
+        args,
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def import_csv(conn: sqlite3.Connection, csv_path: str, batch_size: int = 5000) -> Optional[int]:
+    """One-time import of a legacy results.csv; returns None if the file was imported before.
+
+    All rows and the imported_files marker are written in a single transaction, so a
+    failure part-way leaves nothing behind and a rerun imports the file from scratch.
+    """
+    key = os.path.abspath(csv_path)
+    total = 0
+    with conn:
+        if conn.execute('SELECT 1 FROM imported_files WHERE path = ?', (key,)).fetchone():
+            return None
+        with open(csv_path, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            batch = []
+            for record in reader:
+                batch.append((str(record.get('timestamp'))[:8],) + tuple(record.get(col) for col in COLUMNS))
+                # 分批 executemany 只为限制内存，提交在整个文件导入完成后统一进行
+                if len(batch) >= batch_size:
+                    conn.executemany(_INSERT_SQL, batch)
+                    total += len(batch)
+                    batch = []
+            if batch:
+                conn.executemany(_INSERT_SQL, batch)
+                total += len(batch)
+        conn.execute('INSERT INTO imported_files (path, rows) VALUES (?, ?)', (key, total))
+    return total
+
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    db_default = os.path.join(base_dir, "web_data", "results.db")
+    # --db 既可写在子命令前也可写在子命令后；子命令上用 SUPPRESS，未给出时不覆盖顶层默认值
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--db", type=str, default=argparse.SUPPRESS, help=f"数据库路径，默认 {db_default}")
+    parser = argparse.ArgumentParser(description="检测记录存储（SQLite）维护工具")
+    parser.add_argument("--db", type=str, default=db_default, help="数据库路径")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", parents=[common], help="一次性导入历史 results.csv")
+    imp.add_argument("csv", nargs="+", help="CSV 文件路径")
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    if args.command == "import":
+        for csv_path in args.csv:
+            if not os.path.exists(csv_path):
+                print(f"[WARN] 文件不存在，跳过: {csv_path}")
+                continue
+            count = import_csv(conn, csv_path)
+            if count is None:
+                print(f"[Import] 已导入过，跳过: {csv_path}")
+            else:
+                print(f"[Import] {csv_path}: {count} 行")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
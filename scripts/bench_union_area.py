@@ -0,0 +1,125 @@
+"""
+面积比例计算基准：对比 app.py 旧版“整幅掩膜涂色”实现与 union_area.py 新引擎的耗时与结果差异。
+
+用法（终端）:
+  python scripts/bench_union_area.py --width 8000 --height 6000 --count 300
+可选参数:
+  --repeat     每种实现的重复次数，取中位数，默认 5
+  --max_pixels 多边形栅格化画布像素上限（同 AREA_RASTER_MAX_PIXELS），默认 2048*2048
+  --seed       随机种子，默认 0
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import union_area  # noqa: E402
+
+
+# ---- 旧实现（与改造前的 app.py 保持一致，仅作对照） ----
+
+def legacy_box_ratio(xyxy, img_shape):
+    h, w = img_shape
+    mask = np.zeros((h, w), dtype=np.uint8)
+    for x1, y1, x2, y2 in xyxy:
+        x1i = max(0, min(int(np.floor(x1)), w - 1))
+        y1i = max(0, min(int(np.floor(y1)), h - 1))
+        x2i = max(0, min(int(np.ceil(x2)), w))
+        y2i = max(0, min(int(np.ceil(y2)), h))
+        if x2i <= x1i or y2i <= y1i:
+            continue
+        mask[y1i:y2i, x1i:x2i] = 255
+    return min(1.0, float(int((mask > 0).sum())) / float(max(1, w * h)))
+
+
+def legacy_polygon_ratio(xy_list, img_shape):
+    h, w = img_shape
+    mask_union = np.zeros((h, w), dtype=np.uint8)
+    for pts in xy_list:
+        poly = np.array(pts, dtype=np.int32)
+        poly[:, 0] = np.clip(poly[:, 0], 0, w - 1)
+        poly[:, 1] = np.clip(poly[:, 1], 0, h - 1)
+        cv2.fillPoly(mask_union, [poly], 255)
+    return min(1.0, float(int((mask_union > 0).sum())) / float(max(1, w * h)))
+
+
+def legacy_mask_ratio(masks_np, img_shape):
+    h, w = img_shape
+    union_small = (masks_np > 0.5).any(axis=0).astype(np.uint8)
+    union = cv2.resize(union_small, (w, h), interpolation=cv2.INTER_NEAREST)
+    return min(1.0, float(int((union > 0).sum())) / float(max(1, w * h)))
+
+
+# ---- 合成数据 ----
+
+def make_boxes(rng, w, h, n):
+    cx, cy = rng.uniform(0, w, n), rng.uniform(0, h, n)
+    bw, bh = rng.uniform(20, w / 8, n), rng.uniform(20, h / 8, n)
+    return np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1).astype(np.float32)
+
+
+def make_polygons(rng, boxes, vertices=40):
+    polys = []
+    t = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    for x1, y1, x2, y2 in boxes:
+        r = rng.uniform(0.6, 1.0, vertices)
+        cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+        rx, ry = (x2 - x1) / 2, (y2 - y1) / 2
+        polys.append(np.stack([cx + rx * r * np.cos(t), cy + ry * r * np.sin(t)], axis=1).astype(np.float32))
+    return polys
+
+
+def make_masks(rng, boxes, w, h, mh=160, mw=160):
+    masks = np.zeros((len(boxes), mh, mw), dtype=np.float32)
+    for i, (x1, y1, x2, y2) in enumerate(boxes):
+        masks[i, max(0, int(y1 / h * mh)):int(y2 / h * mh), max(0, int(x1 / w * mw)):int(x2 / w * mw)] = 1.0
+    return masks
+
+
+def bench(fn, *args, repeat=5):
+    times, value = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        value = fn(*args)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times) * 1000.0, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="面积比例计算基准（旧实现 vs union_area）")
+    parser.add_argument("--width", type=int, default=8000)
+    parser.add_argument("--height", type=int, default=6000)
+    parser.add_argument("--count", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max_pixels", type=int, default=union_area.DEFAULT_MAX_PIXELS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    shape = (args.height, args.width)
+    boxes = make_boxes(rng, args.width, args.height, args.count)
+    polys = make_polygons(rng, boxes)
+    masks = make_masks(rng, boxes, args.width, args.height)
+
+    cases = [
+        ("boxes", legacy_box_ratio, union_area.box_union_area_ratio, (boxes, shape), ()),
+        ("polygons", legacy_polygon_ratio, union_area.polygon_union_area_ratio, (polys, shape), (args.max_pixels,)),
+        ("polygons@full", legacy_polygon_ratio, union_area.polygon_union_area_ratio, (polys, shape), (0,)),
+        ("masks", legacy_mask_ratio, union_area.mask_union_area_ratio, (masks, shape), ()),
+    ]
+    print(f"[Bench] image={args.width}x{args.height}, detections={args.count}, repeat={args.repeat}")
+    print(f"{'case':<14}{'legacy ms':>12}{'new ms':>10}{'speedup':>9}{'legacy':>10}{'new':>10}{'abs err':>11}")
+    for name, legacy, new, common, extra in cases:
+        t_old, v_old = bench(legacy, *common, repeat=args.repeat)
+        t_new, v_new = bench(new, *(common + extra), repeat=args.repeat)
+        print(f"{name:<14}{t_old:>12.2f}{t_new:>10.2f}{t_old / max(t_new, 1e-9):>8.1f}x"
+              f"{v_old:>10.5f}{v_new:>10.5f}{abs(v_old - v_new):>11.2e}")
+
+
+if __name__ == "__main__":
+    main()
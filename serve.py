@@ -0,0 +1,127 @@
+"""
+生产环境启动器：预加载模型后 fork 出多个服务进程，模型权重以写时复制（copy-on-write）方式共享
+
+用法（终端，Linux/macOS）:
+  MODEL_PRELOAD=yolo11s.pt python serve.py --processes 4 --host 0.0.0.0 --port 8000
+可选参数:
+  --processes  服务进程数，默认 CPU 核数的一半（至少 1）
+  --host       监听地址，默认 127.0.0.1
+  --port       监听端口，默认 8000
+
+流程:
+  1. 主进程导入 app（DEFER_BACKGROUND=1，不启动 worker 池与调度线程），加载 MODEL_PRELOAD 中的权重并融合 Conv+BN；
+  2. 创建监听 socket，gc.freeze() 后 fork 出各服务进程，子进程共享同一 socket 接受连接；
+  3. 每个子进程各自启动 worker 池、调度线程并预热（线程不会被 fork 继承），torch 线程数按 进程数×WORKER_COUNT 均分 CPU 核；
+  4. 主进程只负责监督：子进程异常退出时重新 fork，收到 SIGTERM/SIGINT 时通知子进程退出。
+
+每个服务进程有自己的调度队列与准入限额；任务状态经 web_data/jobs 在进程间共享，
+任一进程都能查询 /jobs/<id> 与订阅 /jobs/events。Windows 上没有 fork，退化为单进程运行。
+"""
+import os
+import gc
+import sys
+import time
+import signal
+import argparse
+
+
+def _serve_child(app_module, server, index: int) -> None:
+    def _exit(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, _exit)
+    signal.signal(signal.SIGINT, _exit)
+    code = 0
+    try:
+        app_module.start_background(index)
+        server.serve_forever()
+    except SystemExit:
+        pass
+    except Exception:
+        app_module.app.logger.exception('服务进程 %d 异常退出', index)
+        code = 1
+    finally:
+        # os._exit 不执行 atexit，先关闭 worker 池（进程 worker 退出时各自刷盘）并把后台写盘队列刷完
+        try:
+            app_module.stop_background()
+        finally:
+            os._exit(code)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预fork多进程服务")
+    parser.add_argument("--processes", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    processes = max(1, args.processes) if hasattr(os, 'fork') else 1
+    os.environ['SERVE_PROCESSES'] = str(processes)
+    os.environ['DEFER_BACKGROUND'] = '1'
+    try:
+        # 主进程只加载权重不推理；不让 torch 在 fork 前建立多线程池（fork 后的子进程无法使用）
+        import torch
+        torch.set_num_threads(1)
+    except Exception:
+        pass
+    import app as app_module
+    from werkzeug.serving import make_server
+
+    server = make_server(args.host, args.port, app_module.app, threaded=True)
+    if not hasattr(os, 'fork'):
+        print("当前平台不支持 fork，以单进程运行")
+        app_module.start_background()
+        server.serve_forever()
+        return
+
+    t0 = time.perf_counter()
+    app_module.preload_weights()
+    print(f"已预加载 {len(app_module.app.config['MODEL_PRELOAD'])} 个模型，耗时 {time.perf_counter() - t0:.1f}s")
+    # 之后的垃圾回收不再触碰已有对象，避免引用计数/GC标记写脏共享页
+    gc.collect()
+    gc.freeze()
+
+    children = {}
+
+    def spawn(index: int) -> None:
+        pid = os.fork()
+        if pid == 0:
+            _serve_child(app_module, server, index)
+        children[pid] = index
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for i in range(processes):
+        spawn(i)
+    print(f"已启动 {processes} 个服务进程，监听 http://{args.host}:{args.port}/")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is None or stopping:
+            continue
+        print(f"服务进程 {pid}（#{index}）退出，状态 {status}，1 秒后重启", file=sys.stderr)
+        time.sleep(1)
+        if not stopping:
+            spawn(index)
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
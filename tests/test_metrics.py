@@ -0,0 +1,65 @@
+import pytest
+
+import metrics
+
+
+def test_registry_render_exposition_format():
+    registry = metrics.Registry()
+    requests = registry.counter('app_requests_total', 'Requests served', ('route', 'status'))
+    latency = registry.histogram('app_latency_seconds', 'Request latency', ('route',), buckets=(0.1, 1.0))
+    registry.callback('app_queue_depth', 'Jobs waiting', lambda: 3)
+    registry.callback('app_cache_entries', 'Cache entries per tier',
+                      lambda: [({'tier': 'memory'}, 2), ({'tier': 'disk'}, 5.5)], ('tier',))
+
+    requests.inc(route='/detect', status=200)
+    requests.inc(2, route='/detect', status=200)
+    requests.inc(route='/enqueue', status=429)
+    latency.observe(0.05, route='/detect')
+    latency.observe(0.1, route='/detect')
+    latency.observe(3.0, route='/detect')
+
+    assert registry.render() == '\n'.join([
+        '# HELP app_requests_total Requests served',
+        '# TYPE app_requests_total counter',
+        'app_requests_total{route="/detect",status="200"} 3',
+        'app_requests_total{route="/enqueue",status="429"} 1',
+        '# HELP app_latency_seconds Request latency',
+        '# TYPE app_latency_seconds histogram',
+        'app_latency_seconds_bucket{route="/detect",le="0.1"} 2',
+        'app_latency_seconds_bucket{route="/detect",le="1"} 2',
+        'app_latency_seconds_bucket{route="/detect",le="+Inf"} 3',
+        'app_latency_seconds_sum{route="/detect"} 3.15',
+        'app_latency_seconds_count{route="/detect"} 3',
+        '# HELP app_queue_depth Jobs waiting',
+        '# TYPE app_queue_depth gauge',
+        'app_queue_depth 3',
+        '# HELP app_cache_entries Cache entries per tier',
+        '# TYPE app_cache_entries gauge',
+        'app_cache_entries{tier="memory"} 2',
+        'app_cache_entries{tier="disk"} 5.5',
+    ]) + '\n'
+
+
+def test_label_values_are_escaped():
+    registry = metrics.Registry()
+    registry.counter('c_total', 'c', ('name',)).inc(name='a"b\\c\nd')
+    assert 'c_total{name="a\\"b\\\\c\\nd"} 1' in registry.render().splitlines()
+
+
+def test_failing_callback_is_skipped_and_reported():
+    registry = metrics.Registry()
+    registry.callback('broken', 'Raises', lambda: 1 / 0)
+    registry.callback('ok', 'Works', lambda: 1, kind='counter')
+    errors = []
+    text = registry.render(on_error=lambda name, e: errors.append((name, type(e))))
+    assert text == '# HELP ok Works\n# TYPE ok counter\nok 1\n'
+    assert errors == [('broken', ZeroDivisionError)]
+
+
+def test_wrong_labels_and_duplicate_names_are_rejected():
+    registry = metrics.Registry()
+    counter = registry.counter('x_total', 'x', ('route',))
+    with pytest.raises(ValueError):
+        counter.inc(method='GET')
+    with pytest.raises(ValueError):
+        registry.counter('x_total', 'again')
@@ -0,0 +1,77 @@
+import copy
+
+import cv2
+import numpy as np
+import pytest
+
+import preprocess
+
+
+def _synthetic_image(seed=0, h=240, w=320):
+    """Textured colour image with saturated and specular (high V, low S) regions."""
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+    img = cv2.GaussianBlur(img, (7, 7), 0)
+    cv2.rectangle(img, (20, 20), (120, 100), (30, 60, 200), -1)
+    cv2.circle(img, (220, 150), 40, (250, 250, 250), -1)
+    cv2.ellipse(img, (100, 190), (50, 20), 15, 0, 360, (240, 245, 255), -1)
+    return img
+
+
+def _config(**overrides):
+    cfg = preprocess.load_config(None)
+    for key, value in overrides.items():
+        if isinstance(value, dict):
+            cfg[key].update(value)
+        else:
+            cfg[key] = value
+    return cfg
+
+
+CONFIGS = {
+    'default': {},
+    'inpaint': {'de_reflection': {'mode': 'inpaint', 'inpaint_radius': 5}},
+    'retinex': {'illumination': {'retinex': {'enabled': True, 'scales': [5, 15]},
+                                 'clahe': {'enabled': True, 'clipLimit': 3.0, 'tileGridSize': 4}}},
+    'sat_otsu': {'background': {'method': 'sat_otsu', 'strength': 0.5}},
+    'sat_thresh': {'background': {'method': 'sat_thresh', 'sat_thresh': 80}},
+    'nlm': {'bilateral': {'enabled': False}, 'nlm': {'enabled': True}},
+    'all_off': {'white_balance': {'enabled': False}, 'illumination': {'clahe': {'enabled': False}},
+                'de_reflection': {'enabled': False}, 'bilateral': {'enabled': False}},
+}
+
+
+@pytest.mark.parametrize('name', sorted(CONFIGS))
+def test_fast_path_matches_offline_pipeline(name):
+    cfg = _config(**copy.deepcopy(CONFIGS[name]))
+    img = _synthetic_image()
+    before = img.copy()
+    ref, ref_info = preprocess.preprocess_image(img, cfg)
+    timings = {}
+    out, info = preprocess.preprocess_image_fast(img, cfg, timings)
+    assert info == ref_info
+    assert out.dtype == ref.dtype and np.array_equal(out, ref)
+    # 输入不被修改，且输出不与输入共享内存
+    assert np.array_equal(img, before) and not np.shares_memory(out, img)
+    assert set(timings) <= {'white_balance', 'clahe', 'retinex', 'de_reflection', 'denoise', 'background'}
+
+
+def test_verify_fast_on_synthetic_dataset(tmp_path, capsys):
+    images = tmp_path / 'train' / 'images'
+    images.mkdir(parents=True)
+    for seed in range(3):
+        cv2.imwrite(str(images / f'{seed}.png'), _synthetic_image(seed))
+    (images / 'notes.txt').write_text('not an image')
+    assert preprocess.verify_fast(tmp_path, _config(), limit=2)
+    assert '[VERIFY] 2 images, mismatched 0' in capsys.readouterr().out
+
+
+def test_verify_fast_reports_mismatch(tmp_path, monkeypatch, capsys):
+    images = tmp_path / 'images'
+    images.mkdir()
+    cv2.imwrite(str(images / 'a.png'), _synthetic_image())
+    real = preprocess.preprocess_image_fast
+    monkeypatch.setattr(preprocess, 'preprocess_image_fast',
+                        lambda img, cfg: (lambda out, info: (out ^ 1, info))(*real(img, cfg)))
+    assert not preprocess.verify_fast(tmp_path, _config())
+    assert '[MISMATCH]' in capsys.readouterr().out
@@ -0,0 +1,110 @@
+import csv
+import sqlite3
+import sys
+
+import pytest
+
+import result_store
+
+
+def _row(timestamp, filename='a.jpg', model='yolo11n.pt', area_ratio=0.5):
+    return {
+        'timestamp': timestamp, 'original_filename': filename, 'saved_original_path': 'u.jpg',
+        'saved_output_path': 'o.jpg', 'width': 640, 'height': 480, 'count': 2, 'area_ratio': area_ratio,
+        'avg_conf': 0.8, 'model': model, 'conf': 0.25, 'iou': 0.7, 'imgsz': 640, 'max_det': 300,
+    }
+
+
+def _write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=result_store.COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = result_store.connect(str(tmp_path / 'results.db'))
+    yield conn
+    conn.close()
+
+
+def test_import_csv_once_and_query(conn, tmp_path):
+    csv_path = tmp_path / 'results.csv'
+    _write_csv(csv_path, [
+        _row('20260101-080000', 'a.jpg', 'm1.pt', 0.1),
+        _row('20260101-090000', 'b.jpg', 'm2.pt', 0.3),
+        _row('20260102-100000', 'c.jpg', 'm1.pt', 0.5),
+    ])
+    assert result_store.import_csv(conn, str(csv_path), batch_size=2) == 3
+    # 同一文件再次导入直接跳过
+    assert result_store.import_csv(conn, str(csv_path)) is None
+
+    page = result_store.query_results(conn, {}, page=1, page_size=2)
+    assert page['total'] == 3
+    assert [r['original_filename'] for r in page['items']] == ['c.jpg', 'b.jpg']
+    assert [r['original_filename'] for r in result_store.query_results(conn, {}, page=2, page_size=2)['items']] == ['a.jpg']
+
+    assert result_store.query_results(conn, {'model': 'm1.pt'})['total'] == 2
+    assert result_store.query_results(conn, {'filename': 'b.jpg'})['total'] == 1
+    assert result_store.query_results(conn, {'until': '20260101'})['total'] == 2
+    assert result_store.query_results(conn, {'since': '20260102'})['total'] == 1
+    assert result_store.query_results(conn, {'min_area_ratio': 0.3})['total'] == 2
+
+    agg = result_store.aggregate_results(conn, {})
+    assert [(r['day'], r['model'], r['count']) for r in agg] == [
+        ('20260102', 'm1.pt', 1), ('20260101', 'm1.pt', 1), ('20260101', 'm2.pt', 1)]
+
+
+class _FailingConnection:
+    """Connection proxy whose n-th executemany raises, to interrupt an import part-way."""
+
+    def __init__(self, conn, fail_at):
+        self._conn = conn
+        self._fail_at = fail_at
+        self.calls = 0
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def execute(self, *args):
+        return self._conn.execute(*args)
+
+    def executemany(self, *args):
+        self.calls += 1
+        if self.calls == self._fail_at:
+            raise sqlite3.OperationalError('disk I/O error')
+        return self._conn.executemany(*args)
+
+
+def test_import_csv_failure_leaves_nothing_behind(conn, tmp_path):
+    csv_path = tmp_path / 'results.csv'
+    _write_csv(csv_path, [_row(f'20260101-0800{i:02d}') for i in range(5)])
+    # 第二批写入失败：第一批也应回滚，且不记录为已导入
+    with pytest.raises(sqlite3.OperationalError):
+        result_store.import_csv(_FailingConnection(conn, fail_at=2), str(csv_path), batch_size=2)
+    assert conn.execute('SELECT COUNT(*) FROM results').fetchone()[0] == 0
+    assert conn.execute('SELECT COUNT(*) FROM imported_files').fetchone()[0] == 0
+
+    # 重跑后记录不重复
+    assert result_store.import_csv(conn, str(csv_path), batch_size=2) == 5
+    assert conn.execute('SELECT COUNT(*) FROM results').fetchone()[0] == 5
+
+
+@pytest.mark.parametrize('db_first', [True, False])
+def test_main_accepts_db_before_or_after_subcommand(tmp_path, monkeypatch, db_first):
+    csv_path = tmp_path / 'results.csv'
+    db_path = tmp_path / 'cli.db'
+    _write_csv(csv_path, [_row('20260101-080000')])
+    args = ['import', str(csv_path)]
+    args = ['--db', str(db_path)] + args if db_first else args + ['--db', str(db_path)]
+    monkeypatch.setattr(sys, 'argv', ['result_store.py'] + args)
+    result_store.main()
+    conn = result_store.connect(str(db_path))
+    try:
+        assert result_store.query_results(conn, {})['total'] == 1
+    finally:
+        conn.close()
@@ -0,0 +1,77 @@
+import numpy as np
+import cv2
+
+import tiling
+
+
+def _square(x0, y0, size):
+    return np.array([[x0, y0], [x0 + size, y0], [x0 + size, y0 + size], [x0, y0 + size]], dtype=np.float32)
+
+
+def _filled(polys, shape=(200, 300)):
+    canvas = np.zeros(shape, dtype=np.uint8)
+    for p in polys:
+        cv2.fillPoly(canvas, [np.round(p).astype(np.int32)], 255)
+    return canvas > 0
+
+
+def _tile_result(xyxy, conf, cls, polys):
+    # 切片结果只需提供 merge 用到的 Ultralytics Results 接口子集，TiledResult 本身即满足
+    return tiling.TiledResult(None, {0: 'rust'},
+                              tiling.TiledBoxes(np.array(xyxy, dtype=np.float32), np.array(conf), np.array(cls)),
+                              tiling.TiledMasks(polys), 1)
+
+
+def test_tile_windows_cover_image_with_equal_tiles():
+    windows = tiling.tile_windows(1000, 1500, 640, 0.2)
+    assert all(x2 - x1 == 640 and y2 - y1 == 640 for x1, y1, x2, y2 in windows)
+    assert max(x2 for _, _, x2, _ in windows) == 1500 and max(y2 for _, _, _, y2 in windows) == 1000
+    assert tiling.tile_windows(300, 400, 640, 0.2) == [(0, 0, 400, 300)]
+
+
+def test_union_polygon_keeps_disjoint_pieces():
+    a, b = _square(10, 10, 30), _square(80, 60, 20)
+    ring = tiling._union_polygon([a, b], np.array([10, 10, 100, 80], dtype=np.float32))
+    merged = _filled([ring])
+    expected = _filled([a, b])
+    # 零宽连接线只在两块之间多出一条细线，两块本身必须完整保留
+    assert merged[expected].all()
+    assert merged.sum() - expected.sum() < 100
+
+
+def test_union_polygon_of_overlapping_pieces_is_single_outline():
+    a, b = _square(10, 10, 40), _square(30, 30, 40)
+    ring = tiling._union_polygon([a, b], np.array([10, 10, 70, 70], dtype=np.float32))
+    assert np.array_equal(_filled([ring]), _filled([a, b]))
+
+
+def test_merge_joins_detection_cut_at_tile_seam_into_one():
+    # 同一目标被两个切片截断：切片 A 看到左上一块，切片 B（x 偏移 50）看到右下一块，两块互不相连
+    left, right = _square(50, 10, 20), _square(80, 30, 20)
+    part_a = _tile_result([[50, 10, 100, 50]], [0.9], [0], [left])
+    part_b = _tile_result([[10, 10, 50, 50]], [0.8], [0], [right - (50, 0)])
+    merged = tiling.merge(np.zeros((200, 300, 3), dtype=np.uint8),
+                          [((0, 0, 100, 100), part_a), ((50, 0, 150, 100), part_b)], iou_thr=0.9)
+    assert len(merged.boxes) == 1
+    assert merged.boxes.xyxy.cpu().numpy().tolist() == [[50, 10, 100, 50]]
+    assert merged.boxes.conf.cpu().numpy().tolist() == [np.float32(0.9)]
+    ring = merged.masks.xy[0]
+    assert _filled([ring])[_filled([left, right])].all()
+
+
+def test_merge_suppresses_duplicates_and_keeps_other_classes():
+    box = [[20, 20, 60, 60]]
+    part_a = _tile_result(box, [0.9], [0], [_square(20, 20, 40)])
+    part_b = _tile_result([[0, 20, 40, 60]], [0.7], [0], [_square(0, 20, 40)])
+    part_c = _tile_result([[0, 20, 40, 60]], [0.6], [1], [_square(0, 20, 40)])
+    merged = tiling.merge(np.zeros((100, 200, 3), dtype=np.uint8),
+                          [((0, 0, 100, 100), part_a), ((20, 0, 120, 100), part_b), ((20, 0, 120, 100), part_c)],
+                          iou_thr=0.5)
+    assert sorted(merged.boxes.cls.cpu().numpy().tolist()) == [0.0, 1.0]
+    assert len(merged.masks.xy) == 2
+
+
+def test_merge_without_detections():
+    empty = tiling.TiledResult(None, {0: 'rust'}, tiling.TiledBoxes(np.zeros((0, 4)), np.zeros(0), np.zeros(0)), None, 1)
+    merged = tiling.merge(np.zeros((10, 10, 3), dtype=np.uint8), [((0, 0, 10, 10), empty)], iou_thr=0.5)
+    assert len(merged.boxes) == 0 and merged.masks is None and merged.tiles == 1
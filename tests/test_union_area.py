@@ -0,0 +1,61 @@
+import importlib.util
+import os
+
+import numpy as np
+import pytest
+
+import union_area
+
+# 旧版整幅掩膜实现保存在基准脚本中，直接复用作对照
+_BENCH_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts', 'bench_union_area.py')
+_spec = importlib.util.spec_from_file_location('bench_union_area', _BENCH_PATH)
+bench = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench)
+
+W, H = 1600, 1200
+SHAPE = (H, W)
+
+
+@pytest.fixture(params=[0, 1, 2])
+def boxes(request):
+    rng = np.random.default_rng(request.param)
+    return bench.make_boxes(rng, W, H, 80)
+
+
+def test_box_union_matches_legacy_exactly(boxes):
+    assert union_area.box_union_area_ratio(boxes, SHAPE) == bench.legacy_box_ratio(boxes, SHAPE)
+
+
+def test_box_union_edge_cases():
+    assert union_area.box_union_area_ratio(None, SHAPE) == 0.0
+    assert union_area.box_union_area_ratio(np.zeros((0, 4)), SHAPE) == 0.0
+    # 超出画面与退化的框按旧实现的取整/裁剪规则处理
+    odd = np.array([[-50, -50, 10.2, 10.7], [W - 5, H - 5, W + 100, H + 100], [30, 30, 30, 80]], dtype=np.float32)
+    assert union_area.box_union_area_ratio(odd, SHAPE) == bench.legacy_box_ratio(odd, SHAPE)
+    full = np.array([[0, 0, W, H], [10, 10, 20, 20]], dtype=np.float32)
+    assert union_area.box_union_area_ratio(full, SHAPE) == 1.0
+
+
+def test_mask_union_matches_legacy_exactly(boxes):
+    masks = bench.make_masks(np.random.default_rng(0), boxes, W, H)
+    assert union_area.mask_union_area_ratio(masks, SHAPE) == bench.legacy_mask_ratio(masks, SHAPE)
+
+
+def test_polygon_union_full_resolution_matches_legacy_exactly(boxes):
+    polys = bench.make_polygons(np.random.default_rng(0), boxes)
+    assert union_area.polygon_union_area_ratio(polys, SHAPE, max_pixels=0) == bench.legacy_polygon_ratio(polys, SHAPE)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_polygon_union_downscaled_within_tolerance(seed):
+    # 6000×4000 时多边形外接矩形超过默认画布上限，走缩小绘制分支；模块文档承诺误差不超过 1e-3
+    w, h = 6000, 4000
+    rng = np.random.default_rng(seed)
+    polys = bench.make_polygons(rng, bench.make_boxes(rng, w, h, 100))
+    approx = union_area.polygon_union_area_ratio(polys, (h, w))
+    assert abs(approx - bench.legacy_polygon_ratio(polys, (h, w))) <= 1e-3
+
+
+def test_polygon_union_empty():
+    assert union_area.polygon_union_area_ratio([], SHAPE) == 0.0
+    assert union_area.polygon_union_area_ratio([np.zeros((0, 2))], SHAPE) == 0.0
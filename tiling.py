@@ -0,0 +1,192 @@
+"""
+高分辨率图像的切片（tiled）推理：切片窗口划分与跨切片结果合并
+
+- tile_windows：按 tile_size 与重叠比例划分窗口，末行/末列窗口向内对齐，保证切片尺寸一致。
+- merge：把各切片结果平移回原图坐标后按类别做跨切片合并：
+    * 与更高置信度框 IoU 超过 iou_thr 的重复检测（重叠区被两个切片同时检出）直接抑制；
+    * 来自不同切片、交集占较小框比例（IoS）超过 match_thr 的检测视为被切片边界截断的同一目标，
+      合并为外接框，多边形取并集（互不相连的部分以零宽连接线并入同一多边形，面积不丢失）。
+  返回与 Ultralytics Results 接口兼容的 TiledResult（boxes.xyxy/conf/cls、masks.xy、names、plot()），
+  可直接用于 app.py 中的统计、结构化结果与可视化。
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import cv2
+
+import detections
+
+
+def tile_windows(h: int, w: int, tile_size: int, overlap: float) -> List[Tuple[int, int, int, int]]:
+    """(x1, y1, x2, y2) windows covering an h×w image with the given overlap ratio."""
+    step = max(1, int(tile_size * (1.0 - overlap)))
+
+    def starts(length: int) -> List[int]:
+        if length <= tile_size:
+            return [0]
+        pos = list(range(0, length - tile_size + 1, step))
+        if pos[-1] + tile_size < length:
+            pos.append(length - tile_size)
+        return pos
+
+    return [(x, y, min(x + tile_size, w), min(y + tile_size, h)) for y in starts(h) for x in starts(w)]
+
+
+class _Array:
+    """numpy array exposing the .cpu().numpy() chain used on Ultralytics tensors."""
+
+    def __init__(self, data: np.ndarray):
+        self.data = data
+
+    def cpu(self) -> '_Array':
+        return self
+
+    def numpy(self) -> np.ndarray:
+        return self.data
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+class TiledBoxes:
+    def __init__(self, xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray):
+        self.xyxy = _Array(xyxy.reshape(-1, 4).astype(np.float32))
+        self.conf = _Array(conf.astype(np.float32))
+        self.cls = _Array(cls.astype(np.float32))
+
+    def __len__(self) -> int:
+        return len(self.xyxy)
+
+
+class TiledMasks:
+    # 只提供原图坐标下的多边形；没有逐像素 data
+    data = None
+
+    def __init__(self, xy: List[np.ndarray]):
+        self.xy = xy
+
+
+class TiledResult:
+    """Merged whole-image result with the subset of the Ultralytics Results API the app uses."""
+
+    def __init__(self, orig_bgr: np.ndarray, names: Dict, boxes: TiledBoxes,
+                 masks: Optional[TiledMasks], tiles: int):
+        self.orig_img = orig_bgr
+        self.names = names
+        self.boxes = boxes
+        self.masks = masks
+        self.tiles = tiles
+
+    def plot(self) -> np.ndarray:
+        """Annotated BGR image, like Results.plot() on a BGR input."""
+        det = detections.extract(self, self.orig_img.shape[:2], poly_epsilon=0)
+        return detections.render(self.orig_img, det)
+
+
+def _pairwise(box: np.ndarray, others: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """IoU and intersection-over-smaller of one box against many."""
+    ix1 = np.maximum(box[0], others[:, 0])
+    iy1 = np.maximum(box[1], others[:, 1])
+    ix2 = np.minimum(box[2], others[:, 2])
+    iy2 = np.minimum(box[3], others[:, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (others[:, 2] - others[:, 0]) * (others[:, 3] - others[:, 1])
+    iou = inter / np.maximum(area + areas - inter, 1e-9)
+    ios = inter / np.maximum(np.minimum(area, areas), 1e-9)
+    return iou, ios
+
+
+def _bridge(ring: np.ndarray, piece: np.ndarray) -> np.ndarray:
+    """Join a disjoint outline into ring through a zero-width slit between their closest points."""
+    d = ((ring[:, None, :].astype(np.int64) - piece[None, :, :]) ** 2).sum(axis=2)
+    i, j = np.unravel_index(int(np.argmin(d)), d.shape)
+    return np.concatenate([ring[:i + 1], piece[j:], piece[:j + 1], ring[i:]])
+
+
+def _union_polygon(polys: Sequence[np.ndarray], box: np.ndarray) -> np.ndarray:
+    """Outline of the union of polygons, rasterized inside their merged box.
+
+    A detection cut at a tile seam can merge into pieces that do not touch; they are
+    kept as one ring joined by zero-width slits, so filling the polygon (area ratio,
+    masks) still covers every piece while each detection keeps a single polygon.
+    """
+    x0, y0 = int(np.floor(box[0])), int(np.floor(box[1]))
+    bw = max(1, int(np.ceil(box[2])) - x0 + 1)
+    bh = max(1, int(np.ceil(box[3])) - y0 + 1)
+    canvas = np.zeros((bh, bw), dtype=np.uint8)
+    for p in polys:
+        if len(p) >= 3:
+            cv2.fillPoly(canvas, [np.round(p - (x0, y0)).astype(np.int32)], 255)
+    contours, _ = cv2.findContours(canvas, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return np.zeros((0, 2), dtype=np.float32)
+    pieces = sorted((c.reshape(-1, 2) for c in contours), key=cv2.contourArea, reverse=True)
+    ring = pieces[0]
+    for piece in pieces[1:]:
+        ring = _bridge(ring, piece)
+    return (ring + (x0, y0)).astype(np.float32)
+
+
+def merge(orig_bgr: np.ndarray, parts: Sequence[Tuple[Tuple[int, int, int, int], object]],
+          iou_thr: float, match_thr: float = 0.6, max_det: int = 300) -> TiledResult:
+    """Merge per-tile Ultralytics results (window, result) into one whole-image result."""
+    xyxy, conf, cls, tile_ids, polys = [], [], [], [], []
+    names: Dict = {}
+    has_masks = False
+    for tile_id, ((x0, y0, _, _), res) in enumerate(parts):
+        names = names or dict(getattr(res, 'names', None) or {})
+        boxes = res.boxes
+        if boxes is None or boxes.xyxy is None or len(boxes) == 0:
+            continue
+        b = boxes.xyxy.cpu().numpy().astype(np.float32) + np.array([x0, y0, x0, y0], dtype=np.float32)
+        xyxy.append(b)
+        conf.append(boxes.conf.cpu().numpy().astype(np.float32))
+        cls.append(boxes.cls.cpu().numpy().astype(np.float32))
+        tile_ids.append(np.full(len(b), tile_id))
+        masks_obj = getattr(res, 'masks', None)
+        if masks_obj is not None and getattr(masks_obj, 'xy', None) is not None:
+            has_masks = True
+            polys.extend(np.asarray(p, dtype=np.float32).reshape(-1, 2) + (x0, y0) for p in masks_obj.xy)
+        else:
+            polys.extend(np.zeros((0, 2), dtype=np.float32) for _ in range(len(b)))
+
+    if not xyxy:
+        empty = np.zeros((0,), dtype=np.float32)
+        return TiledResult(orig_bgr, names, TiledBoxes(empty, empty, empty),
+                           TiledMasks([]) if has_masks else None, len(parts))
+
+    xyxy_all, conf_all = np.concatenate(xyxy), np.concatenate(conf)
+    cls_all, tile_all = np.concatenate(cls), np.concatenate(tile_ids)
+    order = np.argsort(-conf_all, kind='stable')
+    alive = np.ones(len(order), dtype=bool)
+    out_boxes, out_conf, out_cls, out_polys = [], [], [], []
+    for rank, i in enumerate(order):
+        if not alive[i]:
+            continue
+        alive[i] = False
+        rest = order[rank + 1:]
+        rest = rest[alive[rest] & (cls_all[rest] == cls_all[i])]
+        box = xyxy_all[i].copy()
+        members = [i]
+        if len(rest):
+            iou, ios = _pairwise(xyxy_all[i], xyxy_all[rest])
+            duplicate = iou > iou_thr
+            # 被切片边界截断的同一目标：来自其他切片且大部分落在当前框内
+            cut = (~duplicate) & (ios > match_thr) & (tile_all[rest] != tile_all[i])
+            for j in rest[cut]:
+                members.append(j)
+                box[:2] = np.minimum(box[:2], xyxy_all[j][:2])
+                box[2:] = np.maximum(box[2:], xyxy_all[j][2:])
+            alive[rest[duplicate | cut]] = False
+        out_boxes.append(box)
+        out_conf.append(conf_all[i])
+        out_cls.append(cls_all[i])
+        if has_masks:
+            out_polys.append(polys[i] if len(members) == 1 else _union_polygon([polys[m] for m in members], box))
+        if len(out_boxes) >= max_det:
+            break
+
+    masks = TiledMasks(out_polys) if has_masks else None
+    return TiledResult(orig_bgr, names, TiledBoxes(np.array(out_boxes), np.array(out_conf), np.array(out_cls)),
+                       masks, len(parts))
@@ -17,11 +17,18 @@ YOLO11 训练脚本（Python 接口）
   --patience 早停耐心值（验证指标无提升的连续轮次阈值），默认 20
   --freeze   冻结前 N 层进行微调（可选），默认不冻结
   --resume   从当前权重的训练状态继续（仅当提供 last.pt 时更适用）
+  --quantize_int8 对 --weights 指定的 best.pt 做 INT8 训练后量化（ONNX Runtime），并在 test 集对比精度
+  --calib_dir     量化校准图片目录（默认取 --data 中的 train 图片目录）
+  --calib_images  校准图片数量上限，默认 200
+  --max_map_drop  允许的 mAP@0.50 最大下降（绝对值），超过则不发布量化模型，默认 0.01
 """
 import argparse
 import sys
 import os
 import re
+import glob
+import random
+import shutil
 
 try:
     import torch
@@ -99,6 +106,201 @@ def save_report(text, report_path):
         print(f"[WARN] 评估报告保存失败: {e}")
 
 
+def evaluate_test_split(weights, args, name, task=None, project="runs"):
+    """
+    在 test 集评估指定权重（.pt 或导出的 .onnx），返回 (eval_results, eval_model)。
+    """
+    eval_model = YOLO(weights, task=task) if task else YOLO(weights)
+    eval_results = eval_model.val(
+        data=args.data,
+        split="test",
+        imgsz=args.imgsz,
+        batch=args.batch,
+        device=args.device,
+        workers=0,
+        project=project,
+        name=name
+    )
+    return eval_results, eval_model
+
+
+def map50_of(eval_results):
+    """
+    取 mAP@0.50：分割模型优先使用掩膜指标，否则使用检测框指标。
+    """
+    for attr in ("seg", "box"):
+        metric = getattr(eval_results, attr, None)
+        map50 = getattr(metric, "map50", None) if metric is not None else None
+        if map50 is not None:
+            return float(map50)
+    return None
+
+
+def eval_metrics(eval_results):
+    """
+    整体指标字典 {map50, map5095, precision, recall}：与 map50_of 相同，分割模型优先使用掩膜指标。
+    """
+    for attr in ("seg", "box"):
+        metric = getattr(eval_results, attr, None)
+        if metric is None or getattr(metric, "map50", None) is None:
+            continue
+        values = {"map50": getattr(metric, "map50", None), "map5095": getattr(metric, "map", None),
+                  "precision": getattr(metric, "mp", None), "recall": getattr(metric, "mr", None)}
+        return {k: (float(v) if v is not None else None) for k, v in values.items()}
+    return {"map50": None, "map5095": None, "precision": None, "recall": None}
+
+
+def resolve_split_images(data_yaml, split):
+    """
+    从数据集配置解析指定划分（train/val/test）的图片目录（兼容 path 字段与相对路径写法）。
+    """
+    import yaml
+    with open(data_yaml, "r", encoding="utf-8") as f:
+        cfg = yaml.safe_load(f) or {}
+    root = cfg.get("path") or os.path.dirname(os.path.abspath(data_yaml))
+    if not os.path.isabs(root):
+        root = os.path.join(os.path.dirname(os.path.abspath(data_yaml)), root)
+    entry = cfg.get(split, f"{split}/images")
+    entry = entry[0] if isinstance(entry, (list, tuple)) else entry
+    split_dir = entry if os.path.isabs(entry) else os.path.normpath(os.path.join(root, entry))
+    if not os.path.isdir(split_dir):
+        # 兼容 ../train/images 一类写法在 datasets/ 下的实际位置
+        alt = os.path.join(os.path.dirname(os.path.abspath(data_yaml)), split, "images")
+        if os.path.isdir(alt):
+            return alt
+    return split_dir
+
+
+def resolve_train_images(data_yaml):
+    """
+    从数据集配置解析 train 图片目录。
+    """
+    return resolve_split_images(data_yaml, "train")
+
+
+def letterbox_for_calib(img, imgsz):
+    """
+    与 Ultralytics 推理一致的 letterbox：等比缩放 + 居中灰边填充，输出 1x3xHxW float32（RGB, 0-1）。
+    """
+    import numpy as np
+    h, w = img.shape[:2]
+    r = min(imgsz / h, imgsz / w)
+    nh, nw = int(round(h * r)), int(round(w * r))
+    if (nh, nw) != (h, w):
+        img = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    top = (imgsz - nh) // 2
+    left = (imgsz - nw) // 2
+    canvas = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    canvas[top:top + nh, left:left + nw] = img
+    blob = canvas[:, :, ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+    return np.ascontiguousarray(blob)
+
+
+def quantize_int8(args):
+    """
+    INT8 训练后静态量化：
+      1) 将 best.pt 导出为 FP32 ONNX；
+      2) 用 train 集图片做校准，生成 QDQ 格式 INT8 模型；
+      3) 在 test 集分别评估 FP32 与 INT8；
+      4) mAP@0.50 下降不超过 --max_map_drop 时才发布为 <weights目录>/best_int8.onnx（Web 端会自动发现）。
+    """
+    try:
+        import onnx
+        from onnxruntime.quantization import (
+            CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType, quantize_static
+        )
+    except Exception as e:
+        print(f"[ERROR] INT8 量化需要 onnx 与 onnxruntime: {e}")
+        print("请安装: pip install onnx onnxruntime")
+        sys.exit(1)
+
+    if not os.path.exists(args.weights):
+        print(f"[ERROR] 指定权重不存在: {args.weights}")
+        sys.exit(1)
+    weights_dir = os.path.dirname(os.path.abspath(args.weights))
+    stem = os.path.splitext(os.path.basename(args.weights))[0]
+
+    # 1) 导出 FP32 ONNX（动态 batch 与尺寸：服务端会合批、切片成批推理，请求的 imgsz 也可能与训练尺寸不同）
+    fp32_model = YOLO(args.weights)
+    task = fp32_model.task
+    fp32_path = fp32_model.export(format="onnx", imgsz=args.imgsz, dynamic=True, simplify=True)
+    print(f"[Quant] FP32 ONNX 导出完成: {fp32_path} (task={task})")
+
+    # 2) 校准数据
+    calib_dir = args.calib_dir or resolve_train_images(args.data)
+    images = [p for p in glob.glob(os.path.join(calib_dir, "**", "*"), recursive=True)
+              if os.path.splitext(p)[1].lower() in {".jpg", ".jpeg", ".png", ".bmp", ".webp"}]
+    if not images:
+        print(f"[ERROR] 校准目录中没有图片: {calib_dir}")
+        sys.exit(1)
+    random.Random(0).shuffle(images)
+    images = images[:args.calib_images]
+    print(f"[Quant] 校准图片: {len(images)} 张（来自 {calib_dir}）")
+
+    input_name = onnx.load(fp32_path, load_external_data=False).graph.input[0].name
+
+    class _TrainImageReader(CalibrationDataReader):
+        def __init__(self, paths):
+            self._paths = iter(paths)
+
+        def get_next(self):
+            for p in self._paths:
+                img = cv2.imread(p)
+                if img is not None:
+                    return {input_name: letterbox_for_calib(img, args.imgsz)}
+            return None
+
+    int8_tmp = os.path.join(weights_dir, f"{stem}_int8.tmp.onnx")
+    quantize_static(
+        fp32_path, int8_tmp, _TrainImageReader(images),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        calibrate_method=CalibrationMethod.MinMax,
+    )
+    # 保留 Ultralytics 的 metadata（task、names、imgsz 等），推理端依赖它们
+    fp32_proto = onnx.load(fp32_path)
+    int8_proto = onnx.load(int8_tmp)
+    del int8_proto.metadata_props[:]
+    int8_proto.metadata_props.extend(fp32_proto.metadata_props)
+    onnx.save(int8_proto, int8_tmp)
+    print(f"[Quant] INT8 量化完成: {int8_tmp}")
+
+    # 3) test 集评估对比（量化模型只在 CPU 上有意义）
+    args.device = "cpu"
+    args.batch = 1
+    fp32_results, _ = evaluate_test_split(fp32_path, args, f"{stem}_fp32_test", task=task)
+    int8_results, int8_eval_model = evaluate_test_split(int8_tmp, args, f"{stem}_int8_test", task=task)
+    fp32_map50 = map50_of(fp32_results)
+    int8_map50 = map50_of(int8_results)
+    if fp32_map50 is None or int8_map50 is None:
+        print("[ERROR] 未获取到 mAP@0.50，无法判断量化精度，放弃发布。")
+        os.remove(int8_tmp)
+        sys.exit(1)
+    drop = fp32_map50 - int8_map50
+    lines = [
+        "[Quant] INT8 量化精度对比（test 集）",
+        f"  weights: {args.weights}",
+        f"  FP32 mAP@0.50: {fp32_map50:.4f}",
+        f"  INT8 mAP@0.50: {int8_map50:.4f}",
+        f"  下降: {drop:.4f}（阈值 {args.max_map_drop:.4f}）",
+    ]
+
+    # 4) 精度闸门
+    if drop > args.max_map_drop:
+        lines.append("  结论: 未通过，不发布量化模型。")
+        print("\n".join(lines))
+        os.remove(int8_tmp)
+        sys.exit(2)
+    published = os.path.join(weights_dir, "best_int8.onnx")
+    shutil.move(int8_tmp, published)
+    lines.append(f"  结论: 通过，已发布 {published}")
+    report_text = "\n".join(lines) + "\n\n" + format_eval_report(int8_results, int8_eval_model)
+    print(report_text)
+    save_report(report_text, args.report_out or os.path.join(weights_dir, "int8_report.txt"))
+
+
 def main():
     parser = argparse.ArgumentParser(description="YOLO11 训练入口")
     parser.add_argument("--weights", type=str, default="yolo11n.pt", help="预训练权重路径")
@@ -116,6 +318,10 @@ def main():
     parser.add_argument("--freeze", type=int, default=None, help="冻结前 N 层进行微调（可选）")
     parser.add_argument("--resume", action="store_true", help="从当前权重的训练状态继续（仅当提供 last.pt 时更适用）")
     parser.add_argument("--name_suffix", type=str, default="", help="为输出 run 名称追加后缀，便于对比（例如 _preproc）")
+    parser.add_argument("--quantize_int8", action="store_true", help="对 --weights 做 INT8 训练后量化，并经 test 集精度闸门后发布")
+    parser.add_argument("--calib_dir", type=str, default=None, help="量化校准图片目录（默认取 --data 中的 train 图片目录）")
+    parser.add_argument("--calib_images", type=int, default=200, help="校准图片数量上限")
+    parser.add_argument("--max_map_drop", type=float, default=0.01, help="允许的 mAP@0.50 最大下降（绝对值）")
     args = parser.parse_args()
 
     cuda_available = torch.cuda.is_available()
@@ -155,6 +361,12 @@ def main():
         _model_tag = None
     train_name = (f"rust_{_model_tag}_train" if _model_tag else "rust_custom_train") + (args.name_suffix or "")
     test_name = (f"rust_{_model_tag}_train_test" if _model_tag else "rust_custom_train_test") + (args.name_suffix or "")
+    # INT8 量化模式
+    if args.quantize_int8:
+        print("[Quant] 进入 INT8 量化模式（不训练）...")
+        quantize_int8(args)
+        return
+
     # 仅评估模式
     if args.eval_only:
         print("[EvalOnly] 进入仅评估模式（不训练）...")
@@ -162,17 +374,7 @@ def main():
             if not os.path.exists(args.weights):
                 print(f"[ERROR] 指定权重不存在: {args.weights}")
                 sys.exit(1)
-            eval_model = YOLO(args.weights)
-            eval_results = eval_model.val(
-                data=args.data,
-                split="test",
-                imgsz=args.imgsz,
-                batch=args.batch,
-                device=args.device,
-                workers=0,
-                project="runs",
-                name=test_name
-            )
+            eval_results, eval_model = evaluate_test_split(args.weights, args, test_name)
             print(eval_results)
             # 整理与保存报告
             report_text = format_eval_report(eval_results, eval_model)
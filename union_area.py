@@ -0,0 +1,122 @@
+"""
+检测框 / 分割掩膜并集面积比例的计算引擎（不分配整幅原图大小的掩膜）
+
+- box_union_area_ratio：坐标压缩 + 二维差分。与“在 h×w 掩膜上逐框涂色再计数”的旧实现逐像素等价（误差为 0），
+  内存与耗时只取决于检测数量（max_det=300 时网格不超过 600×600）。
+- mask_union_area_ratio：在掩膜原生分辨率上求并集，按最近邻缩放的行/列复制次数解析地换算到原图像素数，
+  与“先 cv2.resize(INTER_NEAREST) 到原图再计数”的旧实现等价（误差为 0）。
+- polygon_union_area_ratio：只在多边形并集的外接矩形内栅格化；外接矩形不超过 max_pixels 时按原分辨率绘制，
+  与旧实现等价；超过时按比例缩小并用亚像素坐标绘制，再对边界像素做偏差校正，
+  默认 max_pixels 下与旧实现的面积比例绝对误差不超过 1e-3（画布越小误差越大；8000×6000、300 个目标实测约 2e-4，
+  可用 scripts/bench_union_area.py 复测）。
+"""
+from typing import Iterable, Optional, Tuple
+
+import numpy as np
+import cv2
+
+
+# 多边形栅格化画布像素上限（约 2048×2048）
+DEFAULT_MAX_PIXELS = 2048 * 2048
+# fillPoly 亚像素精度：坐标放大 2**_SHIFT 倍后取整
+_SHIFT = 4
+# fillPoly 会把压在边界上的像素整格计入；缩小绘制时这部分被放大 1/scale 倍。
+# 按 (1 - scale) * _EDGE_BIAS * 边界像素数 扣除，系数由 bench_union_area.py 标定
+_EDGE_BIAS = 0.4
+
+
+def box_union_area_ratio(xyxy: Optional[np.ndarray], img_shape: Tuple[int, int]) -> float:
+    """Exact pixel-union area ratio of boxes, computed on a compressed coordinate grid."""
+    h, w = img_shape
+    if xyxy is None or len(xyxy) == 0:
+        return 0.0
+    boxes = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+    # 与逐像素涂色相同的取整与裁剪规则
+    x1 = np.clip(np.floor(boxes[:, 0]), 0, w - 1).astype(np.int64)
+    y1 = np.clip(np.floor(boxes[:, 1]), 0, h - 1).astype(np.int64)
+    x2 = np.clip(np.ceil(boxes[:, 2]), 0, w).astype(np.int64)
+    y2 = np.clip(np.ceil(boxes[:, 3]), 0, h).astype(np.int64)
+    keep = (x2 > x1) & (y2 > y1)
+    if not keep.any():
+        return 0.0
+    x1, y1, x2, y2 = x1[keep], y1[keep], x2[keep], y2[keep]
+
+    xs = np.unique(np.concatenate([x1, x2]))
+    ys = np.unique(np.concatenate([y1, y2]))
+    ix1, ix2 = np.searchsorted(xs, x1), np.searchsorted(xs, x2)
+    iy1, iy2 = np.searchsorted(ys, y1), np.searchsorted(ys, y2)
+
+    # 二维差分：每个框在压缩网格上 +1，前缀和后 >0 的格子即被覆盖
+    diff = np.zeros((len(ys) + 1, len(xs) + 1), dtype=np.int32)
+    np.add.at(diff, (iy1, ix1), 1)
+    np.add.at(diff, (iy1, ix2), -1)
+    np.add.at(diff, (iy2, ix1), -1)
+    np.add.at(diff, (iy2, ix2), 1)
+    covered = diff.cumsum(axis=0).cumsum(axis=1)[:len(ys) - 1, :len(xs) - 1] > 0
+    cell_area = np.diff(ys)[:, None] * np.diff(xs)[None, :]
+    area = int(cell_area[covered].sum())
+    return min(1.0, float(area) / float(max(1, w * h)))
+
+
+def _nearest_repeats(src: int, dst: int) -> np.ndarray:
+    """How many destination pixels each source pixel covers under cv2 INTER_NEAREST resizing."""
+    idx = np.floor(np.arange(dst) * (1.0 / (dst / src))).astype(np.int64)
+    return np.bincount(np.minimum(idx, src - 1), minlength=src).astype(np.int64)
+
+
+def mask_union_area_ratio(masks: np.ndarray, img_shape: Tuple[int, int], threshold: float = 0.5) -> float:
+    """Union area ratio of (N, mh, mw) masks, evaluated at native mask resolution."""
+    h, w = img_shape
+    if masks is None or masks.ndim != 3 or masks.shape[0] == 0:
+        return 0.0
+    union_small = (masks > threshold).any(axis=0)
+    mh, mw = union_small.shape[:2]
+    if (mh, mw) == (h, w):
+        covered = int(np.count_nonzero(union_small))
+    else:
+        rows = _nearest_repeats(mh, h)
+        cols = _nearest_repeats(mw, w)
+        covered = int(rows @ union_small.astype(np.int64) @ cols)
+    return min(1.0, float(covered) / float(max(1, w * h)))
+
+
+def polygon_union_area_ratio(polygons: Iterable[np.ndarray], img_shape: Tuple[int, int],
+                             max_pixels: int = DEFAULT_MAX_PIXELS) -> float:
+    """Union area ratio of pixel-coordinate polygons, rasterized only inside their joint bounding box."""
+    h, w = img_shape
+    polys = [np.asarray(p, dtype=np.float64).reshape(-1, 2) for p in polygons if p is not None and len(p) > 0]
+    if not polys:
+        return 0.0
+    pts = np.concatenate(polys)
+    bx0 = int(np.clip(np.floor(pts[:, 0].min()), 0, w - 1))
+    by0 = int(np.clip(np.floor(pts[:, 1].min()), 0, h - 1))
+    bx1 = int(np.clip(np.ceil(pts[:, 0].max()), 0, w - 1)) + 1
+    by1 = int(np.clip(np.ceil(pts[:, 1].max()), 0, h - 1)) + 1
+    bw, bh = bx1 - bx0, by1 - by0
+
+    if max_pixels <= 0 or bw * bh <= max_pixels:
+        # 原分辨率：与整幅掩膜上 fillPoly 的取整/裁剪规则一致，只是画布缩小到外接矩形
+        canvas = np.zeros((bh, bw), dtype=np.uint8)
+        for poly in polys:
+            p = poly.astype(np.int32)
+            p[:, 0] = np.clip(p[:, 0], 0, w - 1) - bx0
+            p[:, 1] = np.clip(p[:, 1], 0, h - 1) - by0
+            # 逐个填充：一次传入多个多边形时重叠区域会按奇偶规则被挖空
+            cv2.fillPoly(canvas, [p], 255)
+        covered = float(np.count_nonzero(canvas))
+        return min(1.0, covered / float(max(1, w * h)))
+
+    # 缩小绘制：每个画布像素代表 1/scale² 个原图像素
+    scale = float(np.sqrt(max_pixels / float(bw * bh)))
+    cw, ch = max(1, int(np.ceil(bw * scale))), max(1, int(np.ceil(bh * scale)))
+    canvas = np.zeros((ch, cw), dtype=np.uint8)
+    factor = scale * (1 << _SHIFT)
+    for poly in polys:
+        p = np.empty_like(poly)
+        p[:, 0] = (np.clip(poly[:, 0], 0, w - 1) - bx0) * factor
+        p[:, 1] = (np.clip(poly[:, 1], 0, h - 1) - by0) * factor
+        cv2.fillPoly(canvas, [np.round(p).astype(np.int32)], 255, lineType=cv2.LINE_8, shift=_SHIFT)
+    filled = np.count_nonzero(canvas)
+    edge = filled - np.count_nonzero(cv2.erode(canvas, np.ones((3, 3), dtype=np.uint8)))
+    covered = (filled - _EDGE_BIAS * (1.0 - scale) * edge) / (scale * scale)
+    return min(1.0, covered / float(max(1, w * h)))